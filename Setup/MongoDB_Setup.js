@@ -6,18 +6,26 @@ use emotional_diary_db
 // Tạo collections
 db.createCollection("users")
 db.createCollection("entries")
-db.createCollection("emotions")
+db.createCollection("emotion")
 
-// Tạo indexes cho tối ưu hiệu năng
-db.entries.createIndex({ "content": "text" })  // Full-text search index
-db.entries.createIndex({ "user_id": 1 })       // Query by user
-db.entries.createIndex({ "date": -1 })         // Sort by date
-db.emotions.createIndex({ "user_id": 1 })      // Query by user
-db.emotions.createIndex({ "entry_id": 1 })     // Query by entry
-db.emotions.createIndex({ 
+// Tạo indexes cho tối ưu hiệu năng (giống khai báo trong indexes.py; `python indexes.py ensure`
+// tạo index còn thiếu, kiểm tra query plan bằng `python indexes.py check`)
+db.users.createIndex({ "username": 1 }, { name: "username_unique", unique: true })  // Login/register
+db.entries.createIndex({ "content": "text" }, { name: "content_text" })  // Full-text search index
+db.entries.createIndex({ "user_id": 1, "date": -1, "_id": -1 }, { name: "user_date_id" })  // /entries, export, from/to
+db.entries.createIndex({ "user_id": 1, "is_negative": 1, "date": -1 }, { name: "user_negative_date" })  // Negative insights
+db.entries.createIndex({ "updated_at": 1 }, { name: "updated_at", sparse: true })  // Incremental backups
+db.emotion.createIndex({ 
     "user_id": 1, 
     "entry_id": 1 
-}, { unique: true })                           // Unique compound index
+}, { name: "user_entry_unique", unique: true })  // Unique compound index
+db.emotion.createIndex({ "entry_id": 1 }, { name: "entry_id" })  // Query by entry
+db.emotion.createIndex({ "updated_at": 1 }, { name: "updated_at", sparse: true })  // Incremental backups
+db.sentiment_jobs.createIndex({ "entry_id": 1 }, { name: "entry_id_unique", unique: true })  // One job per entry
+db.sentiment_jobs.createIndex({ "status": 1, "queued_at": 1 }, { name: "status_queued" })  // Worker claims
+db.sentiment_jobs.createIndex({ "claim": 1 }, { name: "claim" })
+db.sentiment_cache.createIndex({ "version": 1 }, { name: "version" })
+db.sentiment_daily.createIndex({ "user_id": 1, "date": 1 }, { name: "user_date_unique", unique: true })  // Daily sentiment rollups
 
 // Validator cho collection users
 db.runCommand({
@@ -72,9 +80,9 @@ db.runCommand({
     }
 })
 
-// Validator cho collection emotions
+// Validator cho collection emotion
 db.runCommand({
-    collMod: "emotions",
+    collMod: "emotion",
     validator: {
         $jsonSchema: {
             bsonType: "object",
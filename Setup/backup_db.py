@@ -1,38 +1,206 @@
-import os
+"""
+Backup MongoDB bằng Python: các collection được đọc song song và ghi thành các chunk
+BSON nén gzip, kèm manifest.json ghi số document và SHA-256 của từng chunk.
+
+    python backup_db.py                  # incremental nếu đã có backup trước đó, không thì full
+    python backup_db.py --full --keep 5
+    python backup_db.py --full-every 7   # full sau mỗi 7 bản incremental (mặc định)
+
+Backup incremental chỉ ghi các document có _id (ObjectId) hoặc updated_at mới hơn lúc
+backup trước bắt đầu, cộng với danh sách _id hiện có để restore bỏ qua document đã bị
+xóa. Khi chuỗi incremental dựa trên bản full gần nhất đã đủ full_every bản, lần chạy mặc
+định tự chuyển sang full, nhờ đó retention (giữ keep chuỗi gần nhất) có bản cũ để xóa. Các collection dẫn xuất (rollup, term index, hàng đợi, cache, version) không được
+backup: restore_db.py dựng lại chúng cho các user được khôi phục.
+"""
+import argparse
 import datetime
-import subprocess
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
-def create_backup():
-    # Tạo thư mục backup nếu chưa tồn tại
-    backup_dir = Path("backups")
+from bson.codec_options import CodecOptions
+from bson.objectid import ObjectId
+from bson.raw_bson import RawBSONDocument
+from pymongo import MongoClient
+
+DEFAULT_URI = "mongodb://localhost:27017/emotional_diary_db"
+BACKUP_PREFIX = "emotional_diary_backup_"
+MANIFEST = "manifest.json"
+# incremental: theo _id/updated_at; full: luôn ghi toàn bộ (collection nhỏ)
+BACKUP_COLLECTIONS = {
+    "users": "incremental",
+    "entries": "incremental",
+    "emotion": "incremental",
+    "schema_migrations": "full",
+}
+
+
+#============================================================================================
+def load_manifest(path):
+    manifest = Path(path) / MANIFEST
+    if not manifest.exists():
+        return None
+    return json.loads(manifest.read_text())
+
+
+def load_chain(path):
+    """Backup được chọn và các bản nó dựa vào, mới trước cũ sau: [(path, manifest)]."""
+    path = Path(path)
+    chain = []
+    while True:
+        manifest = load_manifest(path)
+        if not manifest:
+            raise ValueError(f"{path} is not a complete backup (no manifest)")
+        chain.append((path, manifest))
+        if not manifest["base"]:
+            return chain
+        path = path.parent / manifest["base"]
+
+
+def list_backups(backup_dir):
+    """Các backup đã hoàn tất (có manifest), cũ trước mới sau: [(path, manifest)]."""
+    backups = []
+    for path in sorted(Path(backup_dir).glob(BACKUP_PREFIX + "*")):
+        manifest = load_manifest(path)
+        if manifest:
+            backups.append((path, manifest))
+    return backups
+
+
+def incremental_query(since):
+    """Document mới (theo thời điểm trong ObjectId) hoặc bị sửa (updated_at) từ since."""
+    return {"$or": [
+        {"_id": {"$gte": ObjectId.from_datetime(since)}},
+        {"updated_at": {"$gte": since}}
+    ]}
+
+
+def write_chunk(path, docs):
+    data = gzip.compress(b"".join(docs), compresslevel=6)
+    tmp = path.with_suffix(".tmp")
+    tmp.write_bytes(data)
+    tmp.replace(path)
+    return {"file": path.name, "documents": len(docs), "sha256": hashlib.sha256(data).hexdigest()}
+
+
+def dump(collection, query, directory, prefix, pool, limiter, chunk_size, projection=None):
+    """Đọc cursor theo lô và giao việc nén/ghi từng chunk cho pool. Trả về danh sách future."""
+    directory.mkdir(parents=True, exist_ok=True)
+    futures = []
+    docs = []
+
+    def submit():
+        # Giới hạn số chunk đang chờ ghi để không giữ quá nhiều dữ liệu trong bộ nhớ
+        limiter.acquire()
+        future = pool.submit(write_chunk, directory / f"{prefix}{len(futures):05d}.bson.gz", docs)
+        future.add_done_callback(lambda _: limiter.release())
+        futures.append(future)
+
+    for doc in collection.find(query, projection).batch_size(chunk_size):
+        docs.append(doc.raw)
+        if len(docs) >= chunk_size:
+            submit()
+            docs = []
+    if docs:
+        submit()
+    return futures
+
+
+def backup_collection(db, name, mode, target, since, pool, limiter, chunk_size):
+    collection = db.get_collection(name, codec_options=CodecOptions(document_class=RawBSONDocument))
+    incremental = since is not None and mode == "incremental"
+    query = incremental_query(since) if incremental else {}
+    chunks = dump(collection, query, target / name, "", pool, limiter, chunk_size)
+    ids = dump(collection, {}, target / name, "ids-", pool, limiter, chunk_size * 10, {"_id": 1}) if incremental else []
+    result = {"mode": "incremental" if incremental else "full", "chunks": [f.result() for f in chunks]}
+    result["documents"] = sum(c["documents"] for c in result["chunks"])
+    if incremental:
+        result["ids"] = [f.result() for f in ids]
+    return result
+
+
+def create_backup(uri=DEFAULT_URI, backup_dir="backups", full=False, workers=4, chunk_size=10000, keep=5, full_every=7):
+    backup_dir = Path(backup_dir)
     backup_dir.mkdir(exist_ok=True)
-    
-    # Tạo tên file backup với timestamp
-    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    backup_file = backup_dir / f"emotional_diary_backup_{timestamp}"
-    
-    try:
-        # Thực hiện backup với mongodump
-        subprocess.run([
-            "mongodump",
-            "--uri=mongodb://localhost:27017/emotional_diary_db",
-            f"--out={backup_file}",
-            "--gzip"
-        ], check=True)
-        print(f"Backup created successfully at {backup_file}")
-        
-        # Xóa các backup cũ (giữ lại 5 bản gần nhất)
-        backup_files = sorted(backup_dir.glob("emotional_diary_backup_*"))
-        if len(backup_files) > 5:
-            for old_backup in backup_files[:-5]:
-                os.remove(old_backup)
-                print(f"Removed old backup: {old_backup}")
-    
-    except subprocess.CalledProcessError as e:
-        print(f"Backup failed: {e}")
-    except Exception as e:
-        print(f"An error occurred: {e}")
+    previous = list_backups(backup_dir)
+    base = None if full or not previous else previous[-1]
+    # Chuỗi gồm bản full và các incremental sau nó: đủ full_every incremental thì bắt đầu chuỗi mới
+    if base and full_every and len(load_chain(base[0])) > full_every:
+        base = None
+
+    started_at = datetime.datetime.utcnow()
+    # Micro giây trong tên: hai lần chạy trong cùng một giây không trùng thư mục
+    target = backup_dir / f"{BACKUP_PREFIX}{datetime.datetime.now().strftime('%Y%m%d_%H%M%S_%f')}"
+    target.mkdir()
+    # Lấy mốc của backup trước lúc nó bắt đầu: document sửa trong lúc nó chạy được ghi lại lần này
+    since = datetime.datetime.fromisoformat(base[1]["started_at"]) if base else None
+
+    db = MongoClient(uri).get_default_database()
+    limiter = threading.BoundedSemaphore(workers * 2)
+    with ThreadPoolExecutor(workers) as writers, ThreadPoolExecutor(len(BACKUP_COLLECTIONS)) as readers:
+        results = {
+            name: readers.submit(backup_collection, db, name, mode, target, since, writers, limiter, chunk_size)
+            for name, mode in BACKUP_COLLECTIONS.items()
+        }
+        collections = {name: future.result() for name, future in results.items()}
+
+    manifest = {
+        "name": target.name,
+        "type": "incremental" if base else "full",
+        "base": base[0].name if base else None,
+        "since": since.isoformat() if since else None,
+        "started_at": started_at.isoformat(),
+        "finished_at": datetime.datetime.utcnow().isoformat(),
+        "collections": collections,
+    }
+    # Manifest ghi sau cùng: thư mục không có manifest là backup dở dang
+    tmp = target / (MANIFEST + ".tmp")
+    tmp.write_text(json.dumps(manifest, indent=2))
+    tmp.replace(target / MANIFEST)
+    total = sum(c["documents"] for c in collections.values())
+    print(f"{manifest['type'].capitalize()} backup created at {target} ({total} documents)")
+
+    if keep:
+        apply_retention(backup_dir, keep)
+    return target
+
+
+def apply_retention(backup_dir, keep):
+    """
+    Giữ keep chuỗi gần nhất (bản full cùng các incremental dựa trên nó); xóa các backup
+    cũ hơn và các thư mục dở dang (không có manifest) cũ hơn backup hoàn tất mới nhất.
+    """
+    backups = list_backups(backup_dir)
+    if not backups:
+        return
+    fulls = [path.name for path, manifest in backups if manifest["type"] == "full"]
+    cutoff = fulls[-keep] if len(fulls) > keep else None
+    latest = backups[-1][0].name
+    complete = {path.name for path, _ in backups}
+    for path in sorted(Path(backup_dir).glob(BACKUP_PREFIX + "*")):
+        if (cutoff and path.name < cutoff) or (path.name not in complete and path.name < latest):
+            shutil.rmtree(path)
+            print(f"Removed old backup: {path}")
+
 
 if __name__ == "__main__":
-    create_backup()
+    parser = argparse.ArgumentParser(description="Back up the diary database to checksummed BSON chunks")
+    parser.add_argument("--uri", default=os.environ.get("MONGO_URI", DEFAULT_URI))
+    parser.add_argument("--dir", default="backups")
+    parser.add_argument("--full", action="store_true", help="Ignore previous backups and dump everything")
+    parser.add_argument("--workers", type=int, default=4, help="Threads compressing and writing chunks")
+    parser.add_argument("--chunk-size", type=int, default=10000, help="Documents per chunk")
+    parser.add_argument("--keep", type=int, default=5, help="Full backups (with their incrementals) to keep, 0 = all")
+    parser.add_argument("--full-every", type=int, default=7, help="Take a full backup after this many incrementals, 0 = never")
+    args = parser.parse_args()
+    try:
+        create_backup(args.uri, args.dir, args.full, args.workers, args.chunk_size, args.keep, args.full_every)
+    except Exception as e:
+        print(f"Backup failed: {e}")
+        sys.exit(1)
@@ -0,0 +1,151 @@
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+from multiprocessing import Pool
+from pathlib import Path
+
+from bson.objectid import ObjectId
+from pymongo import MongoClient, UpdateOne
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from utils import classify_sentiment, get_random_icon, CLASSIFIER_VERSION
+from sentiment_rollup import RollupDelta
+from data_versions import DataVersions
+
+DEFAULT_URI = "mongodb://localhost:27017/emotional_diary_db"
+
+
+def load_checkpoint(path):
+    # Chỉ resume khi checkpoint được tạo bởi cùng phiên bản classifier
+    if not path.exists():
+        return None
+    checkpoint = json.loads(path.read_text())
+    if checkpoint.get("classifier_version") != CLASSIFIER_VERSION:
+        print("Checkpoint was created by another classifier version, starting over")
+        return None
+    return checkpoint
+
+
+def save_checkpoint(path, checkpoint):
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(checkpoint))
+    tmp.replace(path)
+
+
+def reclassify(uri, batch_size, workers, checkpoint_path, dry_run, max_rate, pause):
+    checkpoint_path = Path(checkpoint_path)
+    checkpoint = None if dry_run else load_checkpoint(checkpoint_path)
+    if checkpoint:
+        print(f"Resuming after {checkpoint['last_id']} ({checkpoint['processed']} entries done)")
+    else:
+        checkpoint = {"classifier_version": CLASSIFIER_VERSION, "last_id": None, "processed": 0, "changed": 0}
+    changes = {}
+
+    # Tạo process pool trước MongoClient để các process con không kế thừa kết nối
+    with Pool(workers) as pool:
+        db = MongoClient(uri).get_default_database()
+        query = {}
+        if checkpoint["last_id"]:
+            query["_id"] = {"$gt": ObjectId(checkpoint["last_id"])}
+        remaining = db.entries.count_documents(query)
+        print(f"{remaining} entries to classify with {workers} workers (dry run: {dry_run})")
+
+        cursor = db.entries.find(query, {"user_id": 1, "date": 1, "content": 1}).sort("_id", 1).batch_size(batch_size)
+        started = time.monotonic()
+        done = 0
+        batch = []
+        for entry in cursor:
+            batch.append(entry)
+            if len(batch) < batch_size:
+                continue
+            done += process_batch(db, pool, batch, checkpoint, changes, dry_run)
+            batch = []
+            report(done, remaining, started, checkpoint)
+            if not dry_run:
+                save_checkpoint(checkpoint_path, checkpoint)
+            throttle(done, started, max_rate, pause)
+        if batch:
+            done += process_batch(db, pool, batch, checkpoint, changes, dry_run)
+            report(done, remaining, started, checkpoint)
+
+    print(f"Finished: {checkpoint['processed']} entries classified, {checkpoint['changed']} sentiments changed")
+    for (old, new), count in sorted(changes.items()):
+        print(f"  {old or 'missing'} -> {new}: {count}")
+    if not dry_run and checkpoint_path.exists():
+        checkpoint_path.unlink()
+
+
+def process_batch(db, pool, entries, checkpoint, changes, dry_run):
+    sentiments = pool.map(classify_sentiment, [e["content"] for e in entries], chunksize=max(1, len(entries) // 16))
+    existing = {
+        emo["entry_id"]: emo
+        for emo in db.emotion.find({"entry_id": {"$in": [e["_id"] for e in entries]}})
+    }
+    ops = []
+    entry_ops = []
+    changed_users = set()
+    rollup = RollupDelta()
+    for entry, sentiment in zip(entries, sentiments):
+        old = existing.get(entry["_id"])
+        old_sentiment = old.get("sentiment") if old else None
+        if old_sentiment == sentiment and old.get("date") == entry["date"]:
+            continue
+        if old_sentiment != sentiment:
+            key = (old_sentiment, sentiment)
+            changes[key] = changes.get(key, 0) + 1
+            checkpoint["changed"] += 1
+        new = {
+            "user_id": entry["user_id"],
+            "entry_id": entry["_id"],
+            "date": entry["date"],
+            "content": entry["content"],
+            "sentiment": sentiment,
+            "icon": old.get("icon") if old and old.get("icon") else get_random_icon(sentiment),
+            "updated_at": datetime.datetime.utcnow()
+        }
+        ops.append(UpdateOne({"user_id": entry["user_id"], "entry_id": entry["_id"]}, {"$set": new}, upsert=True))
+        entry_ops.append(UpdateOne({"_id": entry["_id"]}, {"$set": {"sentiment": sentiment, "icon": new["icon"], "updated_at": new["updated_at"]}}))
+        rollup.replace(old, new)
+        changed_users.add(entry["user_id"])
+    if ops and not dry_run:
+        db.emotion.bulk_write(ops, ordered=False)
+        db.entries.bulk_write(entry_ops, ordered=False)
+        rollup.apply(db)
+        DataVersions(db).bump_many(changed_users)
+    checkpoint["processed"] += len(entries)
+    checkpoint["last_id"] = str(entries[-1]["_id"])
+    return len(entries)
+
+
+def report(done, total, started, checkpoint):
+    elapsed = time.monotonic() - started
+    rate = done / elapsed if elapsed else 0
+    eta = (total - done) / rate if rate else 0
+    print(f"{done}/{total} entries, {rate:.0f} entries/s, ETA {eta:.0f}s, {checkpoint['changed']} changed")
+
+
+def throttle(done, started, max_rate, pause):
+    # Giới hạn tốc độ để không chiếm hết tài nguyên của API đang chạy
+    if max_rate:
+        expected = done / max_rate
+        elapsed = time.monotonic() - started
+        if expected > elapsed:
+            time.sleep(expected - elapsed)
+    if pause:
+        time.sleep(pause)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-classify the sentiment of every diary entry")
+    parser.add_argument("--uri", default=os.environ.get("MONGO_URI", DEFAULT_URI))
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1))
+    parser.add_argument("--checkpoint", default="reclassify_checkpoint.json")
+    parser.add_argument("--dry-run", action="store_true", help="Only report how many sentiments would change")
+    parser.add_argument("--max-rate", type=float, default=0, help="Maximum entries per second (0 = unlimited)")
+    parser.add_argument("--pause", type=float, default=0, help="Seconds to sleep between batches")
+    args = parser.parse_args()
+    reclassify(args.uri, args.batch_size, args.workers, args.checkpoint, args.dry_run, args.max_rate, args.pause)
@@ -1,35 +1,170 @@
+"""
+Restore từ backup của backup_db.py mà không xóa collection nào: document được ghi đè
+theo _id (ReplaceOne upsert), các chunk được restore song song.
+
+    python restore_db.py                                   # bản mới nhất, mọi user
+    python restore_db.py backups/emotional_diary_backup_20240101_020000
+    python restore_db.py --user 65a1f0c2e4b0a1b2c3d4e5f6   # chỉ một user
+    python restore_db.py --verify                          # chỉ kiểm tra checksum
+
+Bản incremental được ghép với các bản trước nó đến bản full gần nhất: bản mới hơn được
+ưu tiên, document không còn trong danh sách _id của bản được chọn thì bỏ qua. Document
+hiện có mà backup không chứa (ví dụ entry tạo sau lúc backup) được giữ nguyên. Sau khi
+ghi, rollup và term index của các user được khôi phục được dựng lại, và entry của họ chưa
+có emotion được đưa vào hàng đợi `sentiment_jobs` để worker của app phân tích (cần app
+đang chạy; có thể dùng reclassify_sentiment.py để phân tích ngay).
+"""
+import argparse
+import gzip
+import hashlib
 import os
-import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
-def restore_backup(backup_path=None):
-    backup_dir = Path("backups")
-    
+import bson
+from bson.objectid import ObjectId
+from pymongo import MongoClient, ReplaceOne
+from pymongo.errors import BulkWriteError
+
+from backup_db import DEFAULT_URI, BACKUP_PREFIX, load_chain, list_backups
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from sentiment_rollup import rebuild as rebuild_rollups
+from term_index import TermIndex
+from data_versions import DataVersions
+from sentiment_queue import SentimentQueue
+
+WRITE_BATCH_SIZE = 1000
+
+
+def read_chunk(path, chunk):
+    data = (path / chunk["file"]).read_bytes()
+    if hashlib.sha256(data).hexdigest() != chunk["sha256"]:
+        raise ValueError(f"Checksum mismatch in {path / chunk['file']}")
+    return bson.decode_all(gzip.decompress(data))
+
+
+def chunk_files(chain):
+    for path, manifest in chain:
+        for name, info in manifest["collections"].items():
+            for chunk in info["chunks"] + info.get("ids", []):
+                yield path / name, chunk
+
+
+def verify(chain, pool):
+    """Đọc lại mọi chunk và so SHA-256 với manifest; lỗi đầu tiên được raise."""
+    files = list(chunk_files(chain))
+    for _ in pool.map(lambda item: read_chunk(*item), files):
+        pass
+    return len(files)
+
+
+#============================================================================================
+def owned_by(collection, doc, user_id):
+    if collection == "users":
+        return doc["_id"] == user_id
+    return doc.get("user_id") == user_id
+
+
+def restore_chunk(db, collection, path, chunk, skip, live, user_id):
+    """
+    Ghi các document của chunk chưa có bản mới hơn (skip) và còn tồn tại (live).
+    Trả về (_id đã gặp, user bị ảnh hưởng, số document đã ghi, lỗi).
+    """
+    seen = set()
+    users = set()
+    ops = []
+    written = 0
+    errors = []
+    for doc in read_chunk(path, chunk):
+        seen.add(doc["_id"])
+        if doc["_id"] in skip or (live is not None and doc["_id"] not in live):
+            continue
+        if user_id and not owned_by(collection, doc, user_id):
+            continue
+        if collection in ("entries", "emotion"):
+            users.add(doc["user_id"])
+        ops.append(ReplaceOne({"_id": doc["_id"]}, doc, upsert=True))
+    for i in range(0, len(ops), WRITE_BATCH_SIZE):
+        batch = ops[i:i + WRITE_BATCH_SIZE]
+        try:
+            db[collection].bulk_write(batch, ordered=False)
+            written += len(batch)
+        except BulkWriteError as e:
+            # Ví dụ username đã được user khác dùng sau lúc backup
+            write_errors = e.details.get("writeErrors", [])
+            written += len(batch) - len(write_errors)
+            errors.extend(f"{collection} {err['op']['_id']}: {err.get('errmsg')}" for err in write_errors)
+    return seen, users, written, errors
+
+
+def restore_backup(backup_path=None, uri=DEFAULT_URI, backup_dir="backups", user_id=None, workers=4, verify_only=False):
     if not backup_path:
         # Nếu không chỉ định backup cụ thể, sử dụng bản mới nhất
-        backup_files = sorted(backup_dir.glob("emotional_diary_backup_*"))
-        if not backup_files:
+        backups = list_backups(backup_dir)
+        if not backups:
             print("No backup files found!")
             return
-        backup_path = backup_files[-1]
-    
-    try:
-        # Thực hiện restore với mongorestore
-        subprocess.run([
-            "mongorestore",
-            "--uri=mongodb://localhost:27017/emotional_diary_db",
-            f"--dir={backup_path}",
-            "--drop",  # Xóa collections hiện tại trước khi restore
-            "--gzip"
-        ], check=True)
-        print(f"Restore completed successfully from {backup_path}")
-    
-    except subprocess.CalledProcessError as e:
-        print(f"Restore failed: {e}")
-    except Exception as e:
-        print(f"An error occurred: {e}")
+        backup_path = backups[-1][0]
+    chain = load_chain(backup_path)
+    print(f"Restoring {chain[0][0]} ({len(chain)} backups in chain)" + (f" for user {user_id}" if user_id else ""))
+
+    with ThreadPoolExecutor(workers) as pool:
+        print(f"Verified {verify(chain, pool)} chunks")
+        if verify_only:
+            return
+        db = MongoClient(uri).get_default_database()
+        newest = chain[0][1]["collections"]
+        # Bản được chọn là incremental: chỉ những _id còn tồn tại lúc đó mới được restore
+        live = {}
+        for name, info in newest.items():
+            if info["mode"] == "incremental":
+                live[name] = {doc["_id"] for chunk in info["ids"] for doc in read_chunk(chain[0][0] / name, chunk)}
+
+        skip = {name: set() for name in newest}
+        users = set()
+        written = 0
+        errors = []
+        for path, manifest in chain:
+            futures = [
+                (name, pool.submit(restore_chunk, db, name, path / name, chunk, skip[name], live.get(name), user_id))
+                for name, info in manifest["collections"].items() if name in skip
+                for chunk in info["chunks"]
+            ]
+            # Gộp _id đã gặp sau khi xong cả bản này để bản cũ hơn không ghi đè bản mới
+            results = [(name, future.result()) for name, future in futures]
+            for name, (seen, chunk_users, count, chunk_errors) in results:
+                skip[name] |= seen
+                users |= chunk_users
+                written += count
+                errors.extend(chunk_errors)
+        print(f"Restored {written} documents for {len(users)} users")
+        for error in errors[:20]:
+            print(f"  failed: {error}")
+
+    # Collection dẫn xuất không có trong backup: dựng lại cho các user vừa được restore
+    term_index = TermIndex(db)
+    for uid in users:
+        rebuild_rollups(db, uid)
+        term_index.rebuild(db.entries, uid)
+    DataVersions(db).bump_many(users, search=True)
+    queued = SentimentQueue(db).recover(user_ids=users) if users else 0
+    print(f"Queued {queued} restored entries without an emotion document for sentiment analysis")
+    return written
+
 
 if __name__ == "__main__":
-    import sys
-    backup_path = sys.argv[1] if len(sys.argv) > 1 else None
-    restore_backup(backup_path)
+    parser = argparse.ArgumentParser(description="Restore a backup created by backup_db.py without dropping data")
+    parser.add_argument("backup_path", nargs="?", help=f"Backup directory (default: newest {BACKUP_PREFIX}*)")
+    parser.add_argument("--uri", default=os.environ.get("MONGO_URI", DEFAULT_URI))
+    parser.add_argument("--dir", default="backups")
+    parser.add_argument("--user", type=ObjectId, help="Only restore this user's account, entries and emotions")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--verify", action="store_true", help="Only check chunk checksums")
+    args = parser.parse_args()
+    try:
+        restore_backup(args.backup_path, args.uri, args.dir, args.user, args.workers, args.verify)
+    except Exception as e:
+        print(f"Restore failed: {e}")
+        sys.exit(1)
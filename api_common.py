@@ -0,0 +1,319 @@
+"""
+Phần dùng chung của hai front end: main.py (Flask + PyMongo) và main_async.py (Quart + Motor).
+
+Các hàm ở đây đọc tham số, dựng truy vấn Mongo và định dạng body của response; mỗi front
+end chỉ chạy truy vấn bằng driver của mình và trả response, nên hai chế độ không lệch
+nhau khi một route thay đổi. Các hàm parse_* trả về (kết quả, lỗi) như
+utils.parse_date_range.
+"""
+from bson.objectid import ObjectId
+
+import fast_json
+from utils import entry_to_json, encode_cursor, decode_cursor, parse_date_range, ENTRY_FIELDS
+from entry_repository import build_entry
+from metrics import render_gauges
+from term_index import to_wordcloud
+
+ENTRIES_PAGE_DEFAULT = 50
+ENTRIES_PAGE_MAX = 200
+ENTRIES_SORT = [("date", -1), ("_id", -1)]
+SEARCH_PAGE_DEFAULT = 20
+SEARCH_PAGE_MAX = 100
+IMPORT_CHUNK_SIZE = 1000
+IMPORT_MAX_ERRORS = 1000
+
+
+def parse_credentials(data):
+    """username/password trong body của /register và /login."""
+    return data.get("username", "").strip(), data.get("password", "")
+
+
+def login_response(user, token):
+    return {"token": token, "username": user["username"], "user_id": str(user["_id"])}
+
+
+def parse_entry_id(entry_id):
+    try:
+        return ObjectId(entry_id), None
+    except Exception:
+        return None, "Invalid entry ID"
+
+
+def pending_entry(entry):
+    """Entry vừa tạo/sửa: cảm xúc còn chờ worker nền phân tích."""
+    response = entry_to_json(entry)
+    response["sentiment_status"] = "pending"
+    return response
+
+
+#============================================================================================
+def parse_entries_args(user_id, args):
+    """
+    Truy vấn của GET /entries. Trả về dict gồm query, projection, fields và limit
+    (None khi không phân trang, tức trả về toàn bộ danh sách).
+    """
+    query = {"user_id": user_id}
+    date_range, error = parse_date_range(args)
+    if error:
+        return None, error
+    if date_range:
+        query["date"] = date_range
+
+    fields = None
+    projection = None
+    if args.get("fields"):
+        fields = [f.strip() for f in args["fields"].split(",") if f.strip()]
+        unknown = [f for f in fields if f not in ENTRY_FIELDS]
+        if unknown:
+            return None, f"Unknown fields: {', '.join(unknown)}"
+        projection = {f: 1 for f in fields}
+        projection["date"] = 1  # cần cho cursor
+
+    limit = None
+    if "limit" in args or "cursor" in args:
+        try:
+            limit = int(args.get("limit", ENTRIES_PAGE_DEFAULT))
+        except ValueError:
+            return None, "limit must be an integer"
+        limit = max(1, min(limit, ENTRIES_PAGE_MAX))
+        cursor = args.get("cursor")
+        if cursor:
+            position = decode_cursor(cursor)
+            if not position:
+                return None, "Invalid cursor"
+            last_date, last_id = position
+            query["$or"] = [
+                {"date": {"$lt": last_date}},
+                {"date": last_date, "_id": {"$lt": last_id}}
+            ]
+    return {"query": query, "projection": projection, "fields": fields, "limit": limit}, None
+
+
+def entries_page(entries, listing):
+    """Body của một trang; entries được lấy với limit + 1 để biết còn trang sau hay không."""
+    limit = listing["limit"]
+    next_cursor = None
+    if len(entries) > limit:
+        entries = entries[:limit]
+        next_cursor = encode_cursor(entries[-1]["date"], entries[-1]["_id"])
+    return {
+        "entries": [entry_to_json(entry, listing["fields"]) for entry in entries],
+        "next_cursor": next_cursor
+    }
+
+
+EXPORT_PROJECTION = {"date": 1, "content": 1, "emotions": 1}
+EXPORT_SORT = [("date", 1), ("_id", 1)]
+
+
+def export_item(entry):
+    return {"date": entry["date"], "content": entry["content"], "emotions": entry.get("emotions", [])}
+
+
+class ImportReport:
+    """
+    Đọc body NDJSON của /entries/import từng dòng và gom entry hợp lệ thành lô. Front end
+    ghi lô (batch) bằng EntryRepository.create_many rồi báo kết quả qua written().
+    """
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.imported = 0
+        self.failed = 0
+        self.errors = []
+        self._chunk = []
+
+    def _error(self, line_no, message):
+        self.failed += 1
+        if len(self.errors) < IMPORT_MAX_ERRORS:
+            self.errors.append({"line": line_no, "error": message})
+
+    def add_line(self, line_no, raw):
+        """Thêm một dòng; True khi lô đã đủ IMPORT_CHUNK_SIZE entry và cần được ghi."""
+        line = raw.strip()
+        if not line:
+            return False
+        try:
+            data = fast_json.loads(line)
+        except ValueError:
+            self._error(line_no, "Invalid JSON")
+            return False
+        entry, icon, error = build_entry(data, self.user_id)
+        if error:
+            self._error(line_no, error)
+            return False
+        self._chunk.append((line_no, entry, icon))
+        return len(self._chunk) >= IMPORT_CHUNK_SIZE
+
+    def batch(self):
+        """Các cặp (entry, icon) của lô đang chờ ghi."""
+        return [(entry, icon) for _, entry, icon in self._chunk]
+
+    def written(self, failed_indexes):
+        """Kết quả ghi lô hiện tại: {vị trí trong lô: lỗi} như create_many trả về."""
+        for i, (line_no, _, _) in enumerate(self._chunk):
+            if i in failed_indexes:
+                self._error(line_no, failed_indexes[i])
+        self.imported += len(self._chunk) - len(failed_indexes)
+        self._chunk = []
+
+    def response(self):
+        """(body, status) của response."""
+        return {
+            "imported": self.imported,
+            "failed": self.failed,
+            "errors": self.errors
+        }, 200 if self.imported or not self.failed else 400
+
+
+#============================================================================================
+ENTRY_EMOTIONS_PROJECTION = {"date": 1, "sentiment": 1, "icon": 1}
+
+
+def entry_emotions_query(user_id):
+    """Sentiment/icon lưu trên entry (sau migration 0001): một truy vấn theo index user_id."""
+    return {"user_id": user_id, "sentiment": {"$exists": True}}
+
+
+def entry_emotion_item(entry):
+    return {
+        "entry_id": str(entry["_id"]),
+        "sentiment": entry.get("sentiment", ""),
+        "icon": entry.get("icon", ""),
+        "date": entry["date"]
+    }
+
+
+def emotion_dates_query(user_id, emotions):
+    """Trước migration 0001: ngày của entry cho một lô emotion, lấy bằng một truy vấn $in."""
+    return {"user_id": user_id, "_id": {"$in": [emo.get("entry_id") for emo in emotions]}}
+
+
+def emotion_items(emotions, dated_entries):
+    dates = {e["_id"]: e["date"] for e in dated_entries}
+    items = []
+    for emo in emotions:
+        item = {
+            "entry_id": str(emo.get("entry_id")),
+            "sentiment": emo.get("sentiment", ""),
+            "icon": emo.get("icon", "")
+        }
+        if emo.get("entry_id") in dates:
+            item["date"] = dates[emo.get("entry_id")]
+        items.append(item)
+    return items
+
+
+def icon_changes(data, now):
+    """$set của PUT /emotions/<entry_id>/icon (trên cả emotion và entry)."""
+    icon = data.get("icon")
+    if not icon:
+        return None, "No icon provided"
+    return {"icon": icon, "updated_at": now}, None
+
+
+#============================================================================================
+TEXT_SEARCH_PROJECTION = {"score": {"$meta": "textScore"}}
+TEXT_SEARCH_SORT = [("score", {"$meta": "textScore"})]
+
+
+def text_search_query(user_id, args):
+    """Truy vấn $text của /entries/search (cần text index trên content, xem indexes.py)."""
+    keyword = args.get("q", "").strip()
+    if not keyword:
+        return None, "No keyword provided"
+    return {"user_id": user_id, "$text": {"$search": keyword}}, None
+
+
+def add_entry_terms(word_freq, entry):
+    """Wordcloud của kết quả tìm kiếm: gộp tần suất từ đã lưu sẵn trên entry."""
+    word_freq.update(entry.get("terms") or {})
+    return entry_to_json(entry)
+
+
+def parse_search_args(args):
+    """Tham số của SearchIndex.search cho /search."""
+    keyword = args.get("q", "").strip()
+    if not keyword:
+        return None, "No keyword provided"
+    date_range, error = parse_date_range(args)
+    if error:
+        return None, error
+    try:
+        limit = int(args.get("limit", SEARCH_PAGE_DEFAULT))
+        offset = int(args.get("offset", 0))
+    except ValueError:
+        return None, "limit and offset must be integers"
+    return {
+        "query": keyword,
+        "start": date_range.get("$gte"),
+        "end": date_range.get("$lte"),
+        "limit": max(1, min(limit, SEARCH_PAGE_MAX)),
+        "offset": max(0, offset)
+    }, None
+
+
+def parse_wordcloud_args(user_id, args):
+    """
+    Trả về ((scope, query), lỗi) cho /entries/wordcloud; query là None khi không lọc theo
+    ngày, lúc đó đọc tổng đã lưu trong term index thay vì duyệt entries.
+    """
+    scope = args.get("scope", "all")
+    if scope not in ("all", "negative"):
+        return None, "scope must be 'all' or 'negative'"
+    date_range, error = parse_date_range(args)
+    if error:
+        return None, error
+    if not date_range:
+        return (scope, None), None
+    query = {"user_id": user_id, "date": date_range}
+    if scope == "negative":
+        query["is_negative"] = True
+    return (scope, query), None
+
+
+def negative_insights_response(negative_entries, wordcloud, total_entries, top_keywords):
+    negative_count = len(negative_entries)
+    return {
+        "entries": [entry_to_json(e) for e in negative_entries],
+        "wordcloud": wordcloud,
+        "negative_count": negative_count,
+        "total_entries": total_entries,
+        "negative_ratio": round(negative_count / total_entries * 100, 2) if total_entries else 0,
+        "top_negative_words": [{"keyword": item["_id"], "count": item["count"]} for item in top_keywords]
+    }
+
+
+def terms_wordcloud(terms_doc, scope):
+    return to_wordcloud((terms_doc or {}).get(scope, {}))
+
+
+#============================================================================================
+def readiness(mongo_ready, engine, preload, process_pool=False):
+    """
+    (body, status) của /readyz. Ở chế độ lazy, hoặc khi model chạy trong process pool
+    (main_async.py), model được nạp khi cần nên không chặn readiness.
+    """
+    model_ready = engine.ready or preload == "lazy" or process_pool
+    if engine.ready:
+        model = "ready"
+    elif process_pool:
+        model = "process pool"
+    else:
+        model = preload if model_ready else "loading"
+    return {
+        "mongo": "ready" if mongo_ready else "unavailable",
+        "model": model,
+        "engine": engine.version,
+        "model_load_seconds": engine.load_seconds
+    }, 200 if mongo_ready and model_ready else 503
+
+
+def cache_gauges(user_cache, sentiment_queue, response_cache, search_index, timeline_store):
+    """Các dòng gauge của cache và chỉ mục trong process, nối vào /metrics."""
+    extra = render_gauges("auth_cache", user_cache.stats(), "Token -> user identity cache")
+    extra += render_gauges("sentiment_cache", sentiment_queue.cache.get_stats(), "Content-hash sentiment cache")
+    extra += render_gauges("response_cache", response_cache.stats(), "Versioned response cache")
+    extra += render_gauges("search_index", search_index.stats(), "In-process search index")
+    extra += render_gauges("timeline_store", timeline_store.stats(), "Per-user sentiment timeline arrays")
+    return extra
@@ -0,0 +1,298 @@
+"""
+Benchmark tải cho các route của API.
+
+Seed một database riêng với N user x M entry (trộn tiếng Anh và tiếng Việt), chạy app
+Flask bằng test client từ nhiều thread đồng thời và đo cho từng route: p50/p95/p99,
+throughput và số lệnh Mongo mỗi request. Kết quả lưu ra JSON để so sánh giữa các lần chạy.
+
+    # MongoDB local (database emotional_diary_bench sẽ bị xóa và seed lại)
+    python benchmarks/bench_api.py --users 5 --entries 2000 --out results.json
+    # Không cần MongoDB: dùng mongomock (các request được chạy tuần tự, bỏ qua route
+    # mongomock không hỗ trợ như $text của /entries/search)
+    python benchmarks/bench_api.py --mongomock
+    # So với lần chạy trước, exit code 1 nếu p95 của route nào chậm hơn 20%
+    python benchmarks/bench_api.py --baseline results.json --threshold 0.2
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+BENCH_URI = "mongodb://localhost:27017/emotional_diary_bench"
+# Route dùng tính năng mongomock không có ($text): chỉ đo với MongoDB thật
+MONGOMOCK_UNSUPPORTED = {"GET /entries/search"}
+
+EN_SENTENCES = [
+    "Today was a wonderful day with my family.",
+    "I feel tired and lonely after work.",
+    "The meeting went fine, nothing special.",
+    "I am anxious about the exam tomorrow.",
+    "We had a great dinner and laughed a lot.",
+    "Everything feels broken and hopeless.",
+    "I went for a long walk in the park.",
+]
+VI_SENTENCES = [
+    "Hôm nay tôi rất vui vì được đi chơi với bạn bè.",
+    "Tôi thấy mệt và buồn, không muốn làm gì cả.",
+    "Công việc bình thường, không có gì đặc biệt.",
+    "Áp lực thi cử làm tôi lo lắng.",
+    "Cả nhà ăn tối cùng nhau, thật ấm áp.",
+    "Tôi cô đơn và thất vọng về bản thân.",
+]
+
+_local = threading.local()
+
+
+def op_count():
+    return getattr(_local, "ops", 0)
+
+
+def _count_op():
+    _local.ops = op_count() + 1
+
+
+#============================================================================================
+def install_op_counter(use_mongomock):
+    """Đếm số lệnh gửi tới Mongo theo từng thread (tức theo từng request)."""
+    if use_mongomock:
+        import mongomock
+        methods = ["find", "find_one", "insert_one", "insert_many", "update_one", "update_many",
+                   "replace_one", "delete_one", "delete_many", "aggregate", "count_documents",
+                   "bulk_write", "find_one_and_update", "find_one_and_replace", "find_one_and_delete"]
+        for name in methods:
+            original = getattr(mongomock.collection.Collection, name)
+
+            def wrapper(self, *args, _original=original, **kwargs):
+                # Chỉ đếm lời gọi ngoài cùng: find_one, find_one_and_* của mongomock gọi lại find
+                depth = getattr(_local, "depth", 0)
+                if not depth:
+                    _count_op()
+                _local.depth = depth + 1
+                try:
+                    return _original(self, *args, **kwargs)
+                finally:
+                    _local.depth = depth
+            setattr(mongomock.collection.Collection, name, wrapper)
+    else:
+        from pymongo import monitoring
+
+        class Listener(monitoring.CommandListener):
+            def started(self, event):
+                if event.command_name not in ("getMore", "endSessions", "ping", "isMaster", "hello"):
+                    _count_op()
+
+            def succeeded(self, event):
+                pass
+
+            def failed(self, event):
+                pass
+        monitoring.register(Listener())
+
+
+def load_app(use_mongomock):
+    os.environ.setdefault("SENTIMENT_WORKERS", "0")  # phân tích cảm xúc được chạy đồng bộ khi seed
+    os.environ.setdefault("SENTIMENT_PRELOAD", "eager")
+    if use_mongomock:
+        import mongomock
+        import flask_pymongo
+        client = mongomock.MongoClient()
+
+        class MockPyMongo:
+            def __init__(self, app=None, *args, **kwargs):
+                self.cx = client
+                self.db = client.emotional_diary_bench
+        flask_pymongo.PyMongo = MockPyMongo
+    else:
+        os.environ["MONGO_URI"] = os.environ.get("BENCH_MONGO_URI", BENCH_URI)
+    install_op_counter(use_mongomock)
+    import main
+    # Lỗi 500 vẫn được đếm trong kết quả; không in traceback cho từng request
+    main.app.logger.disabled = True
+    return main
+
+
+def seed(main, users, entries_per_user):
+    """Tạo user và entry qua chính API (register/login/import), rồi xử lý hết hàng đợi cảm xúc."""
+    db = main.mongo.db
+    for name in db.list_collection_names():
+        db.drop_collection(name)
+    client = main.app.test_client()
+    tokens = []
+    start = datetime.date.today() - datetime.timedelta(days=entries_per_user // 3 + 1)
+    for u in range(users):
+        username = f"bench_user_{u}"
+        client.post("/register", json={"username": username, "password": "bench"})
+        token = client.post("/login", json={"username": username, "password": "bench"}).get_json()["token"]
+        lines = []
+        for i in range(entries_per_user):
+            sentences = random.sample(EN_SENTENCES, 2) if i % 2 else random.sample(VI_SENTENCES, 2)
+            lines.append(json.dumps({
+                "date": (start + datetime.timedelta(days=i // 3)).isoformat(),
+                "content": " ".join(sentences),
+                "emotions": random.sample(["happy", "sad", "tired", "anxious", "relaxed"], 1)
+            }))
+        client.post("/entries/import", data="\n".join(lines).encode("utf-8"),
+                    headers={"Authorization": "Bearer " + token})
+        tokens.append(token)
+    while main.sentiment_queue.process_batch():
+        pass
+    return tokens
+
+
+#============================================================================================
+def route_specs(main, tokens):
+    """Danh sách route cần đo: (tên, method, hàm tạo path, body)."""
+    entry_ids = {}
+    for token in tokens:
+        page = main.app.test_client().get("/entries?limit=50&fields=date",
+                                          headers={"Authorization": "Bearer " + token}).get_json()
+        entry_ids[token] = [e["_id"] for e in page["entries"]]
+    today = datetime.date.today()
+    return [
+        ("GET /entries", "GET", lambda t: "/entries", None),
+        ("GET /entries?limit=50", "GET", lambda t: "/entries?limit=50", None),
+        ("GET /entries/<id>", "GET", lambda t: f"/entries/{random.choice(entry_ids[t])}", None),
+        ("GET /emotions", "GET", lambda t: "/emotions", None),
+        ("GET /emotions/stats", "GET", lambda t: "/emotions/stats?period=year", None),
+        ("GET /entries/search", "GET", lambda t: "/entries/search?q=" + random.choice(["tired", "vui", "family"]), None),
+        ("GET /search", "GET", lambda t: "/search?q=" + random.choice(["tired", "vui", "family", "buon"]), None),
+        ("GET /search/suggest", "GET", lambda t: "/search/suggest?q=" + random.choice(["ti", "vu", "fa", "bu"]), None),
+        ("GET /emotions/timeline", "GET", lambda t: "/emotions/timeline?period=all&bucket=" + random.choice(["day", "week", "month"]), None),
+        ("GET /entries/negative-insights", "GET", lambda t: "/entries/negative-insights", None),
+        ("GET /entries/wordcloud", "GET", lambda t: "/entries/wordcloud", None),
+        ("POST /entries", "POST", lambda t: "/entries",
+         lambda: {"date": today.isoformat(), "content": random.choice(EN_SENTENCES + VI_SENTENCES), "emotions": []}),
+        ("PUT /entries/<id>", "PUT", lambda t: f"/entries/{random.choice(entry_ids[t])}",
+         lambda: {"content": random.choice(EN_SENTENCES + VI_SENTENCES)}),
+        ("GET /healthz", "GET", lambda t: "/healthz", None),
+    ]
+
+
+def run_route(main, spec, tokens, requests, concurrency, serialize):
+    name, method, path_fn, body_fn = spec
+    latencies = []
+    ops = []
+    errors = 0
+    lock = threading.Lock()
+    serial = threading.Lock()
+
+    def one(i):
+        nonlocal errors
+        client = main.app.test_client()
+        token = tokens[i % len(tokens)]
+        kwargs = {"headers": {"Authorization": "Bearer " + token}}
+        if body_fn:
+            kwargs["json"] = body_fn()
+        guard = serial if serialize else None
+        if guard:
+            guard.acquire()
+        try:
+            before = op_count()
+            started = time.perf_counter()
+            response = client.open(path_fn(token), method=method, **kwargs)
+            response.get_data()
+            elapsed = time.perf_counter() - started
+            used = op_count() - before
+        finally:
+            if guard:
+                guard.release()
+        with lock:
+            latencies.append(elapsed)
+            ops.append(used)
+            if response.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(one, range(requests)))
+    wall = time.perf_counter() - started
+    latencies.sort()
+    pct = lambda p: round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 2)
+    return {
+        "requests": requests,
+        "errors": errors,
+        "p50_ms": pct(0.50),
+        "p95_ms": pct(0.95),
+        "p99_ms": pct(0.99),
+        "throughput_rps": round(requests / wall, 1),
+        "mongo_ops_per_request": round(sum(ops) / len(ops), 2)
+    }
+
+
+def compare(results, baseline, threshold):
+    """Trả về danh sách route có p95 chậm hơn baseline quá `threshold` (tỷ lệ)."""
+    regressions = []
+    for name, current in results["routes"].items():
+        old = baseline.get("routes", {}).get(name)
+        if not old or not old.get("p95_ms"):
+            continue
+        ratio = current["p95_ms"] / old["p95_ms"] - 1
+        if ratio > threshold:
+            regressions.append((name, old["p95_ms"], current["p95_ms"], ratio))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark every API route against a seeded corpus")
+    parser.add_argument("--users", type=int, default=3)
+    parser.add_argument("--entries", type=int, default=500, help="Entries per user")
+    parser.add_argument("--requests", type=int, default=100, help="Requests per route")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--mongomock", action="store_true", help="Use an in-memory mongomock database")
+    parser.add_argument("--route", action="append", help="Only run routes whose name contains this text")
+    parser.add_argument("--out", help="Write results to this JSON file")
+    parser.add_argument("--baseline", help="Previous results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed p95 slowdown ratio in baseline mode")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    main = load_app(args.mongomock)
+    print(f"Seeding {args.users} users x {args.entries} entries...")
+    seed_started = time.perf_counter()
+    tokens = seed(main, args.users, args.entries)
+    print(f"Seeded in {time.perf_counter() - seed_started:.1f}s")
+
+    results = {
+        "meta": {
+            "users": args.users,
+            "entries_per_user": args.entries,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "backend": "mongomock" if args.mongomock else "mongodb",
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds")
+        },
+        "routes": {},
+        "skipped": []
+    }
+    for spec in route_specs(main, tokens):
+        if args.route and not any(r in spec[0] for r in args.route):
+            continue
+        if args.mongomock and spec[0] in MONGOMOCK_UNSUPPORTED:
+            results["skipped"].append(spec[0])
+            print(f"{spec[0]:32} skipped (not supported by mongomock)")
+            continue
+        # mongomock không an toàn với nhiều thread nên các request được chạy tuần tự
+        stats = run_route(main, spec, tokens, args.requests, args.concurrency, serialize=args.mongomock)
+        results["routes"][spec[0]] = stats
+        print(f"{spec[0]:32} p50 {stats['p50_ms']:8.2f}ms  p95 {stats['p95_ms']:8.2f}ms  "
+              f"p99 {stats['p99_ms']:8.2f}ms  {stats['throughput_rps']:8.1f} req/s  "
+              f"{stats['mongo_ops_per_request']:5.1f} ops/req  {stats['errors']} errors")
+
+    if args.out:
+        Path(args.out).write_text(json.dumps(results, indent=2))
+        print(f"Results written to {args.out}")
+    if args.baseline:
+        regressions = compare(results, json.loads(Path(args.baseline).read_text()), args.threshold)
+        for name, old, new, ratio in regressions:
+            print(f"REGRESSION {name}: p95 {old}ms -> {new}ms (+{ratio:.0%})")
+        if regressions:
+            sys.exit(1)
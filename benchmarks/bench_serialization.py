@@ -0,0 +1,86 @@
+"""
+So sánh serialize và dung lượng truyền đi của một user có nhiều entry (mặc định 5000):
+json thư viện chuẩn (như jsonify mặc định của Flask) với fast_json, không nén với gzip/brotli.
+
+    python benchmarks/bench_serialization.py --entries 5000 --repeat 20
+"""
+import argparse
+import datetime
+import gzip
+import json
+import random
+import sys
+import time
+from pathlib import Path
+
+from bson.objectid import ObjectId
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import fast_json
+from compression import brotli
+from utils import entry_to_json
+
+WORDS = ("hôm nay tôi thấy rất vui mệt buồn đi học làm việc gia đình bạn bè "
+         "today feel happy tired family work walk dinner exam anxious grateful").split()
+
+
+def make_entries(n):
+    user_id = ObjectId()
+    start = datetime.date(2020, 1, 1)
+    return [
+        {
+            "_id": ObjectId(),
+            "user_id": user_id,
+            "date": (start + datetime.timedelta(days=i // 3)).isoformat(),
+            "content": " ".join(random.choices(WORDS, k=random.randint(20, 120))),
+            "emotions": random.sample(["happy", "sad", "tired", "anxious", "relaxed"], 2)
+        }
+        for i in range(n)
+    ]
+
+
+def stdlib_dumps(obj):
+    # Cấu hình mặc định của Flask jsonify khi không debug
+    return json.dumps(obj, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+
+def timed(fn, payload, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        body = fn(payload)
+        best = min(best, time.perf_counter() - started)
+    return body, best * 1000
+
+
+def report(name, body, ms):
+    line = f"{name:26} {ms:9.2f}ms  raw {len(body) / 1024:9.1f} KB  gzip {len(gzip.compress(body, 6)) / 1024:8.1f} KB"
+    if brotli is not None:
+        line += f"  br {len(brotli.compress(body, quality=5)) / 1024:8.1f} KB"
+    print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark JSON serialization and compression")
+    parser.add_argument("--entries", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    random.seed(42)
+    entries = make_entries(args.entries)
+    print(f"{args.entries} entries, fast_json backend: {fast_json.BACKEND}")
+
+    started = time.perf_counter()
+    payload = [entry_to_json(e) for e in entries]
+    print(f"{'entry_to_json':26} {(time.perf_counter() - started) * 1000:9.2f}ms")
+
+    report("stdlib json", *timed(stdlib_dumps, payload, args.repeat))
+    report("fast_json", *timed(fast_json.dumps_bytes, payload, args.repeat))
+    # Dữ liệu thô từ Mongo (ObjectId) không cần entry_to_json khi dùng fast_json
+    report("fast_json (raw documents)", *timed(fast_json.dumps_bytes, entries, args.repeat))
+
+    for name, compress in [("gzip level 6", lambda b: gzip.compress(b, 6))] + (
+            [("brotli quality 5", lambda b: brotli.compress(b, quality=5))] if brotli is not None else []):
+        body = fast_json.dumps_bytes(payload)
+        _, ms = timed(compress, body, max(1, args.repeat // 4))
+        print(f"{'compress ' + name:26} {ms:9.2f}ms")
@@ -0,0 +1,126 @@
+"""
+Nén response theo Accept-Encoding: brotli (nếu đã cài package `brotli`) hoặc gzip.
+
+Chỉ nén các kiểu nội dung dạng text (JSON, NDJSON, HTML, JS, CSS) lớn hơn
+COMPRESS_MIN_SIZE byte. Response stream (NDJSON) được nén dần từng chunk nên vẫn
+không phải giữ cả body trong bộ nhớ.
+
+init_app gắn vào app Flask (main.py), init_async_app vào app Quart (main_async.py);
+hai bên dùng chung cách chọn encoding và các bộ nén bên dưới.
+"""
+import gzip
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from metrics import span
+
+COMPRESSIBLE_TYPES = (
+    "application/json", "application/x-ndjson", "application/javascript",
+    "text/html", "text/css", "text/plain", "text/javascript"
+)
+
+
+AVAILABLE_ENCODINGS = ["br", "gzip"] if brotli is not None else ["gzip"]
+
+
+def _compressor(encoding, gzip_level, brotli_quality):
+    """(process, finish) của bộ nén dần theo encoding."""
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=brotli_quality)
+        return compressor.process, compressor.finish
+    compressor = zlib.compressobj(gzip_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress, compressor.flush
+
+
+def _to_bytes(chunk):
+    return chunk.encode("utf-8") if isinstance(chunk, str) else chunk
+
+
+def _compress_stream(chunks, encoding, gzip_level, brotli_quality):
+    process, finish = _compressor(encoding, gzip_level, brotli_quality)
+    for chunk in chunks:
+        data = process(_to_bytes(chunk))
+        if data:
+            yield data
+    yield finish()
+
+
+async def _compress_async_stream(chunks, encoding, gzip_level, brotli_quality):
+    process, finish = _compressor(encoding, gzip_level, brotli_quality)
+    async for chunk in chunks:
+        data = process(_to_bytes(chunk))
+        if data:
+            yield data
+    yield finish()
+
+
+def _compress_body(body, encoding, gzip_level, brotli_quality):
+    with span("compress"):
+        if encoding == "br":
+            return brotli.compress(body, quality=brotli_quality)
+        return gzip.compress(body, compresslevel=gzip_level)
+
+
+def _negotiate(request, response):
+    """Encoding sẽ dùng cho response, hoặc None nếu không nén."""
+    if (response.status_code < 200 or response.status_code in (204, 304)
+            or "Content-Encoding" in response.headers
+            or response.mimetype not in COMPRESSIBLE_TYPES):
+        return None
+    response.vary.add("Accept-Encoding")
+    return request.accept_encodings.best_match(AVAILABLE_ENCODINGS)
+
+
+def init_app(app, min_size=1024, gzip_level=6, brotli_quality=5):
+    from flask import request
+
+    @app.after_request
+    def compress_response(response):
+        if response.direct_passthrough:
+            return response
+        encoding = _negotiate(request, response)
+        if not encoding:
+            return response
+
+        if response.is_streamed:
+            response.response = _compress_stream(response.response, encoding, gzip_level, brotli_quality)
+            response.headers.pop("Content-Length", None)
+        else:
+            body = response.get_data()
+            if len(body) < min_size:
+                return response
+            response.set_data(_compress_body(body, encoding, gzip_level, brotli_quality))
+        # ETag yếu (data_versions) vẫn đúng cho bản nén nên giữ nguyên để If-None-Match khớp
+        response.headers["Content-Encoding"] = encoding
+        return response
+
+
+def init_async_app(app, min_size=1024, gzip_level=6, brotli_quality=5):
+    """Như init_app cho Quart: body thường nén một lần, body async iterator nén dần."""
+    from quart import request
+    from quart.wrappers.response import DataBody, IterableBody
+
+    @app.after_request
+    async def compress_response(response):
+        # File tĩnh (FileBody) và body khác được gửi nguyên như direct_passthrough của Flask
+        if not isinstance(response.response, (DataBody, IterableBody)):
+            return response
+        encoding = _negotiate(request, response)
+        if not encoding:
+            return response
+
+        if isinstance(response.response, IterableBody):
+            chunks = response.response.iter
+            response.response = IterableBody(_compress_async_stream(chunks, encoding, gzip_level, brotli_quality))
+            response.headers.pop("Content-Length", None)
+        else:
+            body = await response.get_data()
+            if len(body) < min_size:
+                return response
+            response.set_data(_compress_body(body, encoding, gzip_level, brotli_quality))
+        response.headers["Content-Encoding"] = encoding
+        return response
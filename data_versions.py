@@ -0,0 +1,169 @@
+"""
+Số phiên bản dữ liệu theo user, ETag/304 và cache response cho các route đọc.
+
+Collection `user_versions` giữ {_id: user_id, version}; mọi thao tác sửa entry,
+emotion hay icon của user đều $inc version. Route đọc bọc bằng conditional() trả
+ETag yếu tạo từ (user, version, path, query string): nếu client gửi lại ETag đó
+trong If-None-Match thì trả 304 mà không chạy truy vấn. Khi bật ResponseCache
+(RESPONSE_CACHE_SIZE > 0), response 200 không stream được giữ theo
+(user, version, path, query), nên request lặp lại chỉ tốn một lần đọc version.
+
+Field `search` đếm riêng các lần ghi làm đổi nội dung/ngày của entry, để chỉ mục tìm
+kiếm trong process (search_index.py) biết khi nào phải dựng lại. Cùng document còn giữ
+tổng tần suất từ của user (term_index.py): bump(inc=...) cộng chênh lệch của các tổng đó
+trong cùng lệnh tăng version.
+"""
+import datetime
+import functools
+import hashlib
+import threading
+from collections import OrderedDict
+
+from flask import request, make_response
+from pymongo import UpdateOne, ReturnDocument
+
+VERSIONS_COLLECTION = "user_versions"
+
+
+class DataVersions:
+    def __init__(self, db):
+        self.collection = db[VERSIONS_COLLECTION]
+
+    def get(self, user_id):
+        doc = self.collection.find_one({"_id": user_id}, {"version": 1})
+        return doc["version"] if doc else 0
+
+    def get_search(self, user_id):
+        doc = self.collection.find_one({"_id": user_id}, {"search": 1})
+        return doc.get("search", 0) if doc else 0
+
+    def bump(self, user_id, session=None, search=False, inc=None):
+        """
+        search=True: tăng cả bộ đếm `search` và trả về giá trị mới của nó.
+        inc: các field khác của document cần $inc cùng lúc (tổng tần suất từ).
+        """
+        update = {"$inc": dict(inc or {}, version=1)}
+        if not search:
+            self.collection.update_one({"_id": user_id}, update, upsert=True, session=session)
+            return None
+        update["$inc"]["search"] = 1
+        doc = self.collection.find_one_and_update(
+            {"_id": user_id}, update, {"search": 1},
+            upsert=True, return_document=ReturnDocument.AFTER, session=session
+        )
+        return doc["search"]
+
+    def bump_many(self, user_ids, session=None, search=False):
+        inc = {"version": 1, "search": 1} if search else {"version": 1}
+        ops = [UpdateOne({"_id": uid}, {"$inc": inc}, upsert=True) for uid in set(user_ids)]
+        if ops:
+            self.collection.bulk_write(ops, ordered=False, session=session)
+
+    def bump_all(self):
+        """Dùng sau các thao tác bảo trì ảnh hưởng nhiều user (ví dụ dựng lại rollup)."""
+        self.collection.update_many({}, {"$inc": {"version": 1}})
+
+
+def make_etag(user_id, version, path, args, stream=False):
+    params = "&".join(f"{k}={v}" for k, v in sorted(args.items(multi=True)))
+    # Có ngày hiện tại vì các khoảng như period=week tính theo hôm nay
+    today = datetime.date.today().isoformat()
+    raw = f"{user_id}|{path}|{params}|{int(stream)}|{today}"
+    digest = hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+    return f"{version}-{digest}"
+
+
+#============================================================================================
+class ResponseCache:
+    """LRU các response đã serialize; khóa có version nên dữ liệu cũ không bao giờ được trả ra."""
+
+    def __init__(self, max_size=0, max_bytes=256 * 1024):
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item
+
+    def put(self, key, body, content_type):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            self._items[key] = (body, content_type)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._items),
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0
+            }
+
+
+def set_validators(response, etag):
+    response.set_etag(etag, weak=True)
+    # Trình duyệt giữ response nhưng luôn hỏi lại server bằng If-None-Match
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+
+def check_conditional(request, user_id, version, cache, streaming):
+    """
+    Phần không phụ thuộc framework của conditional, dùng chung với main_async.versioned
+    (request của Flask và Quart đều theo Werkzeug). Trả về (etag, ready, use_cache):
+    ready là (status, body, content_type) khi trả được ngay (304 hoặc trúng cache),
+    ngược lại None và view phải chạy.
+    """
+    etag = make_etag(user_id, version, request.path, request.args, streaming)
+    if request.if_none_match.contains_weak(etag):
+        return etag, (304, b"", None), False
+    use_cache = cache is not None and cache.max_size > 0 and not streaming
+    if use_cache:
+        cached = cache.get(etag)
+        if cached:
+            body, content_type = cached
+            return etag, (200, body, content_type), True
+    return etag, None, use_cache
+
+
+def conditional(versions, get_user, cache=None, stream=lambda: False):
+    """
+    Decorator cho route GET trả dữ liệu của user hiện tại. get_user() trả về user hoặc
+    None (khi đó route tự trả 401 như cũ).
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            user = get_user()
+            if not user:
+                return view(*args, **kwargs)
+            # Đọc version trước khi truy vấn: nếu dữ liệu đổi giữa chừng, lần sau ETag sẽ khác
+            version = versions.get(user["_id"])
+            etag, ready, use_cache = check_conditional(request, user["_id"], version, cache, stream())
+            if ready:
+                status, body, content_type = ready
+                headers = {"Content-Type": content_type} if content_type else {}
+                return set_validators(make_response(body, status, headers), etag)
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            if use_cache and not response.is_streamed:
+                cache.put(etag, response.get_data(), response.headers.get("Content-Type"))
+            return set_validators(response, etag)
+        return wrapper
+    return decorator
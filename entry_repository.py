@@ -0,0 +1,234 @@
+"""
+Ghi entry và dữ liệu đi kèm (tổng từ của user, job phân tích cảm xúc, emotion, rollup).
+
+Các lệnh của một thao tác ghi:
+    1. một lệnh trên `entries`: insert_one đã có sẵn _id nên không đọc lại, sửa dùng
+       find_one_and_update và xóa dùng find_one_and_delete, cả hai lọc theo user_id nên
+       không cần đọc trước để kiểm tra quyền sở hữu;
+    2. tạo/sửa: upsert job vào hàng đợi cảm xúc. Xóa: find_one_and_delete document
+       emotion và một bulk_write trừ phần đóng góp của nó vào rollup (nếu đã có emotion);
+    3. một $inc trên document version của user: tăng version và cộng chênh lệch tổng
+       tần suất từ (tính từ bản trước và sau khi ghi).
+Sửa chỉ content hoặc chỉ emotions tính lại từ khóa từ bản trước mà find_one_and_update
+trả về, và chỉ ghi thêm một lệnh khi từ khóa đổi.
+
+Số lệnh Mongo đo bằng benchmarks/bench_api.py --mongomock: POST /entries 3, PUT
+/entries/<id> chỉ sửa content 3-4 (trung bình 3.8 với câu ngẫu nhiên), DELETE 4 (3 khi
+entry chưa có emotion). Job, version và entries là ba collection khác nhau nên không gộp
+được vào một lệnh; transaction (ENTRY_TRANSACTIONS) không giảm số lệnh.
+
+Nếu có search_index, chỉ mục tìm kiếm trong process được cập nhật sau mỗi lần ghi
+thành công (theo bộ đếm `search` mà lần ghi trả về).
+
+Đặt ENTRY_TRANSACTIONS=1 (chỉ khi MongoDB chạy replica set) để gói các lệnh của một
+thao tác vào một multi-document transaction.
+"""
+import datetime
+import os
+
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError
+
+from keywords import analyze_keywords
+from sentiment_rollup import RollupDelta
+from term_index import entry_terms, term_increments
+
+
+def build_entry(data, user_id):
+    """
+    Kiểm tra dữ liệu một entry mới (dùng chung cho create_entry và import).
+    Trả về (entry, icon, error); error khác None nghĩa là dữ liệu không hợp lệ.
+    """
+    if not data or not isinstance(data, dict) or "date" not in data or "content" not in data:
+        return None, None, "Missing required fields: date, content"
+    date = data["date"]
+    try:
+        datetime.datetime.strptime(date, "%Y-%m-%d")
+    except (TypeError, ValueError):
+        return None, None, "Date must be in YYYY-MM-DD format"
+    content = data["content"]
+    if not isinstance(content, str):
+        return None, None, "Content must be a string"
+    emotions = data.get("emotions", [])
+    if not isinstance(emotions, list):
+        return None, None, "Emotions must be a list of strings"
+    entry = {
+        "date": date,
+        "content": content,
+        "emotions": emotions,
+        "user_id": user_id
+    }
+    # Đếm từ khóa tiêu cực và tần suất từ một lần khi ghi, phục vụ wordcloud/insights
+    entry.update(analyze_keywords(content, emotions))
+    entry.update(entry_terms(content))
+    return entry, data.get("icon"), None
+
+
+def parse_entry_changes(data):
+    """
+    Kiểm tra body của PUT /entries/<id>. Trả về (changes, icon, error) với changes chỉ
+    gồm các field date/content/emotions hợp lệ.
+    """
+    if not data or not isinstance(data, dict):
+        return None, None, "No update data provided"
+    changes = {}
+    if "date" in data:
+        date = data["date"]
+        try:
+            datetime.datetime.strptime(date, "%Y-%m-%d")
+            changes["date"] = date
+        except (TypeError, ValueError):
+            return None, None, "Date must be in YYYY-MM-DD format"
+    if "content" in data:
+        if not isinstance(data["content"], str):
+            return None, None, "Content must be a string"
+        changes["content"] = data["content"]
+    if "emotions" in data:
+        emotions = data["emotions"]
+        if not isinstance(emotions, list):
+            return None, None, "Emotions must be a list of strings"
+        changes["emotions"] = emotions
+    icon = data.get("icon")
+    if not changes and not icon:
+        return None, None, "No valid fields provided to update"
+    return changes, icon, None
+
+
+class EntryRepository:
+    def __init__(self, client, db, sentiment_queue, versions, use_transactions=False, search_index=None):
+        self.client = client
+        self.db = db
+        self.entries = db.entries
+        self.sentiment_queue = sentiment_queue
+        self.versions = versions
+        self.use_transactions = use_transactions
+        self.search_index = search_index
+
+    def _bump(self, user_id, old, new, session, search):
+        """Tăng version của user cùng chênh lệch tổng tần suất từ của entry."""
+        inc = term_increments([(old, new)]).get(user_id)
+        return self.versions.bump(user_id, session=session, search=search, inc=inc)
+
+    def _run(self, write):
+        if not self.use_transactions:
+            return write(None)
+        with self.client.start_session() as session:
+            return session.with_transaction(write)
+
+    #========================================================================================
+    def create(self, entry, icon=None):
+        """Ghi entry mới (đã qua build_entry) và đưa vào hàng đợi phân tích cảm xúc."""
+        def write(session):
+            self.entries.insert_one(entry, session=session)
+            self.sentiment_queue.enqueue(entry["user_id"], entry["_id"], icon, session=session)
+            return self._bump(entry["user_id"], None, entry, session, search=True)
+        version = self._run(write)
+        if self.search_index:
+            self.search_index.update(entry["user_id"], version, added=[entry])
+        return entry
+
+    def create_many(self, user_id, items):
+        """
+        Ghi nhiều entry bằng một insert_many không thứ tự. items: [(entry, icon)].
+        Trả về {index: thông báo lỗi} của các entry không ghi được; phần còn lại vẫn được ghi.
+        Không dùng transaction để một dòng lỗi không làm hỏng cả lô.
+        """
+        failed = {}
+        try:
+            self.entries.insert_many([entry for entry, _ in items], ordered=False)
+        except BulkWriteError as e:
+            failed = {err["index"]: err.get("errmsg", "Write failed") for err in e.details.get("writeErrors", [])}
+        written = [item for i, item in enumerate(items) if i not in failed]
+        self.sentiment_queue.enqueue_many(user_id, [(entry["_id"], icon) for entry, icon in written])
+        if written:
+            inc = term_increments([(None, entry) for entry, _ in written]).get(user_id)
+            version = self.versions.bump(user_id, search=True, inc=inc)
+            if self.search_index:
+                self.search_index.update(user_id, version, added=[entry for entry, _ in written])
+        return failed
+
+    #========================================================================================
+    def update(self, user_id, entry_id, changes, icon=None):
+        """
+        Sửa các field date/content/emotions (đã kiểm tra) của entry thuộc user.
+        Trả về entry sau khi sửa, hoặc None nếu không có entry đó.
+        """
+        query = {"_id": entry_id, "user_id": user_id}
+        fields = dict(changes)
+        if "content" in changes and "emotions" in changes:
+            fields.update(analyze_keywords(changes["content"], changes["emotions"]))
+        if "content" in changes:
+            fields.update(entry_terms(changes["content"]))
+        if fields:
+            # Backup incremental (Setup/backup_db.py) lấy document sửa theo updated_at
+            fields["updated_at"] = datetime.datetime.utcnow()
+        # Chỉ content và date nằm trong chỉ mục tìm kiếm
+        searchable = "content" in changes or "date" in changes
+
+        def write(session):
+            if fields:
+                old = self.entries.find_one_and_update(
+                    query, {"$set": fields}, return_document=ReturnDocument.BEFORE, session=session
+                )
+            else:
+                old = self.entries.find_one(query, session=session)
+            if not old:
+                return None
+            # $set chỉ ghi field cấp một nên bản sau khi sửa = bản trước + fields
+            new = dict(old, **fields)
+            if "is_negative" not in fields and ("content" in changes or "emotions" in changes):
+                self._refresh_keywords(old, new, session)
+            self.sentiment_queue.enqueue(user_id, entry_id, icon, session=session)
+            return new, self._bump(user_id, old, new, session, search=searchable)
+
+        updated, version = self._run(write) or (None, None)
+        if updated and searchable and self.search_index:
+            self.search_index.update(user_id, version, added=[updated], removed=[entry_id])
+        return updated
+
+    def _refresh_keywords(self, old, new, session):
+        """
+        Sửa chỉ content hoặc chỉ emotions: từ khóa tính trên cả hai, với field còn lại lấy
+        từ bản trước của chính lệnh ghi. Chỉ ghi thêm khi từ khóa đổi, và chỉ khi entry chưa
+        bị sửa tiếp (lần sửa sau tự tính từ khóa của nó từ bản trước mà nó đọc được).
+        """
+        keywords = analyze_keywords(new.get("content"), new.get("emotions"))
+        if keywords == {k: old.get(k) for k in keywords}:
+            return
+        result = self.entries.update_one(
+            {"_id": new["_id"], "content": new.get("content"), "emotions": new.get("emotions")},
+            {"$set": keywords},
+            session=session
+        )
+        if result.matched_count:
+            new.update(keywords)
+
+    def delete(self, user_id, entry_id):
+        """
+        Xóa entry của user cùng document emotion và phần đóng góp vào rollup và term index
+        trong cùng thao tác, nên thống kê không còn đếm entry đã xóa.
+        """
+        def write(session):
+            old = self.entries.find_one_and_delete({"_id": entry_id, "user_id": user_id}, session=session)
+            if not old:
+                return None
+            emotion = self.db.emotion.find_one_and_delete({"user_id": user_id, "entry_id": entry_id}, session=session)
+            if emotion:
+                rollup = RollupDelta()
+                rollup.add(emotion, -1)
+                rollup.apply(self.db, session)
+            return self._bump(user_id, old, None, session, search=True)
+        version = self._run(write)
+        if version is None:
+            return False
+        if self.search_index:
+            self.search_index.update(user_id, version, removed=[entry_id])
+        return True
+
+
+def create_repository(client, db, sentiment_queue, versions, search_index=None):
+    return EntryRepository(
+        client, db, sentiment_queue, versions,
+        use_transactions=os.environ.get("ENTRY_TRANSACTIONS", "0") == "1",
+        search_index=search_index
+    )
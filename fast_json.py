@@ -0,0 +1,75 @@
+"""
+Serialize JSON nhanh cho response: dùng orjson nếu đã cài, không thì quay về json
+của thư viện chuẩn. ObjectId được đổi thành chuỗi, datetime/date theo ISO 8601.
+
+init_app(app) thay bộ serialize của Flask: Flask >= 2.2 qua JSON provider (app.json),
+Flask 2.0/2.1 qua app.json_encoder.
+"""
+import datetime
+import json
+
+from bson.objectid import ObjectId
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(obj):
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, (datetime.datetime, datetime.date)):
+        return obj.isoformat()
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+if orjson is not None:
+    BACKEND = "orjson"
+    _OPTIONS = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS
+
+    def dumps_bytes(obj):
+        return orjson.dumps(obj, default=_default, option=_OPTIONS)
+
+    def dumps(obj):
+        return dumps_bytes(obj).decode("utf-8")
+
+    loads = orjson.loads
+else:
+    BACKEND = "json"
+
+    def dumps(obj):
+        return json.dumps(obj, default=_default, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+
+    def dumps_bytes(obj):
+        return dumps(obj).encode("utf-8")
+
+    loads = json.loads
+
+
+#============================================================================================
+def init_app(app):
+    try:
+        from flask.json.provider import DefaultJSONProvider
+    except ImportError:
+        DefaultJSONProvider = None
+
+    if DefaultJSONProvider is not None:
+        class FastJSONProvider(DefaultJSONProvider):
+            def dumps(self, obj, **kwargs):
+                return dumps(obj)
+
+            def loads(self, s, **kwargs):
+                return loads(s)
+
+        app.json = FastJSONProvider(app)
+    else:
+        from flask.json import JSONEncoder
+
+        class FastJSONEncoder(JSONEncoder):
+            def encode(self, o):
+                return dumps(o)
+
+        app.json_encoder = FastJSONEncoder
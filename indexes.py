@@ -0,0 +1,267 @@
+"""
+Khai báo index MongoDB mà các route cần, tạo index còn thiếu bằng CLI (bước deploy)
+và kiểm tra query plan của từng dạng truy vấn bằng explain(): lỗi nếu truy vấn phải
+quét cả collection (COLLSCAN) hoặc sắp xếp trong bộ nhớ (SORT). Với ENSURE_INDEXES=1
+app cũng tạo index còn thiếu ở thread nền khi khởi động (mặc định tắt).
+
+    python indexes.py ensure
+    python indexes.py status
+    python indexes.py check
+
+Index được so theo key (không theo tên) nên index đã tạo bằng Setup/MongoDB_Setup.js
+với tên mặc định vẫn được tính.
+"""
+import argparse
+import datetime
+import os
+import sys
+import threading
+
+from bson.objectid import ObjectId
+from bson.son import SON
+from pymongo import MongoClient, IndexModel, ASCENDING, DESCENDING, TEXT
+from pymongo.errors import OperationFailure
+
+from keywords import top_keywords_pipeline
+from sentiment_queue import JOBS_COLLECTION
+from sentiment_cache import CACHE_COLLECTION
+from sentiment_rollup import ROLLUP_COLLECTION
+
+INDEXES = {
+    "users": [
+        # /register, /login; cũng chặn trùng username khi hai request đăng ký cùng lúc
+        IndexModel([("username", ASCENDING)], name="username_unique", unique=True),
+    ],
+    "entries": [
+        # /entries (sort date, _id giảm dần, from/to, cursor), /entries/export (duyệt ngược),
+        # đếm theo user, các lệnh backfill theo user
+        IndexModel([("user_id", ASCENDING), ("date", DESCENDING), ("_id", DESCENDING)], name="user_date_id"),
+        # /entries/negative-insights, top từ khóa tiêu cực, wordcloud scope=negative
+        IndexModel([("user_id", ASCENDING), ("is_negative", ASCENDING), ("date", DESCENDING)], name="user_negative_date"),
+        # /entries/search; mỗi collection chỉ có được một text index
+        IndexModel([("content", TEXT)], name="content_text"),
+        # backup incremental; chỉ document đã bị sửa mới có updated_at
+        IndexModel([("updated_at", ASCENDING)], name="updated_at", sparse=True),
+    ],
+    "emotion": [
+        # sửa/xóa entry, icon, trạng thái phân tích, /emotions trước migration 0001
+        IndexModel([("user_id", ASCENDING), ("entry_id", ASCENDING)], name="user_entry_unique", unique=True),
+        # tra emotion theo lô entry ($in) của migration, rollup, reclassify và $lookup của recover
+        IndexModel([("entry_id", ASCENDING)], name="entry_id"),
+        IndexModel([("updated_at", ASCENDING)], name="updated_at", sparse=True),
+    ],
+    JOBS_COLLECTION: [
+        # enqueue upsert theo entry_id: mỗi entry nhiều nhất một job
+        IndexModel([("entry_id", ASCENDING)], name="entry_id_unique", unique=True),
+        # worker nhận job pending (hoặc running hết lease) theo thứ tự queued_at
+        IndexModel([("status", ASCENDING), ("queued_at", ASCENDING)], name="status_queued"),
+        IndexModel([("claim", ASCENDING)], name="claim"),
+    ],
+    CACHE_COLLECTION: [
+        IndexModel([("version", ASCENDING)], name="version"),
+    ],
+    ROLLUP_COLLECTION: [
+        IndexModel([("user_id", ASCENDING), ("date", ASCENDING)], name="user_date_unique", unique=True),
+    ],
+}
+
+
+#============================================================================================
+def _key_of(info):
+    """Key của index từ index_information(); text index được quy về các field có weight."""
+    key = list(info["key"])
+    if ("_fts", "text") in key:
+        prefix = key[:key.index(("_fts", "text"))]
+        return tuple(prefix) + tuple((field, "text") for field in sorted(info.get("weights", {})))
+    return tuple((field, int(direction) if isinstance(direction, float) else direction) for field, direction in key)
+
+
+def _declared_key(model):
+    return tuple(model.document["key"].items())
+
+
+def status(db):
+    """Trạng thái từng index khai báo (present/missing/conflict) và các index không khai báo."""
+    rows = []
+    for collection, models in INDEXES.items():
+        existing = {_key_of(info): (name, info) for name, info in db[collection].index_information().items()}
+        declared = set()
+        for model in models:
+            key = _declared_key(model)
+            declared.add(key)
+            row = {"collection": collection, "name": model.document["name"], "key": key}
+            if key not in existing:
+                row["state"] = "missing"
+            elif bool(existing[key][1].get("unique")) != bool(model.document.get("unique")):
+                row["state"] = "conflict"
+                row["existing"] = existing[key][0]
+            else:
+                row["state"] = "present"
+                row["existing"] = existing[key][0]
+            rows.append(row)
+        for key, (name, _) in existing.items():
+            if name != "_id_" and key not in declared:
+                rows.append({"collection": collection, "name": name, "key": key, "state": "extra"})
+    return rows
+
+
+def ensure_indexes(db, log=print):
+    """Tạo các index khai báo còn thiếu. Trả về danh sách (collection, tên) đã tạo."""
+    created = []
+    for row in status(db):
+        if row["state"] == "conflict":
+            log(f"{row['collection']}.{row['existing']}: same key as {row['name']} but different unique option, not changed")
+        if row["state"] != "missing":
+            continue
+        model = next(m for m in INDEXES[row["collection"]] if m.document["name"] == row["name"])
+        try:
+            db[row["collection"]].create_indexes([model])
+        except OperationFailure as e:
+            # Ví dụ dữ liệu cũ có username trùng, hoặc đã có text index khác trên entries
+            log(f"{row['collection']}.{row['name']}: {e}")
+            continue
+        log(f"{row['collection']}.{row['name']}: created")
+        created.append((row["collection"], row["name"]))
+    return created
+
+
+def start_background_ensure(db, log=print):
+    """
+    ensure_indexes ở thread nền, để import app không chờ (hay lỗi vì) Mongo chưa kết nối
+    được; lỗi kết nối chỉ được ghi log.
+    """
+    def run():
+        try:
+            ensure_indexes(db, log)
+        except Exception as e:
+            log(f"Ensuring indexes failed: {e}")
+    thread = threading.Thread(target=run, name="ensure-indexes", daemon=True)
+    thread.start()
+    return thread
+
+
+#============================================================================================
+def query_shapes(user_id=None, entry_id=None):
+    """
+    Dạng truy vấn của các route và worker, viết như lệnh find/aggregate gửi cho explain.
+    Phần tử: (tên, lệnh, cho phép SORT trong bộ nhớ).
+    """
+    user_id = user_id or ObjectId()
+    entry_id = entry_id or ObjectId()
+    day = datetime.date.today().isoformat()
+    yesterday = datetime.datetime.utcnow() - datetime.timedelta(days=1)
+    newest = SON([("date", -1), ("_id", -1)])
+    date_range = {"$gte": "2000-01-01", "$lte": day}
+    return [
+        ("login", {"find": "users", "filter": {"username": "user"}, "limit": 1}, False),
+        ("entries", {"find": "entries", "filter": {"user_id": user_id}, "sort": newest}, False),
+        ("entries from/to", {"find": "entries", "filter": {"user_id": user_id, "date": date_range}, "sort": newest}, False),
+        ("entries cursor", {"find": "entries", "sort": newest, "limit": 51, "filter": {
+            "user_id": user_id,
+            "$or": [{"date": {"$lt": day}}, {"date": day, "_id": {"$lt": entry_id}}]
+        }}, False),
+        ("entries export", {"find": "entries", "filter": {"user_id": user_id},
+                            "sort": SON([("date", 1), ("_id", 1)])}, False),
+        ("entry update/delete", {"find": "entries", "filter": {"_id": entry_id, "user_id": user_id}, "limit": 1}, False),
+        ("emotions", {"find": "entries", "filter": {"user_id": user_id, "sentiment": {"$exists": True}}}, False),
+        ("emotions (legacy)", {"find": "emotion", "filter": {"user_id": user_id}}, False),
+        ("emotions dates", {"find": "entries", "filter": {"user_id": user_id, "_id": {"$in": [entry_id]}}}, False),
+        ("emotion by entry", {"find": "emotion", "filter": {"user_id": user_id, "entry_id": entry_id}, "limit": 1}, False),
+        ("emotions by entries", {"find": "emotion", "filter": {"entry_id": {"$in": [entry_id]}}}, False),
+        ("emotions/stats", {"find": ROLLUP_COLLECTION, "filter": {"user_id": user_id, "date": {"$gte": day}}}, False),
+        ("emotions/timeline", {"find": ROLLUP_COLLECTION, "filter": {"user_id": user_id}, "sort": {"date": 1}}, False),
+        # Sắp xếp theo textScore luôn làm trong bộ nhớ; chỉ cần text index được dùng
+        ("search", {"find": "entries", "filter": {"user_id": user_id, "$text": {"$search": "word"}},
+                    "projection": {"score": {"$meta": "textScore"}},
+                    "sort": {"score": {"$meta": "textScore"}}}, True),
+        ("wordcloud from/to", {"find": "entries", "filter": {"user_id": user_id, "date": date_range}}, False),
+        ("wordcloud negative from/to", {"find": "entries", "filter": {
+            "user_id": user_id, "date": date_range, "is_negative": True}}, False),
+        ("negative entries", {"find": "entries", "filter": {"user_id": user_id, "is_negative": True}}, False),
+        ("entry count", {"aggregate": "entries", "cursor": {}, "pipeline": [
+            {"$match": {"user_id": user_id}}, {"$group": {"_id": 1, "n": {"$sum": 1}}}]}, False),
+        ("top negative keywords", {"aggregate": "entries", "cursor": {},
+                                   "pipeline": top_keywords_pipeline(user_id)}, False),
+        ("terms backfill", {"find": "entries", "filter": {"user_id": user_id, "terms": {"$exists": False}}}, False),
+        ("sentiment status", {"find": JOBS_COLLECTION, "filter": {"entry_id": entry_id, "user_id": user_id}, "limit": 1}, False),
+        ("claim jobs", {"find": JOBS_COLLECTION, "sort": {"queued_at": 1}, "limit": 32, "filter": {"$or": [
+            {"status": "pending"},
+            {"status": "running", "claimed_at": {"$lt": datetime.datetime.utcnow()}}
+        ]}}, False),
+        ("claimed jobs", {"find": JOBS_COLLECTION, "filter": {"claim": ObjectId(), "status": "running"}}, False),
+        ("incremental backup", {"find": "entries", "filter": {"$or": [
+            {"_id": {"$gte": ObjectId.from_datetime(yesterday)}}, {"updated_at": {"$gte": yesterday}}
+        ]}}, False),
+    ]
+
+
+def _walk(plan, problems, allow_sort):
+    """Trả về tập stage trong cây plan, ghi vấn đề vào problems."""
+    stages = set()
+    for child in [plan.get("inputStage"), plan.get("queryPlan")] + plan.get("inputStages", []):
+        if child:
+            stages |= _walk(child, problems, allow_sort)
+    stage = plan.get("stage")
+    if stage == "COLLSCAN":
+        problems.append("COLLSCAN")
+    # SORT trên kết quả $group (vài chục dòng) thì không sao; chỉ lỗi khi sắp xếp document
+    elif stage == "SORT" and not allow_sort and "GROUP" not in stages:
+        problems.append("in-memory SORT")
+    if stage:
+        stages.add(stage)
+    return stages
+
+
+def plan_problems(explain, allow_sort=False):
+    """Tìm COLLSCAN/SORT trong các winningPlan của kết quả explain (find hoặc aggregate)."""
+    problems = []
+
+    def visit(node):
+        if isinstance(node, dict):
+            for key, value in node.items():
+                if key == "winningPlan":
+                    _walk(value, problems, allow_sort)
+                elif key not in ("rejectedPlans", "allPlansExecution"):
+                    visit(value)
+        elif isinstance(node, list):
+            for item in node:
+                visit(item)
+
+    visit(explain)
+    return problems
+
+
+def check(db, log=print):
+    """Chạy explain cho mọi dạng truy vấn. Trả về danh sách (tên, vấn đề); rỗng là đạt."""
+    failures = []
+    for row in status(db):
+        if row["state"] in ("missing", "conflict"):
+            failures.append((f"index {row['collection']}.{row['name']}", row["state"]))
+    for name, command, allow_sort in query_shapes():
+        explain = db.command("explain", command, verbosity="queryPlanner")
+        problems = plan_problems(explain, allow_sort)
+        log(f"{name:28} {', '.join(problems) if problems else 'ok'}")
+        failures.extend((name, p) for p in problems)
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create and verify MongoDB indexes")
+    parser.add_argument("command", choices=["ensure", "status", "check"])
+    parser.add_argument("--uri", default=os.environ.get("MONGO_URI", "mongodb://localhost:27017/emotional_diary_db"))
+    args = parser.parse_args()
+
+    db = MongoClient(args.uri).get_default_database()
+    if args.command == "ensure":
+        created = ensure_indexes(db)
+        print(f"Created {len(created)} indexes" if created else "All indexes present")
+    elif args.command == "status":
+        for row in status(db):
+            key = ", ".join(f"{field}:{direction}" for field, direction in row["key"])
+            print(f"{row['collection']:18} {row['name']:22} {row['state']:8} {key}")
+    else:
+        failures = check(db)
+        if failures:
+            print(f"{len(failures)} problems")
+            sys.exit(1)
+        print("All query shapes use indexes")
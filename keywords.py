@@ -0,0 +1,135 @@
+"""
+Từ khóa tiêu cực, stopwords (tiếng Việt và tiếng Anh) và bộ so khớp nhiều mẫu một lượt.
+
+KeywordMatcher dựng automaton Aho-Corasick từ danh sách từ khóa, nên đếm mọi từ khóa
+trong một văn bản chỉ tốn một lần duyệt, không phụ thuộc số từ khóa. Kết quả được
+tính khi ghi entry và lưu trên document (`negative_keywords`, `is_negative`), để
+/entries/negative-insights chỉ cần truy vấn theo index và aggregate.
+"""
+import datetime
+from collections import deque
+
+from pymongo import UpdateOne
+
+NEGATIVE_KEYWORDS = [
+    "lonely", "tired", "surviving", "vulnerable", "numb", "anxious",
+    "lost", "fragile", "hurt", "grief", "sadness", "not okay", "hopeless",
+    "empty", "broken", "afraid", "pain", "regret", "guilty", "worthless",
+    "buồn", "chán", "mệt", "stress", "lo lắng", "cô đơn", "tức giận", "thất vọng",
+    "khó chịu", "khóc", "đau", "sợ", "áp lực", "bực", "tệ", "không vui",
+    "không ổn", "không tốt", "bỏ cuộc", "thua", "ghét", "không thích"
+]
+
+# Stopwords dùng chung cho mọi wordcloud
+STOPWORDS_EN = {
+    "the", "and", "is", "a", "of", "to", "in", "it", "for", "on", "with",
+    "as", "at", "by", "an", "be", "this", "that", "i", "you", "he", "she",
+    "we", "they", "was", "were", "are", "am", "but", "or", "not", "so",
+    "if", "from", "my", "your", "his", "her", "their", "our", "me", "him",
+    "them", "us"
+}
+STOPWORDS_VI = {
+    "tôi", "mình", "bạn", "anh", "chị", "em", "của", "và", "là", "có", "được",
+    "cho", "với", "này", "kia", "đó", "những", "các", "một", "thì", "mà", "rất",
+    "như", "khi", "đã", "đang", "sẽ", "cũng", "nhưng", "vì", "nên", "để", "từ",
+    "trong", "ngoài", "người", "hôm", "nay", "lại", "còn", "vẫn", "thấy", "làm",
+    "đi", "ra", "vào", "lên", "xuống", "nữa", "quá", "hơn", "nhiều", "chỉ"
+}
+STOPWORDS = STOPWORDS_EN | STOPWORDS_VI
+# Từ ngắn hơn hoặc bằng độ dài này không đưa vào wordcloud
+MIN_TERM_LENGTH = 2
+
+
+class KeywordMatcher:
+    def __init__(self, keywords):
+        self.keywords = list(keywords)
+        # Mỗi node: bảng chuyển, liên kết fail, danh sách từ khóa kết thúc tại node
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+        for kw in self.keywords:
+            self._add(kw.lower(), kw)
+        self._build()
+
+    def _add(self, pattern, keyword):
+        node = 0
+        for ch in pattern:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            node = nxt
+        self._out[node].append(keyword)
+
+    def _build(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self._goto[node].items():
+                queue.append(nxt)
+                f = self._fail[node]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                self._fail[nxt] = self._goto[f].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def count(self, text):
+        """Trả về {từ khóa: số lần xuất hiện} trong text (không phân biệt hoa thường)."""
+        counts = {}
+        node = 0
+        for ch in text.lower():
+            while node and ch not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(ch, 0)
+            for kw in self._out[node]:
+                counts[kw] = counts.get(kw, 0) + 1
+        return counts
+
+
+negative_matcher = KeywordMatcher(NEGATIVE_KEYWORDS)
+
+
+def analyze_keywords(content, emotions):
+    """Các field lưu trên entry: số lần xuất hiện từng từ khóa tiêu cực và cờ is_negative."""
+    texts = [content or ""] + [em for em in (emotions or []) if isinstance(em, str)]
+    counts = {}
+    for text in texts:
+        for kw, n in negative_matcher.count(text).items():
+            counts[kw] = counts.get(kw, 0) + n
+    return {
+        "negative_keywords": [{"keyword": kw, "count": n} for kw, n in counts.items()],
+        "is_negative": bool(counts)
+    }
+
+
+def top_keywords_pipeline(user_id, limit=10):
+    """Aggregate các từ khóa tiêu cực xuất hiện nhiều nhất từ số đếm lưu trên entry."""
+    return [
+        {"$match": {"user_id": user_id, "is_negative": True}},
+        {"$unwind": "$negative_keywords"},
+        {"$group": {"_id": "$negative_keywords.keyword", "count": {"$sum": "$negative_keywords.count"}}},
+        {"$sort": {"count": -1}},
+        {"$limit": limit}
+    ]
+
+
+def backfill_keywords(entries_collection, user_id, batch_size=500):
+    """Tính keyword cho các entry cũ của user chưa có field is_negative."""
+    missing = entries_collection.find(
+        {"user_id": user_id, "is_negative": {"$exists": False}},
+        {"content": 1, "emotions": 1}
+    ).batch_size(batch_size)
+    ops = []
+    for entry in missing:
+        fields = analyze_keywords(entry.get("content"), entry.get("emotions"))
+        # updated_at để backup incremental ghi lại entry
+        fields["updated_at"] = datetime.datetime.utcnow()
+        ops.append(UpdateOne({"_id": entry["_id"]}, {"$set": fields}))
+        if len(ops) >= batch_size:
+            entries_collection.bulk_write(ops, ordered=False)
+            ops = []
+    if ops:
+        entries_collection.bulk_write(ops, ordered=False)
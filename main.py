@@ -1,16 +1,37 @@
 
 from flask import Flask, request, jsonify, render_template
 from flask_pymongo import PyMongo
-from bson.objectid import ObjectId
-from bson.json_util import dumps
+from pymongo.errors import DuplicateKeyError
 from flask_cors import CORS
 
 from collections import Counter
 import datetime
-import re
 import os
+import time
 
-from utils import hash_password, generate_token, decode_token, get_current_user, entry_to_json, classify_sentiment, get_random_icon
+STARTED_AT = time.monotonic()
+
+from utils import hash_password, generate_token, get_current_user, entry_to_json
+from utils import wants_stream, ndjson_response, STREAM_BATCH_SIZE, user_cache
+from api_common import parse_credentials, login_response, parse_entry_id, pending_entry, parse_entries_args, entries_page
+from api_common import ImportReport, EXPORT_PROJECTION, EXPORT_SORT, export_item, ENTRIES_SORT, icon_changes
+from api_common import entry_emotions_query, ENTRY_EMOTIONS_PROJECTION, entry_emotion_item, emotion_dates_query, emotion_items
+from api_common import text_search_query, TEXT_SEARCH_PROJECTION, TEXT_SEARCH_SORT, add_entry_terms, parse_search_args
+from api_common import parse_wordcloud_args, negative_insights_response, readiness, cache_gauges
+from sentiment_queue import create_queue
+from sentiment_rollup import sum_range, stats_range, to_chart
+from keywords import top_keywords_pipeline
+from term_index import TermIndex, to_wordcloud
+from search_index import SearchIndex
+from sentiment_timeline import TimelineStore, parse_timeline_args
+from sentiment_engine import get_engine, warmup, start_background_warmup
+from entry_repository import create_repository, build_entry, parse_entry_changes
+from migrations import MigrationStatus, ENTRY_SENTIMENT, USER_TERMS_TO_VERSIONS
+from data_versions import DataVersions, ResponseCache, conditional
+import indexes
+import metrics
+import fast_json
+import compression
 
 # Định nghĩa đường dẫn tới thư mục templates và static
 template_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), 'templates'))
@@ -18,17 +39,59 @@ static_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), 'static'))
 app = Flask(__name__, template_folder=template_dir, static_folder=static_dir)
 CORS(app)
 
-app.config["MONGO_URI"] = "mongodb://localhost:27017/emotional_diary_db"
+app.config["MONGO_URI"] = os.environ.get("MONGO_URI", "mongodb://localhost:27017/emotional_diary_db")
 app.config["SECRET_KEY"] = os.environ.get("SECRET_KEY", "supersecretkey")
-mongo = PyMongo(app)
+# Bỏ qua truy vấn users khi xác thực, chỉ dựa vào claim trong JWT đã ký
+app.config["AUTH_TRUST_CLAIMS"] = os.environ.get("AUTH_TRUST_CLAIMS", "0") == "1"
+user_cache.ttl = int(os.environ.get("AUTH_CACHE_TTL", 60))
+user_cache.max_size = int(os.environ.get("AUTH_CACHE_SIZE", 1024))
+# Serialize JSON bằng orjson (nếu có) và nén response lớn theo Accept-Encoding
+fast_json.init_app(app)
+compression.init_app(app, min_size=int(os.environ.get("COMPRESS_MIN_SIZE", 1024)))
+# Đo thời gian theo route và theo lệnh Mongo, xem tại /metrics
+metrics.init_app(app, slow_request_ms=float(os.environ.get("SLOW_REQUEST_MS", 0)))
+mongo = PyMongo(app, event_listeners=[metrics.mongo_listener])
+# Index được tạo khi deploy bằng `python indexes.py ensure`; ENSURE_INDEXES=1 thì app tự tạo
+# index còn thiếu ở thread nền, không chặn import khi Mongo chưa sẵn sàng
+if os.environ.get("ENSURE_INDEXES", "0") == "1":
+    indexes.start_background_ensure(mongo.db, log=app.logger.warning)
 entries_collection = mongo.db.entries
 users_collection = mongo.db.users
+# Phân tích cảm xúc chạy nền, không chặn request ghi entry
+sentiment_queue = create_queue(mongo.db)
+sentiment_queue.start()
+# Tổng tần suất từ đọc từ user_terms cũ cho user chưa được migration 0003 chuyển sang
+term_index = TermIndex(mongo.db, MigrationStatus(mongo.db, USER_TERMS_TO_VERSIONS))
+data_versions = DataVersions(mongo.db)
+# Chỉ mục tìm kiếm trong process cho /search, giữ tối đa SEARCH_INDEX_USERS user (LRU)
+search_index = SearchIndex(mongo.db, data_versions, max_users=int(os.environ.get("SEARCH_INDEX_USERS", 1000)))
+# Chuỗi số entry theo ngày (dạng cột NumPy) cho /emotions/timeline, tối đa TIMELINE_USERS user (LRU)
+timeline_store = TimelineStore(mongo.db, data_versions, max_users=int(os.environ.get("TIMELINE_USERS", 1000)))
+entry_repository = create_repository(mongo.cx, mongo.db, sentiment_queue, data_versions, search_index)
+# Route đọc trả ETag theo version dữ liệu của user (304 khi không đổi); cache response nếu RESPONSE_CACHE_SIZE > 0
+response_cache = ResponseCache(int(os.environ.get("RESPONSE_CACHE_SIZE", 0)))
+versioned = conditional(data_versions, lambda: get_current_user(users_collection), response_cache, stream=wants_stream)
+# sentiment/icon nằm trên entry sau khi chạy `python migrations.py migrate`; trước đó đọc từ emotion
+entry_sentiment_migrated = MigrationStatus(mongo.db, ENTRY_SENTIMENT)
+# Nạp model NLP: eager = ngay lúc import (dùng với gunicorn --preload để các worker chia sẻ
+# model theo copy-on-write), background = thread nền (mặc định), lazy = khi cần lần đầu
+SENTIMENT_PRELOAD = os.environ.get("SENTIMENT_PRELOAD", "background")
+if SENTIMENT_PRELOAD == "eager":
+    warmup()
+elif SENTIMENT_PRELOAD == "background":
+    start_background_warmup()
+startup_stats = {"import_seconds": round(time.monotonic() - STARTED_AT, 3), "first_request_seconds": None}
+
+@app.before_request
+def ensure_background_workers():
+    # Worker được fork sau khi import cần tự khởi động lại các thread nền
+    sentiment_queue.start()
+    if startup_stats["first_request_seconds"] is None:
+        startup_stats["first_request_seconds"] = round(time.monotonic() - STARTED_AT, 3)
 #============================================================================================
 @app.route("/register", methods=["POST"])
 def register():
-    data = request.get_json()
-    username = data.get("username", "").strip()
-    password = data.get("password", "")
+    username, password = parse_credentials(request.get_json())
     if not username or not password:
         return jsonify({"error": "Username and password required"}), 400
     if users_collection.find_one({"username": username}):
@@ -37,23 +100,21 @@ def register():
         "username": username,
         "password": hash_password(password)
     }
-    result = users_collection.insert_one(user)
+    try:
+        users_collection.insert_one(user)
+    except DuplicateKeyError:
+        # Hai request đăng ký cùng username cùng lúc: index username_unique chặn bản thứ hai
+        return jsonify({"error": "Username already exists"}), 400
     return jsonify({"message": "User registered"}), 201
 #============================================================================================
 @app.route("/login", methods=["POST"])
 def login():
-    data = request.get_json()
-    username = data.get("username", "").strip()
-    password = data.get("password", "")
+    username, password = parse_credentials(request.get_json())
     user = users_collection.find_one({"username": username})
     if not user or user["password"] != hash_password(password):
         return jsonify({"error": "Invalid username or password"}), 401
     token = generate_token(user["_id"], username)
-    return jsonify({
-        "token": token,
-        "username": username,
-        "user_id": str(user["_id"])
-    }), 200
+    return jsonify(login_response(user, token)), 200
 #============================================================================================
 @app.route("/entries", methods=["POST"])
 def create_entry():
@@ -61,137 +122,130 @@ def create_entry():
     if not user:
         return jsonify({"error": "Unauthorized"}), 401
     data = request.get_json()
-    if not data or "date" not in data or "content" not in data:
-        return jsonify({"error": "Missing required fields: date, content"}), 400
-    date = data["date"]
-    try:
-        datetime.datetime.strptime(date, "%Y-%m-%d")
-    except ValueError:
-        return jsonify({"error": "Date must be in YYYY-MM-DD format"}), 400
-    content = data["content"]
-    emotions = data.get("emotions", [])
-    if not isinstance(emotions, list):
-        return jsonify({"error": "Emotions must be a list of strings"}), 400
-    icon = data.get("icon")
-    entry = {
-        "date": date,
-        "content": content,
-        "emotions": emotions,
-        "user_id": user["_id"]
-    }
-    result = entries_collection.insert_one(entry)
-    new_entry = entries_collection.find_one({"_id": result.inserted_id})
-    # --- PHÂN TÍCH CẢM XÚC VÀ LƯU VÀO DB ---
-    emotion_col = mongo.db.emotion
-    sentiment = classify_sentiment(content)
-    # Nếu user chọn icon thì dùng, không thì random
-    from utils import get_random_icon
-    if not icon:
-        icon = get_random_icon(sentiment)
-    emotion_doc = {
-        "user_id": user["_id"],
-        "entry_id": new_entry["_id"],
-        "content": content,
-        "sentiment": sentiment,
-        "icon": icon
-    }
-    emotion_col.replace_one(
-        {"user_id": user["_id"], "entry_id": new_entry["_id"]},
-        emotion_doc,
-        upsert=True
-    )
-    # --- KẾT THÚC PHÂN TÍCH ---
-    return jsonify(entry_to_json(new_entry)), 201
+    entry, icon, error = build_entry(data, user["_id"])
+    if error:
+        return jsonify({"error": error}), 400
+    # Phân tích cảm xúc được worker nền xử lý; icon user chọn (nếu có) đi kèm job
+    new_entry = entry_repository.create(entry, icon)
+    return jsonify(pending_entry(new_entry)), 201
 #============================================================================================
 @app.route("/entries", methods=["GET"])
+@versioned
 def get_all_entries():
+    """
+    Lấy entries của user, mới nhất trước.
+    Query params (đều tùy chọn):
+        - from, to: lọc theo ngày (YYYY-MM-DD, bao gồm cả hai đầu)
+        - fields: danh sách field cách nhau bởi dấu phẩy, ví dụ fields=date,emotions
+        - limit: bật phân trang theo cursor trên (date, _id); trả về {"entries", "next_cursor"}
+        - cursor: next_cursor của trang trước
+    Không có limit/cursor thì trả về toàn bộ danh sách như trước; danh sách này có
+    thể stream dạng NDJSON (Accept: application/x-ndjson hoặc stream=1).
+    """
     user = get_current_user(users_collection)
     if not user:
         return jsonify({"error": "Unauthorized"}), 401
     # Chỉ cho phép lấy entries của chính user đó
-    entries = entries_collection.find({"user_id": user["_id"]}).sort("date", -1)
-    all_entries = [entry_to_json(entry) for entry in entries]
-    return jsonify(all_entries), 200
+    listing, error = parse_entries_args(user["_id"], request.args)
+    if error:
+        return jsonify({"error": error}), 400
+    fields = listing["fields"]
+    entries = entries_collection.find(listing["query"], listing["projection"]).sort(ENTRIES_SORT)
+    if listing["limit"] is None:
+        if wants_stream():
+            entries = entries.batch_size(STREAM_BATCH_SIZE)
+            return ndjson_response(entry_to_json(entry, fields) for entry in entries)
+        return jsonify([entry_to_json(entry, fields) for entry in entries]), 200
+    # Lấy thêm 1 document để biết còn trang sau hay không
+    return jsonify(entries_page(list(entries.limit(listing["limit"] + 1)), listing)), 200
+#============================================================================================
+@app.route("/entries/import", methods=["POST"])
+def import_entries():
+    """
+    Nhập entries hàng loạt từ body NDJSON (mỗi dòng một entry như body của POST /entries).
+    Body được đọc dần từng dòng, ghi theo lô bằng insert_many không thứ tự; cảm xúc
+    được phân tích theo lô ở worker nền. Trả về số entry đã nhập và lỗi theo từng dòng.
+    """
+    user = get_current_user(users_collection)
+    if not user:
+        return jsonify({"error": "Unauthorized"}), 401
+    report = ImportReport(user["_id"])
+    for line_no, raw in enumerate(iter(request.stream.readline, b""), start=1):
+        if report.add_line(line_no, raw):
+            report.written(entry_repository.create_many(user["_id"], report.batch()))
+    if report.batch():
+        report.written(entry_repository.create_many(user["_id"], report.batch()))
+    body, status = report.response()
+    return jsonify(body), status
+#============================================================================================
+@app.route("/entries/export", methods=["GET"])
+@versioned
+def export_entries():
+    """Xuất toàn bộ entries của user dạng NDJSON, có thể nhập lại bằng /entries/import."""
+    user = get_current_user(users_collection)
+    if not user:
+        return jsonify({"error": "Unauthorized"}), 401
+    entries = entries_collection.find(
+        {"user_id": user["_id"]}, EXPORT_PROJECTION
+    ).sort(EXPORT_SORT).batch_size(STREAM_BATCH_SIZE)
+    response = ndjson_response(export_item(e) for e in entries)
+    response.headers["Content-Disposition"] = "attachment; filename=entries.ndjson"
+    return response
 #============================================================================================
 @app.route("/entries/<entry_id>", methods=["GET"])
 def get_entry(entry_id):
-    try:
-        entry = entries_collection.find_one({"_id": ObjectId(entry_id)})
-        if not entry:
-            return jsonify({"error": "Entry not found"}), 404
-        return jsonify(entry_to_json(entry)), 200
-    except Exception:
-        return jsonify({"error": "Invalid entry ID"}), 400
+    oid, error = parse_entry_id(entry_id)
+    if error:
+        return jsonify({"error": error}), 400
+    entry = entries_collection.find_one({"_id": oid})
+    if not entry:
+        return jsonify({"error": "Entry not found"}), 404
+    return jsonify(entry_to_json(entry)), 200
 #============================================================================================
 @app.route("/entries/<entry_id>", methods=["PUT"])
 def update_entry(entry_id):
     user = get_current_user(users_collection)
     if not user:
         return jsonify({"error": "Unauthorized"}), 401
-    data = request.get_json()
-    if not data:
-        return jsonify({"error": "No update data provided"}), 400
-    update_data = {}
-    if "date" in data:
-        date = data["date"]
-        try:
-            datetime.datetime.strptime(date, "%Y-%m-%d")
-            update_data["date"] = date
-        except ValueError:
-            return jsonify({"error": "Date must be in YYYY-MM-DD format"}), 400
-    if "content" in data:
-        update_data["content"] = data["content"]
-    if "emotions" in data:
-        emotions = data["emotions"]
-        if not isinstance(emotions, list):
-            return jsonify({"error": "Emotions must be a list of strings"}), 400
-        update_data["emotions"] = emotions
-    icon = data.get("icon")
-    if not update_data and not icon:
-        return jsonify({"error": "No valid fields provided to update"}), 400
-    entry = entries_collection.find_one({"_id": ObjectId(entry_id)})
-    if not entry or entry["user_id"] != user["_id"]:
+    oid, error = parse_entry_id(entry_id)
+    if error:
+        return jsonify({"error": error}), 400
+    update_data, icon, error = parse_entry_changes(request.get_json())
+    if error:
+        return jsonify({"error": error}), 400
+    # Phân tích lại cảm xúc ở worker nền
+    updated_entry = entry_repository.update(user["_id"], oid, update_data, icon)
+    if not updated_entry:
         return jsonify({"error": "Entry not found or unauthorized"}), 404
-    if update_data:
-        entries_collection.update_one({"_id": ObjectId(entry_id)}, {"$set": update_data})
-    updated_entry = entries_collection.find_one({"_id": ObjectId(entry_id)})
-    # --- PHÂN TÍCH CẢM XÚC VÀ LƯU VÀO DB (khi sửa) ---
-    emotion_col = mongo.db.emotion
-    content = updated_entry["content"]
-    sentiment = classify_sentiment(content)
-    from utils import get_random_icon
-    if not icon:
-        icon = get_random_icon(sentiment)
-    emotion_doc = {
-        "user_id": user["_id"],
-        "entry_id": updated_entry["_id"],
-        "content": content,
-        "sentiment": sentiment,
-        "icon": icon
-    }
-    emotion_col.replace_one(
-        {"user_id": user["_id"], "entry_id": updated_entry["_id"]},
-        emotion_doc,
-        upsert=True
-    )
-    # --- KẾT THÚC PHÂN TÍCH ---
-    return jsonify(entry_to_json(updated_entry)), 200
+    return jsonify(pending_entry(updated_entry)), 200
+#============================================================================================
+@app.route("/entries/<entry_id>/sentiment", methods=["GET"])
+def get_entry_sentiment(entry_id):
+    """
+    Trạng thái phân tích cảm xúc của một entry, để client poll sau khi tạo/sửa.
+    Trả về status: 'pending', 'failed' (kèm error), 'done' (kèm sentiment, icon) hoặc 'missing'.
+    """
+    user = get_current_user(users_collection)
+    if not user:
+        return jsonify({"error": "Unauthorized"}), 401
+    oid, error = parse_entry_id(entry_id)
+    if error:
+        return jsonify({"error": error}), 400
+    result = sentiment_queue.status(user["_id"], oid)
+    result["entry_id"] = entry_id
+    return jsonify(result), 200
 #============================================================================================
 @app.route("/entries/<entry_id>", methods=["DELETE"])
 def delete_entry(entry_id):
     user = get_current_user(users_collection)
     if not user:
         return jsonify({"error": "Unauthorized"}), 401
-    entry = entries_collection.find_one({"_id": ObjectId(entry_id)})
-    if not entry or entry["user_id"] != user["_id"]:
+    oid, error = parse_entry_id(entry_id)
+    if error:
+        return jsonify({"error": error}), 400
+    # Xóa cả dữ liệu phân tích cảm xúc liên quan
+    if not entry_repository.delete(user["_id"], oid):
         return jsonify({"error": "Entry not found or unauthorized"}), 404
-    result = entries_collection.delete_one({"_id": ObjectId(entry_id)})
-    # --- XÓA DỮ LIỆU PHÂN XÍCH CẢM XÚC LIÊN QUAN ---
-    emotion_col = mongo.db.emotion
-    emotion_col.delete_one({"user_id": user["_id"], "entry_id": ObjectId(entry_id)})
-    # --- KẾT THÚC XÓA ---
-    if result.deleted_count == 0:
-        return jsonify({"error": "Entry not found"}), 404
     return jsonify({"message": "Entry deleted"}), 200
 #============================================================================================
 @app.route("/")
@@ -206,180 +260,223 @@ def diary():
 def charts():
     return render_template("charts.html")
 
+@app.route("/healthz")
+def healthz():
+    """Liveness: process đang chạy và phục vụ được request."""
+    return jsonify({
+        "status": "ok",
+        "uptime_seconds": round(time.monotonic() - STARTED_AT, 3),
+        "startup": startup_stats
+    }), 200
+
+@app.route("/readyz")
+def readyz():
+    """Readiness: báo riêng trạng thái MongoDB và model NLP; 503 nếu một trong hai chưa sẵn sàng."""
+    try:
+        mongo.db.command("ping")
+        mongo_ready = True
+    except Exception:
+        mongo_ready = False
+    body, status = readiness(mongo_ready, get_engine(), SENTIMENT_PRELOAD)
+    return jsonify(body), status
+
+@app.route("/metrics")
+def metrics_endpoint():
+    """Số liệu theo định dạng text của Prometheus (của process hiện tại)."""
+    extra = cache_gauges(user_cache, sentiment_queue, response_cache, search_index, timeline_store)
+    return app.response_class(metrics.render(extra), mimetype="text/plain; version=0.0.4")
+
 #============================================================================================
+def iter_entry_emotions(user_id):
+    """Sentiment/icon lưu trên entry: một truy vấn theo index user_id, chỉ lấy các field cần."""
+    entries = entries_collection.find(
+        entry_emotions_query(user_id), ENTRY_EMOTIONS_PROJECTION
+    ).batch_size(STREAM_BATCH_SIZE)
+    for entry in entries:
+        yield entry_emotion_item(entry)
+
+def iter_emotions_with_dates(user_id):
+    """Duyệt emotion của user theo lô, mỗi lô lấy ngày của entry bằng một truy vấn $in."""
+    emotion_col = mongo.db.emotion
+    emotions = emotion_col.find({"user_id": user_id}).batch_size(STREAM_BATCH_SIZE)
+    batch = []
+    for emo in emotions:
+        batch.append(emo)
+        if len(batch) >= STREAM_BATCH_SIZE:
+            yield from _attach_dates(user_id, batch)
+            batch = []
+    if batch:
+        yield from _attach_dates(user_id, batch)
+
+def _attach_dates(user_id, emotions):
+    return emotion_items(emotions, entries_collection.find(emotion_dates_query(user_id, emotions), {"date": 1}))
+
 @app.route("/emotions", methods=["GET"])
+@versioned
 def get_emotions():
     user = get_current_user(users_collection)
     if not user:
         return jsonify({"error": "Unauthorized"}), 401
-    emotion_col = mongo.db.emotion
     # Chỉ lấy emotions của user hiện tại
-    emotions = list(emotion_col.find({"user_id": user["_id"]}))
-    entries = list(entries_collection.find({"user_id": user["_id"]}))
-    entry_id_to_date = {str(e["_id"]): e["date"] for e in entries}
-    result = []
-    for emo in emotions:
-        item = {
-            "entry_id": str(emo.get("entry_id")),
-            "sentiment": emo.get("sentiment", ""),
-            "icon": emo.get("icon", "")
-        }
-        entry_id = str(emo.get("entry_id"))
-        if entry_id in entry_id_to_date:
-            item["date"] = entry_id_to_date[entry_id]
-        result.append(item)
-    return jsonify(result), 200
+    if entry_sentiment_migrated.done():
+        emotions = iter_entry_emotions(user["_id"])
+    else:
+        emotions = iter_emotions_with_dates(user["_id"])
+    if wants_stream():
+        return ndjson_response(emotions)
+    return jsonify(list(emotions)), 200
 
 #============================================================================================
 @app.route("/emotions/stats", methods=["GET"])
+@versioned
 def get_emotion_stats():
     """
     API trả về tổng số lần xuất hiện từng loại cảm xúc trong last week/last month/last year.
     Tham số:
         - period: 'week', 'month', 'year'
+        - from, to: khoảng ngày tùy ý (YYYY-MM-DD), ưu tiên hơn period
+    Số liệu đọc từ rollup theo ngày (sentiment_rollup.py), không join sang entries.
     """
     user = get_current_user(users_collection)
     if not user:
         return jsonify({"error": "Unauthorized"}), 401
-    period = request.args.get("period", "month")  # default: month
-
-    now = datetime.datetime.now()
-    if period == "week":
-        start_date = now - datetime.timedelta(days=7)
-    elif period == "month":
-        start_date = now - datetime.timedelta(days=30)
-    elif period == "year":
-        start_date = now - datetime.timedelta(days=365)
-    else:
-        start_date = now - datetime.timedelta(days=30)
+    start, end, error = stats_range(request.args.get("period", "month"), request.args.get("from"), request.args.get("to"))
+    if error:
+        return jsonify({"error": error}), 400
+    return jsonify(to_chart(sum_range(mongo.db, user["_id"], start, end))), 200
 
-    # Sử dụng aggregation pipeline để join emotion với entries và lọc theo ngày
-    pipeline = [
-        {
-            "$match": {
-                "user_id": user["_id"]
-            }
-        },
-        {
-            "$lookup": {
-                "from": "entries",
-                "localField": "entry_id",
-                "foreignField": "_id",
-                "as": "entry"
-            }
-        },
-        {
-            "$unwind": "$entry"
-        },
-        {
-            "$addFields": {
-                "entry_date": {
-                    "$dateFromString": {
-                        "dateString": "$entry.date",
-                        "format": "%Y-%m-%d"
-                    }
-                }
-            }
-        },
-        {
-            "$match": {
-                "entry_date": {"$gte": start_date}
-            }
-        },
-        {
-            "$group": {
-                "_id": "$sentiment",
-                "count": {"$sum": 1}
-            }
-        }
-    ]
-
-    emotion_col = mongo.db.emotion
-    agg_result = list(emotion_col.aggregate(pipeline))
-
-    # Đảm bảo đủ 3 loại cảm xúc
-    all_sentiments = ["positive", "neutral", "negative"]
-    sentiment_counter = {s: 0 for s in all_sentiments}
-    for item in agg_result:
-        sentiment = item["_id"]
-        if sentiment in sentiment_counter:
-            sentiment_counter[sentiment] = item["count"]
-
-    data = [sentiment_counter[s] for s in all_sentiments]
-
-    result = {
-        "labels": [s.capitalize() for s in all_sentiments],
-        "datasets": [{
-            "label": "Emotion Count",
-            "data": data,
-            "backgroundColor": ["#81c784", "#fff176", "#e57373"]
-        }]
-    }
-    return jsonify(result), 200
+@app.route("/emotions/timeline", methods=["GET"])
+@versioned
+def get_emotion_timeline():
+    """
+    Số entry theo cảm xúc, điểm tâm trạng, trung bình trượt và chuỗi ngày liên tiếp theo
+    thời gian (sentiment_timeline.py).
+    Query params:
+        - bucket: 'day' (mặc định), 'week', 'month'
+        - from, to: khoảng ngày (YYYY-MM-DD); không có thì theo period
+        - period: 'week', 'month', 'year' (mặc định), 'all'
+        - points: số điểm tối đa (mặc định 365, tối đa 2000), khoảng liền nhau được gộp lại
+        - window: số khoảng của trung bình trượt (mặc định 7 ngày / 4 tuần / 3 tháng)
+    """
+    user = get_current_user(users_collection)
+    if not user:
+        return jsonify({"error": "Unauthorized"}), 401
+    params, error = parse_timeline_args(request.args)
+    if error:
+        return jsonify({"error": error}), 400
+    timeline, error = timeline_store.timeline(user["_id"], **params)
+    if error:
+        return jsonify({"error": error}), 400
+    return jsonify(timeline), 200
 #============================================================================================
 @app.route("/emotions/<entry_id>/icon", methods=["PUT"])
 def update_emotion_icon(entry_id):
     user = get_current_user(users_collection)
     if not user:
         return jsonify({"error": "Unauthorized"}), 401
-    data = request.get_json()
-    icon = data.get("icon")
-    if not icon:
-        return jsonify({"error": "No icon provided"}), 400
+    changes, error = icon_changes(request.get_json(), datetime.datetime.utcnow())
+    if error:
+        return jsonify({"error": error}), 400
+    oid, error = parse_entry_id(entry_id)
+    if error:
+        return jsonify({"error": error}), 400
     emotion_col = mongo.db.emotion
     result = emotion_col.update_one(
-        {"user_id": user["_id"], "entry_id": ObjectId(entry_id)},
-        {"$set": {"icon": icon}}
+        {"user_id": user["_id"], "entry_id": oid},
+        {"$set": changes}
     )
     if result.matched_count == 0:
         return jsonify({"error": "Emotion not found"}), 404
+    entries_collection.update_one({"_id": oid, "user_id": user["_id"]}, {"$set": changes})
+    data_versions.bump(user["_id"])
     return jsonify({"message": "Icon updated"}), 200
 #============================================================================================
 @app.route("/entries/search", methods=["GET"])
+@versioned
 def search_entries():
     """
     Tìm kiếm entry theo keyword, trả về danh sách entries và wordcloud.
     Query params:
         - q: từ khóa tìm kiếm
+        - stream=1 (hoặc Accept: application/x-ndjson): trả về NDJSON, mỗi dòng một
+          entry, dòng cuối là {"wordcloud": [...]}
     """
     user = get_current_user(users_collection)
     if not user:
         return jsonify({"error": "Unauthorized"}), 401
-    
-    keyword = request.args.get("q", "").strip()
-    if not keyword:
-        return jsonify({"error": "No keyword provided"}), 400
-
-    # Đảm bảo đã tạo text index trên content: db.entries.createIndex({content: "text"})
-    query = {
-        "user_id": user["_id"],
-        "$text": {"$search": keyword}
-    }
-    projection = {"score": {"$meta": "textScore"}}
-    entries = list(entries_collection.find(query, projection).sort([("score", {"$meta": "textScore"})]))
-    entry_list = [entry_to_json(e) for e in entries]
+    query, error = text_search_query(user["_id"], request.args)
+    if error:
+        return jsonify({"error": error}), 400
 
-    # Tạo wordcloud: đếm tần suất các từ xuất hiện trong các entry tìm được
-    words = []
-    for e in entries:
-        content = e.get("content", "")
-        # Tách từ, loại bỏ ký tự đặc biệt, chuyển về lower
-        words += re.findall(r'\b\w+\b', content.lower())
-    # Loại bỏ stopwords đơn giản
-    stopwords = set(["the", "and", "is", "a", "of", "to", "in", "it", "for", "on", "with", "as", "at", "by", "an", "be", "this", "that", "i", "you", "he", "she", "we", "they", "was", "were", "are", "am", "but", "or", "not", "so", "if", "from", "my", "your", "his", "her", "their", "our", "me", "him", "them", "us"])
-    filtered_words = [w for w in words if w not in stopwords and len(w) > 2]
-    word_freq = Counter(filtered_words)
-    wordcloud = [{"text": w, "value": c} for w, c in word_freq.most_common(50)]
+    cursor = entries_collection.find(query, TEXT_SEARCH_PROJECTION).sort(TEXT_SEARCH_SORT)
+    word_freq = Counter()
+    if wants_stream():
+        cursor = cursor.batch_size(STREAM_BATCH_SIZE)
+        def generate():
+            for e in cursor:
+                yield add_entry_terms(word_freq, e)
+            yield {"wordcloud": to_wordcloud(word_freq)}
+        return ndjson_response(generate())
 
+    entry_list = [add_entry_terms(word_freq, e) for e in cursor]
     return jsonify({
         "entries": entry_list,
-        "wordcloud": wordcloud
+        "wordcloud": to_wordcloud(word_freq)
     }), 200
 #============================================================================================
+@app.route("/search", methods=["GET"])
+@versioned
+def search():
+    """
+    Tìm entry bằng chỉ mục trong process (search_index.py): không phân biệt dấu, từ cuối
+    khớp theo tiền tố, xếp hạng BM25, trả về đoạn trích thay vì cả entry.
+    Query params:
+        - q: từ khóa
+        - from, to: khoảng ngày (YYYY-MM-DD)
+        - limit (mặc định 20, tối đa 100), offset
+    """
+    user = get_current_user(users_collection)
+    if not user:
+        return jsonify({"error": "Unauthorized"}), 401
+    params, error = parse_search_args(request.args)
+    if error:
+        return jsonify({"error": error}), 400
+    return jsonify(search_index.search(user["_id"], **params)), 200
+
+@app.route("/search/suggest", methods=["GET"])
+@versioned
+def search_suggest():
+    """Gợi ý từ theo tiền tố của từ cuối trong q (không phân biệt dấu), để tìm khi đang gõ."""
+    user = get_current_user(users_collection)
+    if not user:
+        return jsonify({"error": "Unauthorized"}), 401
+    return jsonify({"suggestions": search_index.suggest(user["_id"], request.args.get("q", ""))}), 200
+#============================================================================================
+@app.route("/entries/wordcloud", methods=["GET"])
+@versioned
+def entries_wordcloud():
+    """
+    Wordcloud từ chỉ mục tần suất từ.
+    Query params:
+        - scope: 'all' (mặc định) hoặc 'negative'
+        - from, to: chỉ tính các entry trong khoảng ngày (YYYY-MM-DD)
+    """
+    user = get_current_user(users_collection)
+    if not user:
+        return jsonify({"error": "Unauthorized"}), 401
+    parsed, error = parse_wordcloud_args(user["_id"], request.args)
+    if error:
+        return jsonify({"error": error}), 400
+    scope, query = parsed
+    if query is None:
+        return jsonify({"wordcloud": term_index.wordcloud(user["_id"], scope)}), 200
+    return jsonify({"wordcloud": term_index.wordcloud_for(entries_collection, query, scope)}), 200
+#============================================================================================
 @app.route("/entries/negative-insights", methods=["GET"])
+@versioned
 def negative_insights():
     """
-    Phân tích tiêu cực: 
+    Phân tích tiêu cực:
     - Trả về danh sách entry chứa từ tiêu cực.
     - Thống kê số entry tiêu cực, tổng số entry, tỷ lệ tiêu cực (%).
     - Wordcloud các từ tiêu cực xuất hiện nhiều nhất.
@@ -389,72 +486,15 @@ def negative_insights():
     if not user:
         return jsonify({"error": "Unauthorized"}), 401
 
-    NEGATIVE_KEYWORDS = [
-        "lonely", "tired", "surviving", "vulnerable", "numb", "anxious", 
-        "lost", "fragile", "hurt", "grief", "sadness", "not okay", "hopeless",
-        "empty", "broken", "afraid", "pain", "regret", "guilty", "worthless",
-        "buồn", "chán", "mệt", "stress", "lo lắng", "cô đơn", "tức giận", "thất vọng", 
-        "khó chịu", "khóc", "đau", "sợ", "áp lực", "bực", "tệ", "không vui", 
-        "không ổn", "không tốt", "bỏ cuộc", "thua", "ghét", "không thích"
-    ]
-
-    regex_list = [{"content": {"$regex": kw, "$options": "i"}} for kw in NEGATIVE_KEYWORDS]
-    regex_list += [{"emotions": {"$regex": kw, "$options": "i"}} for kw in NEGATIVE_KEYWORDS]
-
-    query = {
-        "user_id": user["_id"],
-        "$or": regex_list
-    }
-
-    all_entries = list(entries_collection.find({"user_id": user["_id"]}))
-    negative_entries = list(entries_collection.find(query))
-    entry_list = [entry_to_json(e) for e in negative_entries]
-
-    # Wordcloud cho các entry tiêu cực
-    words = []
-    for e in negative_entries:
-        content = e.get("content", "")
-        words += re.findall(r'\b\w+\b', content.lower())
-        if isinstance(e.get("emotions", None), list):
-            words += [em.lower() for em in e["emotions"] if isinstance(em, str)]
-            
-    stopwords = set([
-        "the", "and", "is", "a", "of", "to", "in", "it", "for", "on", "with", 
-        "as", "at", "by", "an", "be", "this", "that", "i", "you", "he", "she", 
-        "we", "they", "was", "were", "are", "am", "but", "or", "not", "so", 
-        "if", "from", "my", "your", "his", "her", "their", "our", "me", "him", 
-        "them", "us"
-    ])
-    filtered_words = [w for w in words if w not in stopwords and len(w) > 2]
-    word_freq = Counter(filtered_words)
-    wordcloud = [{"text": w, "value": c} for w, c in word_freq.most_common(50)]
-
-    # Thống kê số entry tiêu cực, tổng số entry, tỷ lệ
-    total_entries = len(all_entries)
-    negative_count = len(negative_entries)
-    negative_ratio = round(negative_count / total_entries * 100, 2) if total_entries else 0
-
-    # Thống kê top từ tiêu cực lặp lại nhiều nhất trong các entry tiêu cực
-    negative_word_counts = {kw: 0 for kw in NEGATIVE_KEYWORDS}
-    for e in negative_entries:
-        text = (e.get("content", "") + " " + " ".join(e.get("emotions", []))).lower()
-        for kw in NEGATIVE_KEYWORDS:
-            if kw in text:
-                negative_word_counts[kw] += text.count(kw)
-    
-    top_negative_words = sorted(
-        [{"keyword": k, "count": v} for k, v in negative_word_counts.items() if v > 0],
-        key=lambda x: x["count"], reverse=True
-    )[:10]
-
-    return jsonify({
-        "entries": entry_list,
-        "wordcloud": wordcloud,
-        "negative_count": negative_count,
-        "total_entries": total_entries,
-        "negative_ratio": negative_ratio,
-        "top_negative_words": top_negative_words
-    }), 200
+    # Entry cũ chưa có is_negative/negative_keywords/terms được tính bù bằng migration 0002
+    return jsonify(negative_insights_response(
+        list(entries_collection.find({"user_id": user["_id"], "is_negative": True})),
+        # Wordcloud cho các entry tiêu cực, đọc từ chỉ mục tần suất từ
+        term_index.wordcloud(user["_id"], "negative"),
+        entries_collection.count_documents({"user_id": user["_id"]}),
+        # Top từ tiêu cực từ số đếm đã lưu trên từng entry
+        list(entries_collection.aggregate(top_keywords_pipeline(user["_id"])))
+    )), 200
 
 if __name__ == "__main__":
     app.run(debug=True)
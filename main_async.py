@@ -0,0 +1,597 @@
+"""
+Chế độ phục vụ bất đồng bộ (asyncio) của API nhật ký: cùng các route với main.py,
+chạy trên Quart với driver Motor, để một process phục vụ nhiều client đồng thời
+mà không cần tăng số thread.
+
+    hypercorn main_async:app --bind 0.0.0.0:5000 --workers 2
+    python main_async.py
+
+- Route đọc truy vấn bằng Motor; các truy vấn độc lập chạy đồng thời bằng asyncio.gather
+  (ví dụ /entries/negative-insights).
+- Route ghi dùng lại EntryRepository (PyMongo đồng bộ: transaction, term index, job cảm
+  xúc) trong một thread pool nhỏ (WRITE_THREADS) để không chặn event loop.
+- Phân loại cảm xúc (tốn CPU) của worker nền chạy trong process pool (SENTIMENT_PROCESSES),
+  không tranh GIL với event loop; SENTIMENT_PROCESSES=0 thì chạy ngay trong thread worker.
+- Kích thước pool kết nối Motor: MONGO_MAX_POOL_SIZE, MONGO_MIN_POOL_SIZE.
+
+Đọc tham số, dựng truy vấn và định dạng response dùng chung với main.py qua api_common.py;
+file này chỉ chạy truy vấn bằng Motor. Nén response dùng compression.init_async_app.
+"""
+import asyncio
+import datetime
+import functools
+import multiprocessing
+import os
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import MongoClient
+from pymongo.errors import DuplicateKeyError
+from quart import Quart, Response, g, request, render_template
+from quart.wrappers.response import DataBody
+
+STARTED_AT = time.monotonic()
+
+import compression
+import fast_json
+import indexes
+import metrics
+from utils import hash_password, generate_token, entry_to_json, authenticate, remember_user, USER_PROJECTION
+from utils import STREAM_BATCH_SIZE, NdjsonChunks, wants_ndjson, user_cache, classify_sentiment_batch
+from api_common import parse_credentials, login_response, parse_entry_id, pending_entry, parse_entries_args, entries_page
+from api_common import ImportReport, EXPORT_PROJECTION, EXPORT_SORT, export_item, ENTRIES_SORT, icon_changes
+from api_common import entry_emotions_query, ENTRY_EMOTIONS_PROJECTION, entry_emotion_item, emotion_dates_query, emotion_items
+from api_common import text_search_query, TEXT_SEARCH_PROJECTION, TEXT_SEARCH_SORT, add_entry_terms, parse_search_args
+from api_common import parse_wordcloud_args, negative_insights_response, terms_wordcloud, readiness, cache_gauges
+from entry_repository import create_repository, build_entry, parse_entry_changes
+from sentiment_queue import create_queue, job_status, JOBS_COLLECTION
+from sentiment_rollup import ROLLUP_COLLECTION, TOTALS_PROJECTION, range_query, sum_rows, stats_range, to_chart
+from keywords import top_keywords_pipeline
+from search_index import SearchIndex
+from sentiment_timeline import TimelineStore, parse_timeline_args
+from term_index import TERMS_COLLECTION, LEGACY_TERMS_COLLECTION, WORDCLOUD_PROJECTION, to_wordcloud, add_contribution
+from data_versions import DataVersions, ResponseCache, check_conditional, set_validators, VERSIONS_COLLECTION
+from migrations import MigrationStatus, ENTRY_SENTIMENT, USER_TERMS_TO_VERSIONS
+from sentiment_engine import get_engine, warmup, start_background_warmup
+
+template_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), 'templates'))
+static_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), 'static'))
+app = Quart(__name__, template_folder=template_dir, static_folder=static_dir)
+# /entries/import đọc body theo từng dòng như main.py, không giới hạn kích thước
+app.config["MAX_CONTENT_LENGTH"] = None
+
+MONGO_URI = os.environ.get("MONGO_URI", "mongodb://localhost:27017/emotional_diary_db")
+SECRET_KEY = os.environ.get("SECRET_KEY", "supersecretkey")
+AUTH_TRUST_CLAIMS = os.environ.get("AUTH_TRUST_CLAIMS", "0") == "1"
+MONGO_MAX_POOL_SIZE = int(os.environ.get("MONGO_MAX_POOL_SIZE", 100))
+MONGO_MIN_POOL_SIZE = int(os.environ.get("MONGO_MIN_POOL_SIZE", 0))
+WRITE_THREADS = int(os.environ.get("WRITE_THREADS", 4))
+SENTIMENT_PROCESSES = int(os.environ.get("SENTIMENT_PROCESSES", 1))
+SENTIMENT_PRELOAD = os.environ.get("SENTIMENT_PRELOAD", "background")
+user_cache.ttl = int(os.environ.get("AUTH_CACHE_TTL", 60))
+user_cache.max_size = int(os.environ.get("AUTH_CACHE_SIZE", 1024))
+response_cache = ResponseCache(int(os.environ.get("RESPONSE_CACHE_SIZE", 0)))
+startup_stats = {"import_seconds": round(time.monotonic() - STARTED_AT, 3), "first_request_seconds": None}
+
+# Được tạo trong startup(), sau khi event loop (và process worker của hypercorn) đã có
+db = None
+sync_db = None
+entry_repository = None
+sentiment_queue = None
+search_index = None
+timeline_store = None
+entry_sentiment_migrated = None
+terms_migrated = None
+versions = None
+write_executor = None
+sentiment_pool = None
+
+
+@app.before_serving
+async def startup():
+    global db, sync_db, entry_repository, sentiment_queue, search_index, timeline_store, entry_sentiment_migrated, versions
+    global terms_migrated
+    global write_executor, sentiment_pool
+    client = AsyncIOMotorClient(MONGO_URI, maxPoolSize=MONGO_MAX_POOL_SIZE, minPoolSize=MONGO_MIN_POOL_SIZE,
+                                event_listeners=[metrics.mongo_listener])
+    db = client.get_default_database()
+    # Client đồng bộ cho route ghi và worker cảm xúc, đủ kết nối cho các thread của chúng
+    workers = int(os.environ.get("SENTIMENT_WORKERS", 2))
+    sync_client = MongoClient(MONGO_URI, maxPoolSize=WRITE_THREADS + workers + 2,
+                              event_listeners=[metrics.mongo_listener])
+    sync_db = sync_client.get_default_database()
+    if os.environ.get("ENSURE_INDEXES", "0") == "1":
+        indexes.start_background_ensure(sync_db, log=app.logger.warning)
+    write_executor = ThreadPoolExecutor(WRITE_THREADS, thread_name_prefix="entry-write")
+    classify_batch = None
+    if SENTIMENT_PROCESSES > 0:
+        # spawn: process con không kế thừa thread và kết nối Mongo của process hiện tại
+        sentiment_pool = ProcessPoolExecutor(SENTIMENT_PROCESSES, mp_context=multiprocessing.get_context("spawn"))
+        classify_batch = lambda texts: sentiment_pool.submit(classify_sentiment_batch, texts).result()
+    elif SENTIMENT_PRELOAD == "eager":
+        warmup()
+    elif SENTIMENT_PRELOAD == "background":
+        start_background_warmup()
+    sentiment_queue = create_queue(sync_db, classify_batch)
+    sentiment_queue.start()
+    versions = DataVersions(sync_db)
+    search_index = SearchIndex(sync_db, versions, max_users=int(os.environ.get("SEARCH_INDEX_USERS", 1000)))
+    timeline_store = TimelineStore(sync_db, versions, max_users=int(os.environ.get("TIMELINE_USERS", 1000)))
+    entry_repository = create_repository(sync_client, sync_db, sentiment_queue, versions, search_index)
+    entry_sentiment_migrated = MigrationStatus(sync_db, ENTRY_SENTIMENT)
+    terms_migrated = MigrationStatus(sync_db, USER_TERMS_TO_VERSIONS)
+
+
+@app.after_serving
+async def shutdown():
+    sentiment_queue.stop()
+    write_executor.shutdown(wait=True)
+    if sentiment_pool:
+        sentiment_pool.shutdown(wait=True)
+
+
+async def run_sync(fn, *args):
+    """Chạy hàm đồng bộ (PyMongo) trong thread pool ghi."""
+    return await asyncio.get_running_loop().run_in_executor(write_executor, functools.partial(fn, *args))
+
+
+#============================================================================================
+def json_response(obj, status=200):
+    return Response(fast_json.dumps_bytes(obj), status=status, mimetype="application/json")
+
+
+def wants_stream():
+    return wants_ndjson(request.args, request.headers)
+
+
+def ndjson_response(items):
+    """utils.ndjson_response cho một async iterator."""
+    async def generate():
+        chunks = NdjsonChunks()
+        async for item in items:
+            chunk = chunks.add(item)
+            if chunk:
+                yield chunk
+        chunk = chunks.close()
+        if chunk:
+            yield chunk
+    return Response(generate(), mimetype="application/x-ndjson")
+
+
+async def get_current_user():
+    """utils.get_current_user, tra users bằng Motor."""
+    user, lookup = authenticate(request.headers.get("Authorization", ""), SECRET_KEY, AUTH_TRUST_CLAIMS)
+    if lookup is None:
+        return user
+    return remember_user(lookup, await db.users.find_one({"_id": lookup[1]}, USER_PROJECTION))
+
+
+def versioned(view):
+    """data_versions.conditional cho view async; version đọc bằng Motor."""
+    @functools.wraps(view)
+    async def wrapper(*args, **kwargs):
+        user = await get_current_user()
+        if not user:
+            return await view(*args, **kwargs)
+        doc = await db[VERSIONS_COLLECTION].find_one({"_id": user["_id"]}, {"version": 1})
+        version = doc["version"] if doc else 0
+        etag, ready, use_cache = check_conditional(request, user["_id"], version, response_cache, wants_stream())
+        if ready:
+            status, body, content_type = ready
+            return set_validators(Response(body, status=status, content_type=content_type), etag)
+        response = await view(*args, **kwargs)
+        if response.status_code != 200:
+            return response
+        if use_cache and isinstance(response.response, DataBody):
+            response_cache.put(etag, await response.get_data(), response.headers.get("Content-Type"))
+        return set_validators(response, etag)
+    return wrapper
+
+
+@app.before_request
+async def before_request():
+    g.started = time.perf_counter()
+    if startup_stats["first_request_seconds"] is None:
+        startup_stats["first_request_seconds"] = round(time.monotonic() - STARTED_AT, 3)
+
+
+@app.after_request
+async def after_request(response):
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    metrics.request_duration.observe(time.perf_counter() - g.started, request.method, route, str(response.status_code))
+    # Tương đương CORS(app) của main.py
+    response.headers["Access-Control-Allow-Origin"] = "*"
+    if request.method == "OPTIONS":
+        response.headers["Access-Control-Allow-Headers"] = request.headers.get("Access-Control-Request-Headers", "*")
+        response.headers["Access-Control-Allow-Methods"] = "GET, POST, PUT, DELETE, OPTIONS"
+    return response
+
+
+# Đăng ký sau after_request ở trên nên chạy trước nó (thứ tự ngược): thời gian đo gồm cả nén
+compression.init_async_app(app, min_size=int(os.environ.get("COMPRESS_MIN_SIZE", 1024)))
+
+
+#============================================================================================
+@app.route("/register", methods=["POST"])
+async def register():
+    username, password = parse_credentials(await request.get_json())
+    if not username or not password:
+        return json_response({"error": "Username and password required"}, 400)
+    if await db.users.find_one({"username": username}):
+        return json_response({"error": "Username already exists"}, 400)
+    try:
+        await db.users.insert_one({"username": username, "password": hash_password(password)})
+    except DuplicateKeyError:
+        return json_response({"error": "Username already exists"}, 400)
+    return json_response({"message": "User registered"}, 201)
+
+
+@app.route("/login", methods=["POST"])
+async def login():
+    username, password = parse_credentials(await request.get_json())
+    user = await db.users.find_one({"username": username})
+    if not user or user["password"] != hash_password(password):
+        return json_response({"error": "Invalid username or password"}, 401)
+    return json_response(login_response(user, generate_token(user["_id"], user["username"], SECRET_KEY)))
+
+
+#============================================================================================
+@app.route("/entries", methods=["POST"])
+async def create_entry():
+    user = await get_current_user()
+    if not user:
+        return json_response({"error": "Unauthorized"}, 401)
+    entry, icon, error = build_entry(await request.get_json(), user["_id"])
+    if error:
+        return json_response({"error": error}, 400)
+    new_entry = await run_sync(entry_repository.create, entry, icon)
+    return json_response(pending_entry(new_entry), 201)
+
+
+@app.route("/entries", methods=["GET"])
+@versioned
+async def get_all_entries():
+    """Như get_all_entries của main.py (from/to, fields, limit/cursor, stream)."""
+    user = await get_current_user()
+    if not user:
+        return json_response({"error": "Unauthorized"}, 401)
+    listing, error = parse_entries_args(user["_id"], request.args)
+    if error:
+        return json_response({"error": error}, 400)
+    fields = listing["fields"]
+    cursor = db.entries.find(listing["query"], listing["projection"]).sort(ENTRIES_SORT)
+    if listing["limit"] is None:
+        if wants_stream():
+            cursor = cursor.batch_size(STREAM_BATCH_SIZE)
+            return ndjson_response(entry_to_json(e, fields) async for e in cursor)
+        return json_response([entry_to_json(e, fields) for e in await cursor.to_list(None)])
+    limit = listing["limit"] + 1
+    return json_response(entries_page(await cursor.limit(limit).to_list(limit), listing))
+
+
+@app.route("/entries/import", methods=["POST"])
+async def import_entries():
+    """Như import_entries của main.py: body NDJSON đọc dần, ghi theo lô trong thread pool."""
+    user = await get_current_user()
+    if not user:
+        return json_response({"error": "Unauthorized"}, 401)
+
+    async def lines():
+        pending = b""
+        async for data in request.body:
+            pending += data
+            *complete, pending = pending.split(b"\n")
+            for line in complete:
+                yield line
+        if pending:
+            yield pending
+
+    report = ImportReport(user["_id"])
+    line_no = 0
+    async for raw in lines():
+        line_no += 1
+        if report.add_line(line_no, raw):
+            report.written(await run_sync(entry_repository.create_many, user["_id"], report.batch()))
+    if report.batch():
+        report.written(await run_sync(entry_repository.create_many, user["_id"], report.batch()))
+    return json_response(*report.response())
+
+
+@app.route("/entries/export", methods=["GET"])
+@versioned
+async def export_entries():
+    user = await get_current_user()
+    if not user:
+        return json_response({"error": "Unauthorized"}, 401)
+    cursor = db.entries.find({"user_id": user["_id"]}, EXPORT_PROJECTION).sort(EXPORT_SORT).batch_size(STREAM_BATCH_SIZE)
+    response = ndjson_response(export_item(e) async for e in cursor)
+    response.headers["Content-Disposition"] = "attachment; filename=entries.ndjson"
+    return response
+
+
+@app.route("/entries/<entry_id>", methods=["GET"])
+async def get_entry(entry_id):
+    oid, error = parse_entry_id(entry_id)
+    if error:
+        return json_response({"error": error}, 400)
+    entry = await db.entries.find_one({"_id": oid})
+    if not entry:
+        return json_response({"error": "Entry not found"}, 404)
+    return json_response(entry_to_json(entry))
+
+
+@app.route("/entries/<entry_id>", methods=["PUT"])
+async def update_entry(entry_id):
+    user = await get_current_user()
+    if not user:
+        return json_response({"error": "Unauthorized"}, 401)
+    oid, error = parse_entry_id(entry_id)
+    if error:
+        return json_response({"error": error}, 400)
+    update_data, icon, error = parse_entry_changes(await request.get_json())
+    if error:
+        return json_response({"error": error}, 400)
+    updated_entry = await run_sync(entry_repository.update, user["_id"], oid, update_data, icon)
+    if not updated_entry:
+        return json_response({"error": "Entry not found or unauthorized"}, 404)
+    return json_response(pending_entry(updated_entry))
+
+
+@app.route("/entries/<entry_id>/sentiment", methods=["GET"])
+async def get_entry_sentiment(entry_id):
+    user = await get_current_user()
+    if not user:
+        return json_response({"error": "Unauthorized"}, 401)
+    oid, error = parse_entry_id(entry_id)
+    if error:
+        return json_response({"error": error}, 400)
+    job, emo = await asyncio.gather(
+        db[JOBS_COLLECTION].find_one({"entry_id": oid, "user_id": user["_id"]}, {"status": 1, "error": 1}),
+        db.emotion.find_one({"entry_id": oid, "user_id": user["_id"]})
+    )
+    result = job_status(job, emo)
+    result["entry_id"] = entry_id
+    return json_response(result)
+
+
+@app.route("/entries/<entry_id>", methods=["DELETE"])
+async def delete_entry(entry_id):
+    user = await get_current_user()
+    if not user:
+        return json_response({"error": "Unauthorized"}, 401)
+    oid, error = parse_entry_id(entry_id)
+    if error:
+        return json_response({"error": error}, 400)
+    if not await run_sync(entry_repository.delete, user["_id"], oid):
+        return json_response({"error": "Entry not found or unauthorized"}, 404)
+    return json_response({"message": "Entry deleted"})
+
+
+#============================================================================================
+@app.route("/")
+async def home():
+    return await render_template("login.html")
+
+
+@app.route("/diary")
+async def diary():
+    return await render_template("index.html")
+
+
+@app.route("/charts")
+async def charts():
+    return await render_template("charts.html")
+
+
+@app.route("/healthz")
+async def healthz():
+    return json_response({
+        "status": "ok",
+        "uptime_seconds": round(time.monotonic() - STARTED_AT, 3),
+        "startup": startup_stats
+    })
+
+
+@app.route("/readyz")
+async def readyz():
+    try:
+        await db.command("ping")
+        mongo_ready = True
+    except Exception:
+        mongo_ready = False
+    return json_response(*readiness(mongo_ready, get_engine(), SENTIMENT_PRELOAD, sentiment_pool is not None))
+
+
+@app.route("/metrics")
+async def metrics_endpoint():
+    extra = cache_gauges(user_cache, sentiment_queue, response_cache, search_index, timeline_store)
+    return Response(metrics.render(extra), mimetype="text/plain; version=0.0.4")
+
+
+#============================================================================================
+async def iter_entry_emotions(user_id):
+    cursor = db.entries.find(entry_emotions_query(user_id), ENTRY_EMOTIONS_PROJECTION).batch_size(STREAM_BATCH_SIZE)
+    async for entry in cursor:
+        yield entry_emotion_item(entry)
+
+
+async def iter_emotions_with_dates(user_id):
+    """Trước migration 0001: đọc emotion theo lô, lấy ngày của entry bằng $in."""
+    batch = []
+    async for emo in db.emotion.find({"user_id": user_id}).batch_size(STREAM_BATCH_SIZE):
+        batch.append(emo)
+        if len(batch) >= STREAM_BATCH_SIZE:
+            for item in await _attach_dates(user_id, batch):
+                yield item
+            batch = []
+    if batch:
+        for item in await _attach_dates(user_id, batch):
+            yield item
+
+
+async def _attach_dates(user_id, emotions):
+    entries = await db.entries.find(emotion_dates_query(user_id, emotions), {"date": 1}).to_list(None)
+    return emotion_items(emotions, entries)
+
+
+@app.route("/emotions", methods=["GET"])
+@versioned
+async def get_emotions():
+    user = await get_current_user()
+    if not user:
+        return json_response({"error": "Unauthorized"}, 401)
+    if entry_sentiment_migrated.done():
+        emotions = iter_entry_emotions(user["_id"])
+    else:
+        emotions = iter_emotions_with_dates(user["_id"])
+    if wants_stream():
+        return ndjson_response(emotions)
+    return json_response([item async for item in emotions])
+
+
+@app.route("/emotions/stats", methods=["GET"])
+@versioned
+async def get_emotion_stats():
+    user = await get_current_user()
+    if not user:
+        return json_response({"error": "Unauthorized"}, 401)
+    start, end, error = stats_range(request.args.get("period", "month"), request.args.get("from"), request.args.get("to"))
+    if error:
+        return json_response({"error": error}, 400)
+    rows = await db[ROLLUP_COLLECTION].find(range_query(user["_id"], start, end), TOTALS_PROJECTION).to_list(None)
+    return json_response(to_chart(sum_rows(rows)))
+
+
+@app.route("/emotions/timeline", methods=["GET"])
+@versioned
+async def get_emotion_timeline():
+    user = await get_current_user()
+    if not user:
+        return json_response({"error": "Unauthorized"}, 401)
+    params, error = parse_timeline_args(request.args)
+    if error:
+        return json_response({"error": error}, 400)
+    # Tính bằng NumPy trên thread: không chặn event loop khi phải dựng lại chuỗi của user
+    timeline, error = await run_sync(functools.partial(timeline_store.timeline, user["_id"], **params))
+    if error:
+        return json_response({"error": error}, 400)
+    return json_response(timeline)
+
+
+@app.route("/emotions/<entry_id>/icon", methods=["PUT"])
+async def update_emotion_icon(entry_id):
+    user = await get_current_user()
+    if not user:
+        return json_response({"error": "Unauthorized"}, 401)
+    changes, error = icon_changes(await request.get_json(), datetime.datetime.utcnow())
+    if error:
+        return json_response({"error": error}, 400)
+    oid, error = parse_entry_id(entry_id)
+    if error:
+        return json_response({"error": error}, 400)
+    result = await db.emotion.update_one({"user_id": user["_id"], "entry_id": oid}, {"$set": changes})
+    if result.matched_count == 0:
+        return json_response({"error": "Emotion not found"}, 404)
+    await db.entries.update_one({"_id": oid, "user_id": user["_id"]}, {"$set": changes})
+    await run_sync(versions.bump, user["_id"])
+    return json_response({"message": "Icon updated"})
+
+
+#============================================================================================
+@app.route("/entries/search", methods=["GET"])
+@versioned
+async def search_entries():
+    user = await get_current_user()
+    if not user:
+        return json_response({"error": "Unauthorized"}, 401)
+    query, error = text_search_query(user["_id"], request.args)
+    if error:
+        return json_response({"error": error}, 400)
+    cursor = db.entries.find(query, TEXT_SEARCH_PROJECTION).sort(TEXT_SEARCH_SORT)
+    word_freq = Counter()
+    if wants_stream():
+        cursor = cursor.batch_size(STREAM_BATCH_SIZE)
+
+        async def generate():
+            async for e in cursor:
+                yield add_entry_terms(word_freq, e)
+            yield {"wordcloud": to_wordcloud(word_freq)}
+        return ndjson_response(generate())
+
+    entry_list = [add_entry_terms(word_freq, e) for e in await cursor.to_list(None)]
+    return json_response({"entries": entry_list, "wordcloud": to_wordcloud(word_freq)})
+
+
+@app.route("/search", methods=["GET"])
+@versioned
+async def search():
+    """Như /search của main.py; tra chỉ mục (có thể phải dựng từ Mongo) trong thread pool."""
+    user = await get_current_user()
+    if not user:
+        return json_response({"error": "Unauthorized"}, 401)
+    params, error = parse_search_args(request.args)
+    if error:
+        return json_response({"error": error}, 400)
+    return json_response(await run_sync(functools.partial(search_index.search, user["_id"], **params)))
+
+
+@app.route("/search/suggest", methods=["GET"])
+@versioned
+async def search_suggest():
+    user = await get_current_user()
+    if not user:
+        return json_response({"error": "Unauthorized"}, 401)
+    return json_response({"suggestions": await run_sync(search_index.suggest, user["_id"], request.args.get("q", ""))})
+
+
+async def find_terms(user_id, scope):
+    """Như TermIndex.totals: trước khi migration 0003 xong, user còn trong user_terms đọc từ đó."""
+    if not terms_migrated.done():
+        doc = await db[LEGACY_TERMS_COLLECTION].find_one({"_id": user_id}, {scope: 1})
+        if doc:
+            return doc
+    return await db[TERMS_COLLECTION].find_one({"_id": user_id}, {scope: 1})
+
+
+@app.route("/entries/wordcloud", methods=["GET"])
+@versioned
+async def entries_wordcloud():
+    user = await get_current_user()
+    if not user:
+        return json_response({"error": "Unauthorized"}, 401)
+    parsed, error = parse_wordcloud_args(user["_id"], request.args)
+    if error:
+        return json_response({"error": error}, 400)
+    scope, query = parsed
+    if query is None:
+        terms_doc = await find_terms(user["_id"], scope)
+        return json_response({"wordcloud": terms_wordcloud(terms_doc, scope)})
+    counts = Counter()
+    async for entry in db.entries.find(query, WORDCLOUD_PROJECTION):
+        add_contribution(counts, entry, scope)
+    return json_response({"wordcloud": to_wordcloud(counts)})
+
+
+@app.route("/entries/negative-insights", methods=["GET"])
+@versioned
+async def negative_insights():
+    user = await get_current_user()
+    if not user:
+        return json_response({"error": "Unauthorized"}, 401)
+    # Bốn truy vấn độc lập chạy đồng thời
+    negative_entries, terms_doc, total_entries, top = await asyncio.gather(
+        db.entries.find({"user_id": user["_id"], "is_negative": True}).to_list(None),
+        find_terms(user["_id"], "negative"),
+        db.entries.count_documents({"user_id": user["_id"]}),
+        db.entries.aggregate(top_keywords_pipeline(user["_id"])).to_list(None)
+    )
+    return json_response(negative_insights_response(
+        negative_entries, terms_wordcloud(terms_doc, "negative"), total_entries, top
+    ))
+
+
+if __name__ == "__main__":
+    # Server dev chỉ nghe trên localhost như main.py; HOST=0.0.0.0 để mở ra ngoài
+    app.run(host=os.environ.get("HOST", "127.0.0.1"), port=int(os.environ.get("PORT", 5000)))
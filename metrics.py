@@ -0,0 +1,254 @@
+"""
+Đo thời gian theo route, theo lệnh Mongo và theo từng đoạn xử lý (classify, serialize),
+xuất ra /metrics theo định dạng text của Prometheus.
+
+    - http_request_duration_seconds{method, route, status}: middleware của Flask
+    - mongo_command_duration_seconds{collection, command} và mongo_documents_returned_total:
+      CommandListener của PyMongo (truyền vào PyMongo(app, event_listeners=[mongo_listener]))
+    - app_span_duration_seconds{span}: các đoạn bọc bằng `with span("classify"):`
+
+Mọi số liệu nằm trong bộ nhớ của process (mỗi worker gunicorn có bộ số riêng).
+Đặt SLOW_REQUEST_MS để ghi log các request chậm kèm thời gian từng phần của request đó.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+from pymongo import monitoring
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = [(k, list(v[0]), v[1], v[2]) for k, v in self._series.items()]
+        for label_values, counts, total, count in sorted(snapshot):
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                labels = _format_labels(self.labels, label_values, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, label_values, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = _format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {total:.6f}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class CounterMetric:
+    def __init__(self, name, help_text, labels):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount, *label_values):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            snapshot = sorted(self._values.items())
+        for label_values, value in snapshot:
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+def render_gauges(prefix, values, help_text):
+    """Gauge từ một dict số liệu (ví dụ stats() của cache); bỏ qua giá trị không phải số."""
+    lines = []
+    for key, value in sorted(values.items()):
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        name = f"{prefix}_{key}"
+        lines += [f"# HELP {name} {help_text} ({key})", f"# TYPE {name} gauge", f"{name} {value}"]
+    return lines
+
+
+#============================================================================================
+request_duration = Histogram("http_request_duration_seconds", "HTTP request latency", ("method", "route", "status"))
+mongo_duration = Histogram("mongo_command_duration_seconds", "MongoDB command latency", ("collection", "command"))
+mongo_documents = CounterMetric("mongo_documents_returned_total", "Documents returned by MongoDB commands",
+                                ("collection", "command"))
+mongo_failures = CounterMetric("mongo_command_failures_total", "Failed MongoDB commands", ("collection", "command"))
+span_duration = Histogram("app_span_duration_seconds", "Time spent in instrumented code sections", ("span",))
+
+# Thời gian từng phần của request đang chạy trên thread hiện tại (cho slow-request log)
+_request = threading.local()
+
+
+def _breakdown():
+    return getattr(_request, "breakdown", None)
+
+
+def observe_span(name, seconds):
+    span_duration.observe(seconds, name)
+    breakdown = _breakdown()
+    if breakdown is not None:
+        breakdown[name] = breakdown.get(name, 0.0) + seconds
+
+
+@contextmanager
+def span(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_span(name, time.perf_counter() - started)
+
+
+#============================================================================================
+def _documents_returned(reply):
+    cursor = reply.get("cursor")
+    if isinstance(cursor, dict):
+        return len(cursor.get("firstBatch") or cursor.get("nextBatch") or [])
+    if "value" in reply:  # findAndModify
+        return 1 if reply["value"] else 0
+    return 0
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Ghi thời gian và số document trả về của từng lệnh, theo collection và tên lệnh."""
+
+    IGNORED = {"hello", "isMaster", "ismaster", "ping", "endSessions", "saslStart", "saslContinue", "buildInfo"}
+
+    def __init__(self):
+        self._pending = {}
+
+    def started(self, event):
+        if event.command_name in self.IGNORED:
+            return
+        if event.command_name == "getMore":
+            collection = event.command.get("collection")
+        else:
+            collection = event.command.get(event.command_name)
+        self._pending[(event.connection_id, event.request_id)] = collection if isinstance(collection, str) else ""
+
+    def _finish(self, event):
+        collection = self._pending.pop((event.connection_id, event.request_id), None)
+        if collection is None:
+            return None
+        seconds = event.duration_micros / 1e6
+        mongo_duration.observe(seconds, collection, event.command_name)
+        breakdown = _breakdown()
+        if breakdown is not None:
+            breakdown["mongo"] = breakdown.get("mongo", 0.0) + seconds
+            breakdown["mongo_commands"] = breakdown.get("mongo_commands", 0) + 1
+        return collection
+
+    def succeeded(self, event):
+        collection = self._finish(event)
+        if collection is not None:
+            returned = _documents_returned(event.reply)
+            if returned:
+                mongo_documents.inc(returned, collection, event.command_name)
+
+    def failed(self, event):
+        collection = self._finish(event)
+        if collection is not None:
+            mongo_failures.inc(1, collection, event.command_name)
+
+
+mongo_listener = MongoCommandListener()
+
+
+#============================================================================================
+def _instrument_json(app):
+    """Bọc bộ serialize JSON của Flask trong span("serialize")."""
+    provider = getattr(app, "json", None)
+    if provider is not None and hasattr(provider, "dumps"):
+        # Flask >= 2.2: JSON provider
+        dumps = provider.dumps
+
+        def timed_dumps(obj, **kwargs):
+            with span("serialize"):
+                return dumps(obj, **kwargs)
+        provider.dumps = timed_dumps
+    else:
+        # Flask 2.0/2.1: json_encoder
+        base = app.json_encoder
+
+        class TimedJSONEncoder(base):
+            def encode(self, o):
+                with span("serialize"):
+                    return super().encode(o)
+        app.json_encoder = TimedJSONEncoder
+
+
+def init_app(app, slow_request_ms=None):
+    """Gắn middleware đo thời gian request; slow_request_ms > 0 bật log request chậm."""
+    from flask import request
+
+    _instrument_json(app)
+
+    @app.before_request
+    def _start_timer():
+        _request.started = time.perf_counter()
+        _request.breakdown = {}
+
+    def _record(response):
+        started = getattr(_request, "started", None)
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        request_duration.observe(elapsed, request.method, route, str(response.status_code))
+        breakdown = _request.breakdown
+        _request.started = None
+        _request.breakdown = None
+        if slow_request_ms and elapsed * 1000 >= slow_request_ms:
+            parts = " ".join(
+                f"{k}={v}" if k == "mongo_commands" else f"{k}={v * 1000:.1f}ms"
+                for k, v in sorted(breakdown.items())
+            )
+            app.logger.warning("Slow request %s %s %s %.1fms %s",
+                               request.method, route, response.status_code, elapsed * 1000, parts)
+        return response
+
+    # Flask chạy after_request theo thứ tự ngược lúc đăng ký: đặt _record đầu danh sách để
+    # nó chạy sau cùng và thời gian đo gồm cả các hook khác (nén response, CORS...)
+    app.after_request_funcs.setdefault(None, []).insert(0, _record)
+
+
+def render(extra_lines=()):
+    lines = []
+    for metric in (request_duration, mongo_duration, mongo_documents, mongo_failures, span_duration):
+        lines += metric.render()
+    lines += extra_lines
+    return "\n".join(lines) + "\n"
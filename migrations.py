@@ -0,0 +1,227 @@
+"""
+Migration dữ liệu có đánh số phiên bản, chạy theo lô và tiếp tục được sau khi bị dừng.
+
+Trạng thái mỗi migration nằm trong collection `schema_migrations` (_id = version):
+status running/done và checkpoint của lô cuối cùng đã ghi. Chạy lại lệnh migrate sẽ
+bỏ qua migration đã xong và tiếp tục migration đang dở từ checkpoint.
+
+    python migrations.py status
+    python migrations.py migrate [--batch-size 500]
+
+Code mới luôn ghi theo schema mới; các route đọc chỉ chuyển sang schema mới khi
+migration tương ứng đã xong (xem MigrationStatus).
+"""
+import argparse
+import datetime
+import os
+import time
+
+from pymongo import MongoClient, UpdateOne
+
+from data_versions import DataVersions
+from keywords import analyze_keywords
+from term_index import TermIndex, LEGACY_TERMS_COLLECTION, entry_terms
+
+MIGRATIONS_COLLECTION = "schema_migrations"
+
+
+#============================================================================================
+def entry_sentiment(db, checkpoint, batch_size):
+    """Chép sentiment và icon từ collection emotion sang document entry."""
+    query = {}
+    if checkpoint.get("last_id"):
+        query["_id"] = {"$gt": checkpoint["last_id"]}
+    cursor = db.entries.find(query, {"_id": 1}).sort("_id", 1).batch_size(batch_size)
+    batch = []
+    for entry in cursor:
+        batch.append(entry["_id"])
+        if len(batch) >= batch_size:
+            yield _copy_sentiment(db, batch, checkpoint)
+            batch = []
+    if batch:
+        yield _copy_sentiment(db, batch, checkpoint)
+
+
+def _copy_sentiment(db, entry_ids, checkpoint):
+    emotions = db.emotion.find({"entry_id": {"$in": entry_ids}}, {"entry_id": 1, "sentiment": 1, "icon": 1})
+    # Không ghi đè entry mà worker đã ghi sentiment mới hơn
+    ops = [
+        UpdateOne(
+            {"_id": emo["entry_id"], "sentiment": {"$exists": False}},
+            {"$set": {"sentiment": emo.get("sentiment", ""), "icon": emo.get("icon", ""),
+                      "updated_at": datetime.datetime.utcnow()}}
+        )
+        for emo in emotions
+    ]
+    if ops:
+        db.entries.bulk_write(ops, ordered=False)
+    checkpoint["last_id"] = entry_ids[-1]
+    checkpoint["processed"] = checkpoint.get("processed", 0) + len(entry_ids)
+    return checkpoint
+
+
+def entry_terms_backfill(db, checkpoint, batch_size):
+    """
+    Tính is_negative/negative_keywords và `terms` cho entry cũ (trước khi các field này
+    được ghi lúc tạo entry) và cộng `terms` vào tổng tần suất từ của user.
+    """
+    query = {}
+    if checkpoint.get("last_id"):
+        query["_id"] = {"$gt": checkpoint["last_id"]}
+    cursor = db.entries.find(query, {"_id": 1}).sort("_id", 1).batch_size(batch_size)
+    batch = []
+    for entry in cursor:
+        batch.append(entry["_id"])
+        if len(batch) >= batch_size:
+            yield _compute_terms(db, batch, checkpoint)
+            batch = []
+    if batch:
+        yield _compute_terms(db, batch, checkpoint)
+
+
+def _compute_terms(db, entry_ids, checkpoint):
+    missing = db.entries.find(
+        {"_id": {"$in": entry_ids}, "$or": [{"terms": {"$exists": False}}, {"is_negative": {"$exists": False}}]},
+        {"user_id": 1, "content": 1, "emotions": 1, "is_negative": 1, "terms": 1}
+    )
+    term_index = TermIndex(db)
+    for entry in missing:
+        fields = {}
+        if "is_negative" not in entry:
+            fields.update(analyze_keywords(entry.get("content"), entry.get("emotions")))
+        if "terms" not in entry:
+            fields.update(entry_terms(entry.get("content")))
+        # Từng entry một: entry vừa được sửa (đã có terms) thì không cộng hai lần vào tổng
+        result = db.entries.update_one(
+            {"_id": entry["_id"], "terms": entry.get("terms", {"$exists": False})},
+            {"$set": dict(fields, updated_at=datetime.datetime.utcnow())}
+        )
+        if result.modified_count:
+            old = dict(entry)
+            entry.update(fields)
+            term_index.apply(old, entry)
+    checkpoint["last_id"] = entry_ids[-1]
+    checkpoint["processed"] = checkpoint.get("processed", 0) + len(entry_ids)
+    return checkpoint
+
+
+def user_terms_to_versions(db, checkpoint, batch_size):
+    """
+    Tổng tần suất từ chuyển từ collection user_terms sang document version của user:
+    dựng lại từ `terms` trên entry cho từng user rồi xóa document cũ của user đó (từ đó
+    wordcloud đọc tổng mới), xong thì xóa collection cũ.
+    """
+    query = {}
+    if checkpoint.get("last_id"):
+        query["_id"] = {"$gt": checkpoint["last_id"]}
+    term_index = TermIndex(db)
+    versions = DataVersions(db)
+    batch = []
+    for user in db.users.find(query, {"_id": 1}).sort("_id", 1).batch_size(batch_size):
+        term_index.rebuild(db.entries, user["_id"])
+        batch.append(user["_id"])
+        if len(batch) >= batch_size:
+            yield _rebuilt_terms(db, versions, batch, checkpoint)
+            batch = []
+    if batch:
+        yield _rebuilt_terms(db, versions, batch, checkpoint)
+    db.drop_collection(LEGACY_TERMS_COLLECTION)
+
+
+def _rebuilt_terms(db, versions, user_ids, checkpoint):
+    db[LEGACY_TERMS_COLLECTION].delete_many({"_id": {"$in": user_ids}})
+    # Wordcloud có thể đổi: bỏ ETag/response đã cache của các user này
+    versions.bump_many(user_ids)
+    checkpoint["last_id"] = user_ids[-1]
+    checkpoint["processed"] = checkpoint.get("processed", 0) + len(user_ids)
+    return checkpoint
+
+
+# (version, tên, hàm). Hàm nhận checkpoint đã lưu và yield checkpoint mới sau mỗi lô.
+MIGRATIONS = [
+    ("0001", "entry_sentiment", entry_sentiment),
+    ("0002", "entry_terms", entry_terms_backfill),
+    ("0003", "user_terms_to_versions", user_terms_to_versions),
+]
+ENTRY_SENTIMENT = "0001"
+USER_TERMS_TO_VERSIONS = "0003"
+
+
+#============================================================================================
+def is_applied(db, version):
+    return db[MIGRATIONS_COLLECTION].find_one({"_id": version, "status": "done"}, {"_id": 1}) is not None
+
+
+def migrate(db, batch_size=500, log=print):
+    """Chạy lần lượt các migration chưa xong. Trả về danh sách version đã chạy."""
+    col = db[MIGRATIONS_COLLECTION]
+    ran = []
+    for version, name, fn in MIGRATIONS:
+        state = col.find_one({"_id": version}) or {}
+        if state.get("status") == "done":
+            continue
+        checkpoint = state.get("checkpoint") or {}
+        if checkpoint:
+            log(f"{version} {name}: resuming ({checkpoint.get('processed', 0)} done)")
+        col.update_one(
+            {"_id": version},
+            {"$set": {"name": name, "status": "running"},
+             "$setOnInsert": {"started_at": datetime.datetime.utcnow()}},
+            upsert=True
+        )
+        started = time.monotonic()
+        for checkpoint in fn(db, checkpoint, batch_size):
+            col.update_one({"_id": version}, {"$set": {"checkpoint": checkpoint, "updated_at": datetime.datetime.utcnow()}})
+            log(f"{version} {name}: {checkpoint.get('processed', 0)} processed")
+        col.update_one({"_id": version}, {"$set": {"status": "done", "finished_at": datetime.datetime.utcnow()}})
+        log(f"{version} {name}: done in {time.monotonic() - started:.1f}s")
+        ran.append(version)
+    return ran
+
+
+def status(db):
+    states = {doc["_id"]: doc for doc in db[MIGRATIONS_COLLECTION].find()}
+    return [
+        {"version": version, "name": name, "status": states.get(version, {}).get("status", "pending"),
+         "processed": states.get(version, {}).get("checkpoint", {}).get("processed", 0)}
+        for version, name, _ in MIGRATIONS
+    ]
+
+
+class MigrationStatus:
+    """
+    Cho route đọc biết migration đã xong chưa. Khi đã xong thì nhớ luôn; khi chưa thì
+    chỉ hỏi lại DB sau recheck_seconds để không thêm một truy vấn vào mỗi request.
+    """
+
+    def __init__(self, db, version, recheck_seconds=30):
+        self.db = db
+        self.version = version
+        self.recheck_seconds = recheck_seconds
+        self._done = False
+        self._checked_at = None
+
+    def done(self):
+        if self._done:
+            return True
+        now = time.monotonic()
+        if self._checked_at is None or now - self._checked_at >= self.recheck_seconds:
+            self._checked_at = now
+            self._done = is_applied(self.db, self.version)
+        return self._done
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run versioned data migrations")
+    parser.add_argument("command", choices=["migrate", "status"])
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--uri", default=os.environ.get("MONGO_URI", "mongodb://localhost:27017/emotional_diary_db"))
+    args = parser.parse_args()
+
+    db = MongoClient(args.uri).get_default_database()
+    if args.command == "migrate":
+        ran = migrate(db, args.batch_size)
+        print(f"Applied {len(ran)} migrations" if ran else "Nothing to migrate")
+    else:
+        for row in status(db):
+            print(f"{row['version']} {row['name']:20} {row['status']:8} {row['processed']} processed")
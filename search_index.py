@@ -0,0 +1,277 @@
+"""
+Tìm kiếm entry ngay trong process: chỉ mục ngược theo user với token đã chuẩn hóa
+Unicode và bỏ dấu ("buồn", "buon", "BUỒN" là cùng một token), xếp hạng BM25, lọc theo
+khoảng ngày, gợi ý theo tiền tố và đoạn trích có đánh dấu từ khớp.
+
+Chỉ mục của một user được dựng từ Mongo (chỉ lấy date và content) ở lần tìm đầu tiên,
+sau đó EntryRepository cập nhật mỗi khi ghi. Bộ đếm `search` trong user_versions tăng ở
+mỗi lần ghi làm đổi nội dung: process nào thấy bộ đếm khác với chỉ mục của mình (vì
+lần ghi đến từ process khác) thì dựng lại chỉ mục của user đó.
+
+Posting list là hai array (số thứ tự document, tần suất). Khi entry bị xóa/sửa, số thứ
+tự của nó được bỏ khỏi posting list của các term trong nội dung cũ (term không còn
+document nào thì bỏ hẳn, kể cả khỏi gợi ý), nên df của BM25 luôn đúng; ô của document
+chết chỉ được thu hồi khi số document chết vượt số document còn sống.
+"""
+import heapq
+import html
+import math
+import re
+import threading
+import unicodedata
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+
+TOKEN_RE = re.compile(r"\w+")
+# Bỏ dấu: tách ký tự tổ hợp (NFD) rồi xóa các dấu trong khối Combining Diacritical Marks
+_STRIP_MARKS = dict.fromkeys(range(0x300, 0x370))
+_STRIP_MARKS[ord("đ")] = "d"
+BM25_K1 = 1.2
+BM25_B = 0.75
+MIN_PREFIX = 2
+PREFIX_EXPANSIONS = 20
+SNIPPET_CHARS = 160
+MAX_TF = 65535
+
+
+def fold(text):
+    return unicodedata.normalize("NFD", text.lower()).translate(_STRIP_MARKS)
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(fold(text or ""))
+
+
+class UserIndex:
+    def __init__(self, version):
+        self.version = version
+        self.ids = []
+        self.dates = []
+        self.contents = []
+        self.lengths = array("I")
+        self.slot_of = {}
+        # term -> (array số thứ tự document, array tần suất); số thứ tự luôn tăng
+        self.postings = {}
+        # term -> dạng có dấu gặp đầu tiên, dùng cho gợi ý
+        self.surface = {}
+        self.total_length = 0
+        self.dead = 0
+        self._sorted_terms = None
+
+    def add(self, entry_id, date, content):
+        content = unicodedata.normalize("NFC", content or "")
+        slot = len(self.ids)
+        self.ids.append(entry_id)
+        self.dates.append(date)
+        self.contents.append(content)
+        counts = {}
+        for token in tokenize(content):
+            counts[token] = counts.get(token, 0) + 1
+        new_terms = set()
+        for term, tf in counts.items():
+            posting = self.postings.get(term)
+            if posting is None:
+                posting = self.postings[term] = (array("I"), array("H"))
+                new_terms.add(term)
+            posting[0].append(slot)
+            posting[1].append(min(tf, MAX_TF))
+        length = sum(counts.values())
+        self.lengths.append(length)
+        self.total_length += length
+        self.slot_of[entry_id] = slot
+        if new_terms:
+            self._sorted_terms = None
+            for word in TOKEN_RE.findall(content.lower()):
+                if fold(word) in new_terms:
+                    self.surface.setdefault(fold(word), word)
+
+    def remove(self, entry_id):
+        slot = self.slot_of.pop(entry_id, None)
+        if slot is None:
+            return
+        for term in set(tokenize(self.contents[slot])):
+            slots, tfs = self.postings[term]
+            i = bisect_left(slots, slot)
+            del slots[i]
+            del tfs[i]
+            if not slots:
+                del self.postings[term]
+                self.surface.pop(term, None)
+                self._sorted_terms = None
+        self.ids[slot] = None
+        self.contents[slot] = None
+        self.total_length -= self.lengths[slot]
+        self.dead += 1
+        if self.dead > max(64, len(self.slot_of)):
+            self._compact()
+
+    def _compact(self):
+        live = [(self.ids[s], self.dates[s], self.contents[s]) for s in sorted(self.slot_of.values())]
+        self.__init__(self.version)
+        for entry_id, date, content in live:
+            self.add(entry_id, date, content)
+
+    #========================================================================================
+    def expand(self, token, prefix):
+        """Các term khớp token; với tiền tố thì lấy các term có nhiều document nhất."""
+        if not prefix or len(token) < MIN_PREFIX:
+            return [token] if token in self.postings else []
+        if self._sorted_terms is None:
+            self._sorted_terms = sorted(self.postings)
+        terms = []
+        i = bisect_left(self._sorted_terms, token)
+        while i < len(self._sorted_terms) and self._sorted_terms[i].startswith(token):
+            terms.append(self._sorted_terms[i])
+            i += 1
+        if len(terms) > PREFIX_EXPANSIONS:
+            terms = heapq.nlargest(PREFIX_EXPANSIONS, terms, key=lambda t: len(self.postings[t][0]))
+        return terms
+
+    def score(self, terms, start=None, end=None):
+        """BM25 của các document chứa ít nhất một term, trong khoảng ngày [start, end]."""
+        n = len(self.slot_of)
+        if not n:
+            return {}
+        avgdl = self.total_length / n or 1
+        scores = {}
+        for term in terms:
+            slots, tfs = self.postings[term]
+            idf = math.log(1 + (n - len(slots) + 0.5) / (len(slots) + 0.5))
+            for slot, tf in zip(slots, tfs):
+                date = self.dates[slot]
+                if (start and date < start) or (end and date > end):
+                    continue
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[slot] / avgdl)
+                scores[slot] = scores.get(slot, 0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+        return scores
+
+
+def snippet(content, terms, width=SNIPPET_CHARS):
+    """Đoạn trích quanh từ khớp đầu tiên, từ khớp bọc trong <mark>, phần còn lại đã escape."""
+    matches = [m.span() for m in TOKEN_RE.finditer(content) if fold(m.group()) in terms]
+    begin = 0
+    if matches and matches[0][1] > width:
+        # Bắt đầu trước từ khớp đầu tiên khoảng một phần ba đoạn trích, ở đầu một từ
+        begin = matches[0][0] - width // 3
+        space = content.find(" ", begin, matches[0][0])
+        begin = space + 1 if space != -1 else begin
+    end = begin + width
+    if end < len(content):
+        space = content.rfind(" ", begin, end)
+        end = space if space > begin else end
+    else:
+        end = len(content)
+    parts = ["…" if begin else ""]
+    pos = begin
+    for s, e in matches:
+        if s < begin or e > end:
+            continue
+        parts.append(html.escape(content[pos:s]))
+        parts.append(f"<mark>{html.escape(content[s:e])}</mark>")
+        pos = e
+    parts.append(html.escape(content[pos:end]))
+    if end < len(content):
+        parts.append("…")
+    return "".join(parts)
+
+
+#============================================================================================
+class SearchIndex:
+    def __init__(self, db, versions, max_users=1000):
+        self.entries = db.entries
+        self.versions = versions
+        self.max_users = max_users
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+        self.builds = 0
+
+    def _get(self, user_id):
+        version = self.versions.get_search(user_id)
+        with self._lock:
+            index = self._users.get(user_id)
+            if index is not None and index.version == version:
+                self._users.move_to_end(user_id)
+                return index
+        # Dựng ngoài lock; nếu có lần ghi xen vào thì version lệch và lần sau dựng lại
+        index = UserIndex(version)
+        for entry in self.entries.find({"user_id": user_id}, {"date": 1, "content": 1}).batch_size(1000):
+            index.add(entry["_id"], entry.get("date"), entry.get("content"))
+        with self._lock:
+            self.builds += 1
+            self._users[user_id] = index
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        return index
+
+    def update(self, user_id, version, added=(), removed=()):
+        """
+        Áp dụng một lần ghi của EntryRepository. version là bộ đếm `search` sau lần ghi;
+        nếu chỉ mục không ở đúng version trước đó thì bỏ chỉ mục để lần tìm sau dựng lại.
+        """
+        with self._lock:
+            index = self._users.get(user_id)
+            if index is None:
+                return
+            if index.version != version - 1:
+                del self._users[user_id]
+                return
+            for entry_id in removed:
+                index.remove(entry_id)
+            for entry in added:
+                index.add(entry["_id"], entry.get("date"), entry.get("content"))
+            index.version = version
+
+    def forget(self, user_id):
+        with self._lock:
+            self._users.pop(user_id, None)
+
+    #========================================================================================
+    def search(self, user_id, query, start=None, end=None, limit=20, offset=0):
+        """
+        Một trang kết quả: {"results": [{_id, date, score, snippet}], "total", "next_offset"}.
+        Token cuối của query được khớp theo tiền tố để tìm được khi đang gõ.
+        """
+        index = self._get(user_id)
+        tokens = tokenize(query)
+        with self._lock:
+            terms = set()
+            for i, token in enumerate(tokens):
+                terms.update(index.expand(token, prefix=i == len(tokens) - 1))
+            scores = index.score(terms, start, end)
+            top = heapq.nlargest(offset + limit, scores.items(), key=lambda item: (item[1], index.dates[item[0]]))
+            results = [
+                {
+                    "_id": str(index.ids[slot]),
+                    "date": index.dates[slot],
+                    "score": round(score, 4),
+                    "snippet": snippet(index.contents[slot], terms)
+                }
+                for slot, score in top[offset:]
+            ]
+        total = len(scores)
+        return {
+            "results": results,
+            "total": total,
+            "next_offset": offset + limit if offset + limit < total else None
+        }
+
+    def suggest(self, user_id, prefix, limit=10):
+        """Gợi ý các từ (dạng có dấu) bắt đầu bằng từ cuối của prefix, nhiều document trước."""
+        tokens = tokenize(prefix)
+        if not tokens:
+            return []
+        index = self._get(user_id)
+        with self._lock:
+            terms = index.expand(tokens[-1], prefix=True)
+            terms = heapq.nlargest(limit, terms, key=lambda t: len(index.postings[t][0]))
+            return [index.surface.get(term, term) for term in terms]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "users": len(self._users),
+                "documents": sum(len(index.slot_of) for index in self._users.values()),
+                "builds": self.builds
+            }
@@ -0,0 +1,116 @@
+"""
+Cache kết quả phân loại cảm xúc theo hash nội dung.
+
+Khóa là sha256 của (CLASSIFIER_VERSION, nội dung đã chuẩn hóa), nên sửa entry mà
+không đổi content, hoặc nhiều entry có cùng nội dung, sẽ không phải chạy lại
+TextBlob. Có hai tầng: LRU trong process và collection `sentiment_cache` trong Mongo.
+Khi CLASSIFIER_VERSION đổi, mọi khóa cũ không còn khớp và bị xóa khỏi Mongo lúc khởi tạo.
+"""
+import hashlib
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+
+from pymongo import ReplaceOne
+
+from utils import CLASSIFIER_VERSION, classify_sentiment_batch
+
+CACHE_COLLECTION = "sentiment_cache"
+
+
+def normalize_content(text):
+    text = unicodedata.normalize("NFC", text or "")
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def content_key(text, version=CLASSIFIER_VERSION):
+    raw = f"{version}\0{normalize_content(text)}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class SentimentCache:
+    def __init__(self, db=None, max_size=10000, classify_batch=classify_sentiment_batch, version=CLASSIFIER_VERSION):
+        self.collection = db[CACHE_COLLECTION] if db is not None else None
+        self.max_size = max_size
+        self.classify_batch = classify_batch
+        self.version = version
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "db_hits": 0, "misses": 0}
+
+    def invalidate_stale(self):
+        """Xóa các kết quả của phiên bản classifier cũ."""
+        with self._lock:
+            self._lru.clear()
+        if self.collection is not None:
+            self.collection.delete_many({"version": {"$ne": self.version}})
+
+    #========================================================================================
+    def _get_memory(self, key):
+        with self._lock:
+            sentiment = self._lru.get(key)
+            if sentiment is not None:
+                self._lru.move_to_end(key)
+            return sentiment
+
+    def _put_memory(self, key, sentiment):
+        with self._lock:
+            self._lru[key] = sentiment
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.max_size:
+                self._lru.popitem(last=False)
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self.stats[name] += n
+
+    #========================================================================================
+    def classify_many(self, texts):
+        """Phân loại một danh sách nội dung, chỉ chạy classifier cho phần chưa có trong cache."""
+        keys = [content_key(t, self.version) for t in texts]
+        results = {}
+        for key in set(keys):
+            sentiment = self._get_memory(key)
+            if sentiment is not None:
+                results[key] = sentiment
+        self._count("memory_hits", sum(1 for k in keys if k in results))
+
+        missing = {k for k in keys if k not in results}
+        if missing and self.collection is not None:
+            for doc in self.collection.find({"_id": {"$in": list(missing)}, "version": self.version}):
+                results[doc["_id"]] = doc["sentiment"]
+                self._put_memory(doc["_id"], doc["sentiment"])
+            self._count("db_hits", sum(1 for k in keys if k in missing and k in results))
+
+        # Phần còn thiếu được phân loại trong một lời gọi batch (mỗi nội dung một lần)
+        pending = {}
+        for key, text in zip(keys, texts):
+            if key in results:
+                continue
+            if key in pending:
+                # Trùng nội dung trong cùng một lô: coi như hit của lần phân loại này
+                self._count("memory_hits")
+                continue
+            pending[key] = text
+        new_docs = []
+        if pending:
+            for key, sentiment in zip(pending, self.classify_batch(list(pending.values()))):
+                results[key] = sentiment
+                self._put_memory(key, sentiment)
+                new_docs.append({"_id": key, "version": self.version, "sentiment": sentiment})
+            self._count("misses", len(pending))
+        if new_docs and self.collection is not None:
+            self.collection.bulk_write([ReplaceOne({"_id": d["_id"]}, d, upsert=True) for d in new_docs], ordered=False)
+        return [results[k] for k in keys]
+
+    def classify(self, text):
+        return self.classify_many([text])[0]
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["memory_size"] = len(self._lru)
+        lookups = stats["memory_hits"] + stats["db_hits"] + stats["misses"]
+        stats["hit_rate"] = round((lookups - stats["misses"]) / lookups, 4) if lookups else 0
+        return stats
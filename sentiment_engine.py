@@ -0,0 +1,316 @@
+"""
+Các backend phân loại cảm xúc, chọn bằng biến môi trường SENTIMENT_ENGINE.
+
+    - textblob (mặc định): polarity của TextBlob với ngưỡng ±0.1
+    - transformer: model Hugging Face chạy trên CPU, gom các lời gọi đồng thời (classify
+      và classify_batch của các worker hàng đợi cảm xúc) thành micro-batch (chờ tối đa
+      SENTIMENT_MAX_WAIT_MS) rồi chạy một forward pass
+
+Cấu hình cho transformer: SENTIMENT_MODEL, SENTIMENT_MAX_LENGTH, SENTIMENT_MAX_BATCH,
+SENTIMENT_MAX_WAIT_MS, SENTIMENT_THREADS, SENTIMENT_QUANTIZE=1 (int8 động).
+
+Model được nạp lười (lần phân loại đầu tiên) hoặc chủ động qua warmup(); gọi warmup()
+trước khi fork worker (ví dụ gunicorn --preload) để các worker dùng chung bộ nhớ
+model theo copy-on-write.
+
+Đo throughput/latency trên CPU:
+    python sentiment_engine.py bench --engine transformer --requests 500 --concurrency 16
+"""
+import argparse
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class SentimentEngine:
+    name = "base"
+    ready = False
+    load_seconds = None
+
+    @property
+    def version(self):
+        """Định danh classifier, dùng làm CLASSIFIER_VERSION cho cache cảm xúc."""
+        return self.name
+
+    def load(self):
+        """Nạp tài nguyên NLP; không làm gì nếu đã nạp."""
+        self.ready = True
+
+    def warmup(self):
+        started = time.perf_counter()
+        self.load()
+        self.classify_batch(["warmup"])
+        self.load_seconds = round(time.perf_counter() - started, 3)
+
+    def classify(self, text):
+        return self.classify_batch([text])[0]
+
+    def classify_batch(self, texts):
+        raise NotImplementedError
+
+
+#============================================================================================
+class TextBlobEngine(SentimentEngine):
+    name = "textblob"
+
+    def __init__(self, threshold=0.1):
+        self._textblob = None
+        self.threshold = threshold
+        self._load_lock = threading.Lock()
+
+    @property
+    def version(self):
+        return f"textblob-{self.threshold}"
+
+    def load(self):
+        # TextBlob kéo theo nltk/pattern nên chỉ import khi thật sự cần
+        with self._load_lock:
+            if self._textblob is None:
+                from textblob import TextBlob
+                self._textblob = TextBlob
+                self.ready = True
+
+    def classify(self, text):
+        if self._textblob is None:
+            self.load()
+        polarity = self._textblob(text).sentiment.polarity
+        if polarity > self.threshold:
+            return "positive"
+        elif polarity < -self.threshold:
+            return "negative"
+        else:
+            return "neutral"
+
+    def classify_batch(self, texts):
+        return [self.classify(t) for t in texts]
+
+
+#============================================================================================
+class MicroBatcher:
+    """
+    Gom các lời gọi submit() đồng thời: lấy tối đa max_batch phần tử, hoặc chờ tối đa
+    max_wait giây kể từ phần tử đầu tiên, rồi gọi fn(list) một lần và trả kết quả
+    cho từng Future.
+    """
+
+    def __init__(self, fn, max_batch=32, max_wait=0.005):
+        self.fn = fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def _ensure_started(self):
+        # Thread nền được tạo lúc dùng lần đầu, và tạo lại trong process con sau fork
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue()
+                threading.Thread(target=self._run, args=(self._queue,), name="sentiment-batcher", daemon=True).start()
+                self._pid = os.getpid()
+
+    def submit(self, item):
+        self._ensure_started()
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def _run(self, q):
+        while True:
+            batch = [q.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(q.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            items = [item for item, _ in batch]
+            try:
+                results = self.fn(items)
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+
+
+class TransformerEngine(SentimentEngine):
+    name = "transformer"
+
+    def __init__(self, model_name="cardiffnlp/twitter-xlm-roberta-base-sentiment", max_length=256,
+                 max_batch=32, max_wait_ms=5, num_threads=None, quantize=False):
+        self.model_name = model_name
+        self.max_length = max_length
+        self.max_batch = max_batch
+        self.num_threads = num_threads
+        self.quantize = quantize
+        self._model = None
+        self._tokenizer = None
+        self._labels = None
+        self._load_lock = threading.Lock()
+        self._batcher = MicroBatcher(self._forward, max_batch, max_wait_ms / 1000.0)
+
+    @property
+    def version(self):
+        return f"transformer-{self.model_name}-{self.max_length}{'-int8' if self.quantize else ''}"
+
+    def load(self):
+        """Nạp tokenizer và model (chỉ một lần); gọi sớm để warmup."""
+        with self._load_lock:
+            if self._model is not None:
+                return
+            import torch
+            from transformers import AutoModelForSequenceClassification, AutoTokenizer
+            if self.num_threads:
+                torch.set_num_threads(self.num_threads)
+            tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+            model = AutoModelForSequenceClassification.from_pretrained(self.model_name)
+            model.eval()
+            if self.quantize:
+                model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+            self._labels = [_map_label(model.config.id2label[i]) for i in range(model.config.num_labels)]
+            self._tokenizer = tokenizer
+            self._model = model
+            self.ready = True
+
+    def classify(self, text):
+        # Lời gọi đơn lẻ đi qua micro-batcher để gộp với các request đồng thời khác
+        return self._batcher.submit(text).result()
+
+    def classify_batch(self, texts):
+        # Lô của hàng đợi cảm xúc cũng đi qua micro-batcher: các lô nhỏ của nhiều worker
+        # (hoặc phần lẻ cuối của một lô lớn) được gộp thành forward pass đầy max_batch
+        futures = [self._batcher.submit(text) for text in texts]
+        return [future.result() for future in futures]
+
+    def _forward(self, texts):
+        self.load()
+        import torch
+        results = []
+        for i in range(0, len(texts), self.max_batch):
+            chunk = [t or "" for t in texts[i:i + self.max_batch]]
+            inputs = self._tokenizer(chunk, padding=True, truncation=True,
+                                     max_length=self.max_length, return_tensors="pt")
+            with torch.inference_mode():
+                logits = self._model(**inputs).logits
+            results.extend(self._labels[j] for j in logits.argmax(dim=-1).tolist())
+        return results
+
+
+def _map_label(label):
+    """Đưa nhãn của model (negative/LABEL_0/1 star...) về positive/neutral/negative."""
+    label = str(label).lower()
+    if "neg" in label:
+        return "negative"
+    if "pos" in label:
+        return "positive"
+    if "star" in label:
+        stars = int(label.split()[0])
+        return "negative" if stars <= 2 else "positive" if stars >= 4 else "neutral"
+    if label in ("label_0", "0"):
+        return "negative"
+    if label in ("label_2", "2"):
+        return "positive"
+    return "neutral"
+
+
+#============================================================================================
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def create_engine(name=None):
+    name = name or os.environ.get("SENTIMENT_ENGINE", "textblob")
+    if name == "transformer":
+        threads = os.environ.get("SENTIMENT_THREADS")
+        return TransformerEngine(
+            model_name=os.environ.get("SENTIMENT_MODEL", "cardiffnlp/twitter-xlm-roberta-base-sentiment"),
+            max_length=int(os.environ.get("SENTIMENT_MAX_LENGTH", 256)),
+            max_batch=int(os.environ.get("SENTIMENT_MAX_BATCH", 32)),
+            max_wait_ms=float(os.environ.get("SENTIMENT_MAX_WAIT_MS", 5)),
+            num_threads=int(threads) if threads else None,
+            quantize=os.environ.get("SENTIMENT_QUANTIZE", "0") == "1"
+        )
+    if name == "textblob":
+        return TextBlobEngine()
+    raise ValueError(f"Unknown sentiment engine: {name}")
+
+
+def get_engine():
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = create_engine()
+    return _engine
+
+
+def warmup():
+    """Nạp và chạy thử engine hiện tại (đồng bộ)."""
+    get_engine().warmup()
+
+
+def start_background_warmup():
+    """Nạp engine ở thread nền để app phục vụ các route nhẹ ngay lập tức."""
+    def run():
+        try:
+            warmup()
+        except Exception:
+            logging.getLogger(__name__).exception("Sentiment engine warmup failed")
+    thread = threading.Thread(target=run, name="sentiment-warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+#============================================================================================
+def benchmark(engine, texts, requests, concurrency):
+    """Gửi `requests` lời gọi classify() từ `concurrency` thread; trả về throughput và latency."""
+    engine.classify(texts[0])  # warmup, không tính vào kết quả
+    latencies = []
+
+    def one(i):
+        start = time.perf_counter()
+        engine.classify(texts[i % len(texts)])
+        latencies.append(time.perf_counter() - start)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(one, range(requests)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    pct = lambda p: latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "throughput_rps": round(requests / elapsed, 1),
+        "p50_ms": round(pct(0.50), 2),
+        "p95_ms": round(pct(0.95), 2),
+        "p99_ms": round(pct(0.99), 2)
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sentiment engine tools")
+    parser.add_argument("command", choices=["bench"])
+    parser.add_argument("--engine", default=os.environ.get("SENTIMENT_ENGINE", "textblob"))
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    # Chỉ đo trên CPU
+    os.environ["CUDA_VISIBLE_DEVICES"] = ""
+    sample = [
+        "Hôm nay tôi rất vui vì được gặp lại bạn cũ.",
+        "Tôi thấy mệt mỏi và cô đơn, không muốn làm gì cả.",
+        "Today was fine, nothing special happened at work.",
+        "I am so grateful for my family and this beautiful weekend!",
+        "Everything went wrong and I feel hopeless.",
+    ]
+    print(benchmark(create_engine(args.engine), sample, args.requests, args.concurrency))
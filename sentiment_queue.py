@@ -0,0 +1,363 @@
+"""
+Hàng đợi phân tích cảm xúc chạy nền.
+
+create_entry/update_entry chỉ ghi một job vào collection `sentiment_jobs` rồi trả
+về ngay; các worker thread lấy job theo lô, chạy classify_sentiment, ghi sentiment/icon
+lên entry và upsert vào collection `emotion` (nguồn của rollup). Job được lưu trong Mongo nên không bị mất khi restart.
+Worker còn định kỳ quét lại các entry chưa có document emotion: lần quét thường chỉ xét
+entry mới (từ lần quét trước), mỗi full_recovery_interval một process quét toàn bộ để
+bắt cả entry có _id cũ (ví dụ ghi thẳng vào DB); restore_db.py quét các user vừa khôi phục.
+Khi entry bị xóa, EntryRepository xóa luôn document emotion và phần đóng góp vào rollup;
+worker chỉ dọn emotion của entry bị xóa trong lúc job của nó đang được xử lý.
+
+Job phân loại lỗi (ví dụ nội dung không đọc được) không làm hỏng cả lô: nó được thử lại
+tối đa MAX_ATTEMPTS lần rồi chuyển sang trạng thái `failed`, các job khác vẫn được ghi.
+"""
+import datetime
+import logging
+import os
+import threading
+import time
+
+from bson.objectid import ObjectId
+from pymongo import ReplaceOne, UpdateOne
+
+from data_versions import DataVersions
+from sentiment_cache import SentimentCache
+from sentiment_rollup import RollupDelta
+from utils import get_random_icon
+
+JOBS_COLLECTION = "sentiment_jobs"
+# Mốc _id của entry đã được recover() kiểm tra
+RECOVERY_COLLECTION = "sentiment_recovery"
+# Entry có _id tạo trong khoảng này trước lần quét vẫn được quét lại lần sau (insert đến muộn)
+RECOVERY_OVERLAP = datetime.timedelta(hours=1)
+# Chu kỳ quét entry mới chưa có emotion của worker đầu tiên
+RECOVERY_INTERVAL_SECONDS = 600
+RECOVERY_BATCH_SIZE = 1000
+MAX_ATTEMPTS = 3
+
+logger = logging.getLogger(__name__)
+
+
+def job_status(job, emotion):
+    """Trạng thái phân tích từ job (nếu còn) và document emotion của entry."""
+    if job:
+        if job.get("status") == "failed":
+            return {"status": "failed", "error": job.get("error", "")}
+        return {"status": "pending"}
+    if not emotion:
+        return {"status": "missing"}
+    return {"status": "done", "sentiment": emotion.get("sentiment", ""), "icon": emotion.get("icon", "")}
+
+
+class SentimentQueue:
+    def __init__(self, db, cache=None, workers=2, batch_size=32, poll_interval=1.0, lease_seconds=300, versions=None,
+                 full_recovery_hours=24):
+        self.db = db
+        self.cache = cache or SentimentCache(db)
+        self.versions = versions or DataVersions(db)
+        self.jobs = db[JOBS_COLLECTION]
+        self.workers = workers
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.lease = datetime.timedelta(seconds=lease_seconds)
+        self.full_recovery_interval = datetime.timedelta(hours=full_recovery_hours)
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+        self._pid = None
+
+    #========================================================================================
+    def enqueue(self, user_id, entry_id, icon=None, session=None):
+        """Đưa entry vào hàng đợi. Gọi lại cho cùng entry sẽ gộp thành một job."""
+        self.jobs.update_one(
+            {"entry_id": entry_id},
+            {"$set": {
+                "user_id": user_id,
+                "icon": icon,
+                "status": "pending",
+                "attempts": 0,
+                "version": ObjectId(),
+                "queued_at": datetime.datetime.utcnow()
+            }},
+            upsert=True,
+            session=session
+        )
+        self._wakeup.set()
+
+    def enqueue_many(self, user_id, items):
+        """Đưa nhiều entry vào hàng đợi bằng một bulk_write. items: [(entry_id, icon)]."""
+        if not items:
+            return
+        now = datetime.datetime.utcnow()
+        self.jobs.bulk_write([
+            UpdateOne(
+                {"entry_id": entry_id},
+                {"$set": {
+                    "user_id": user_id,
+                    "icon": icon,
+                    "status": "pending",
+                    "attempts": 0,
+                    "version": ObjectId(),
+                    "queued_at": now
+                }},
+                upsert=True
+            )
+            for entry_id, icon in items
+        ], ordered=False)
+        self._wakeup.set()
+
+    def status(self, user_id, entry_id):
+        """Trả về trạng thái phân tích của một entry: pending, failed, done hoặc missing."""
+        job = self.jobs.find_one({"entry_id": entry_id, "user_id": user_id}, {"status": 1, "error": 1})
+        emo = None if job else self.db.emotion.find_one({"entry_id": entry_id, "user_id": user_id})
+        return job_status(job, emo)
+
+    #========================================================================================
+    def start(self):
+        # Sau fork (gunicorn --preload) thread của process cha không còn: tạo lại trong process con
+        if self._threads and self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._threads = []
+        for i in range(self.workers):
+            t = threading.Thread(target=self._run, args=(i == 0,), name=f"sentiment-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        self._wakeup.set()
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+
+    def recover(self, full=None, user_ids=None):
+        """
+        Tạo job cho các entry chưa có document emotion (ví dụ process chết giữa lúc ghi
+        entry và lúc ghi job), bằng anti-join theo index emotion.entry_id.
+
+        Lần quét thường chỉ xét entry tạo sau mốc của lần quét trước (theo index _id). Mỗi
+        full_recovery_interval, một process (nhận lượt qua RECOVERY_COLLECTION) quét toàn
+        bộ entries; full=True buộc quét toàn bộ. user_ids: chỉ quét entry của các user này
+        (restore_db.py), không đổi mốc. Trả về số job đã tạo.
+        """
+        state = self.db[RECOVERY_COLLECTION]
+        now = datetime.datetime.utcnow()
+        match = {}
+        if user_ids is not None:
+            match["user_id"] = {"$in": list(user_ids)}
+        else:
+            checkpoint = state.find_one({"_id": "entries"})
+            if not checkpoint:
+                full = True
+            elif full is None:
+                full = state.find_one_and_update(
+                    {"_id": "entries", "full_scan_at": {"$not": {"$gte": now - self.full_recovery_interval}}},
+                    {"$set": {"full_scan_at": now}}
+                ) is not None
+            if not full:
+                match["_id"] = {"$gte": checkpoint["scanned_from"]}
+        pipeline = [
+            {"$match": match},
+            {"$lookup": {"from": "emotion", "localField": "_id", "foreignField": "entry_id", "as": "emo"}},
+            {"$match": {"emo": {"$size": 0}}},
+            {"$project": {"_id": 1, "user_id": 1}}
+        ]
+        count = 0
+        batch = []
+        for entry in self.db.entries.aggregate(pipeline):
+            batch.append(entry)
+            if len(batch) >= RECOVERY_BATCH_SIZE:
+                count += self._enqueue_missing(batch)
+                batch = []
+        count += self._enqueue_missing(batch)
+        if user_ids is None:
+            update = {"scanned_from": ObjectId.from_datetime(now - RECOVERY_OVERLAP)}
+            if full:
+                update["full_scan_at"] = now
+            state.update_one({"_id": "entries"}, {"$set": update}, upsert=True)
+        if count:
+            logger.info("Sentiment recovery queued %d entries%s", count, " (full scan)" if full else "")
+        return count
+
+    def _enqueue_missing(self, entries):
+        """Tạo job cho các entry chưa có job; job đang chờ (có thể kèm icon) được giữ nguyên."""
+        if not entries:
+            return 0
+        now = datetime.datetime.utcnow()
+        result = self.jobs.bulk_write([
+            UpdateOne(
+                {"entry_id": entry["_id"]},
+                {"$setOnInsert": {
+                    "user_id": entry["user_id"],
+                    "icon": None,
+                    "status": "pending",
+                    "attempts": 0,
+                    "version": ObjectId(),
+                    "queued_at": now
+                }},
+                upsert=True
+            )
+            for entry in entries
+        ], ordered=False)
+        if result.upserted_count:
+            self._wakeup.set()
+        return result.upserted_count
+
+    def _run(self, do_recover):
+        if do_recover:
+            try:
+                self.cache.invalidate_stale()
+            except Exception:
+                logger.exception("Sentiment cache cleanup failed")
+        next_recovery = 0
+        while not self._stop.is_set():
+            if do_recover and time.monotonic() >= next_recovery:
+                try:
+                    self.recover()
+                except Exception:
+                    logger.exception("Sentiment recovery failed")
+                next_recovery = time.monotonic() + RECOVERY_INTERVAL_SECONDS
+            try:
+                processed = self.process_batch()
+            except Exception:
+                logger.exception("Sentiment worker error")
+                processed = 0
+            if not processed:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+    #========================================================================================
+    def _claim_batch(self):
+        now = datetime.datetime.utcnow()
+        claimable = {"$or": [
+            {"status": "pending"},
+            # Job của worker đã chết: hết hạn lease thì cho worker khác nhận lại
+            {"status": "running", "claimed_at": {"$lt": now - self.lease}}
+        ]}
+        candidates = [j["_id"] for j in self.jobs.find(claimable, {"_id": 1}).sort("queued_at", 1).limit(self.batch_size)]
+        if not candidates:
+            return []
+        # Nhận cả lô bằng một update_many; job nào worker khác vừa nhận thì không khớp claimable nữa
+        claim = ObjectId()
+        self.jobs.update_many(
+            {"$and": [{"_id": {"$in": candidates}}, claimable]},
+            {"$set": {"status": "running", "claimed_at": now, "claim": claim}}
+        )
+        return list(self.jobs.find({"claim": claim, "status": "running"}))
+
+    def process_batch(self):
+        """Nhận một lô job, phân loại và ghi kết quả. Trả về số job đã xử lý."""
+        jobs = self._claim_batch()
+        if not jobs:
+            return 0
+        entries = self.db.entries.find({"_id": {"$in": [j["entry_id"] for j in jobs]}})
+        entries_by_id = {e["_id"]: e for e in entries}
+        found = [(job, entries_by_id[job["entry_id"]]) for job in jobs if job["entry_id"] in entries_by_id]
+        classified, failed = self._classify(found)
+        rollup = RollupDelta()
+        deleted = [job for job in jobs if job["entry_id"] not in entries_by_id]
+        for job in deleted:
+            # Entry đã bị xóa: bỏ emotion và phần đóng góp của nó vào rollup
+            rollup.add(self.db.emotion.find_one_and_delete({"user_id": job["user_id"], "entry_id": job["entry_id"]}), -1)
+        entry_ops = []
+        emotion_ops = []
+        now = datetime.datetime.utcnow()
+        # Bản cũ để trừ đúng phần đóng góp cũ vào rollup, đọc bằng một truy vấn $in. Job của
+        # một entry chỉ do một worker giữ tại một thời điểm nên bản cũ không đổi trước khi ghi.
+        old_docs = {}
+        if classified:
+            entry_ids = [entry["_id"] for _, entry, _ in classified]
+            old_docs = {doc["entry_id"]: doc for doc in self.db.emotion.find({"entry_id": {"$in": entry_ids}})}
+        for job, entry, sentiment in classified:
+            content = entry["content"]
+            icon = job.get("icon") or get_random_icon(sentiment)
+            emotion_doc = {
+                "user_id": entry["user_id"],
+                "entry_id": entry["_id"],
+                "date": entry["date"],
+                "content": content,
+                "sentiment": sentiment,
+                "icon": icon,
+                "updated_at": now
+            }
+            emotion_ops.append(ReplaceOne({"user_id": entry["user_id"], "entry_id": entry["_id"]}, emotion_doc, upsert=True))
+            rollup.replace(old_docs.get(entry["_id"]), emotion_doc)
+            entry_ops.append(UpdateOne({"_id": entry["_id"]}, {"$set": {"sentiment": sentiment, "icon": icon, "updated_at": now}}))
+        if emotion_ops:
+            self.db.emotion.bulk_write(emotion_ops, ordered=False)
+        if entry_ops:
+            self.db.entries.bulk_write(entry_ops, ordered=False)
+            self._drop_deleted(classified, old_docs, rollup)
+        rollup.apply(self.db)
+        self.versions.bump_many([entry["user_id"] for _, entry, _ in classified] + [job["user_id"] for job in deleted])
+        for job in jobs:
+            if job["_id"] in failed:
+                self._fail(job, failed[job["_id"]])
+                continue
+            # Chỉ xóa đúng phiên bản đã nhận; nếu entry bị sửa trong lúc xử lý thì job vẫn còn
+            self.jobs.delete_one({"_id": job["_id"], "version": job["version"]})
+        return len(jobs)
+
+    def _drop_deleted(self, classified, old_docs, rollup):
+        """
+        Entry bị xóa sau khi worker đọc nó: EntryRepository.delete có thể chạy trước lúc
+        upsert emotion ở trên, để lại document emotion mới. Nếu document đó còn thì xóa và
+        hoàn lại thay đổi rollup của lô (delete đã trừ bản cũ); nếu delete đã lấy nó thì
+        delete đã trừ bản mới nên giữ nguyên.
+        """
+        entry_ids = [entry["_id"] for _, entry, _ in classified]
+        live = {e["_id"] for e in self.db.entries.find({"_id": {"$in": entry_ids}}, {"_id": 1})}
+        for _, entry, _ in classified:
+            if entry["_id"] in live:
+                continue
+            emotion_doc = self.db.emotion.find_one_and_delete({"user_id": entry["user_id"], "entry_id": entry["_id"]})
+            if emotion_doc:
+                rollup.replace(emotion_doc, old_docs.get(entry["_id"]))
+
+    def _classify(self, found):
+        """
+        Phân loại cả lô bằng một lời gọi; nếu lỗi thì phân loại từng job để tìm job hỏng.
+        Trả về ([(job, entry, sentiment)], {job _id: lỗi}).
+        """
+        try:
+            sentiments = self.cache.classify_many([entry["content"] for _, entry in found])
+            return [(job, entry, s) for (job, entry), s in zip(found, sentiments)], {}
+        except Exception:
+            logger.warning("Sentiment batch of %d failed, classifying jobs one by one", len(found))
+        classified = []
+        failed = {}
+        for job, entry in found:
+            try:
+                classified.append((job, entry, self.cache.classify(entry["content"])))
+            except Exception as e:
+                logger.exception("Sentiment job for entry %s failed", entry["_id"])
+                failed[job["_id"]] = f"{type(e).__name__}: {e}"
+        return classified, failed
+
+    def _fail(self, job, error):
+        """Trả job về hàng đợi (xếp cuối) hoặc đánh dấu failed khi đã thử MAX_ATTEMPTS lần."""
+        attempts = job.get("attempts", 0) + 1
+        self.jobs.update_one(
+            {"_id": job["_id"], "version": job["version"]},
+            {"$set": {
+                "status": "failed" if attempts >= MAX_ATTEMPTS else "pending",
+                "attempts": attempts,
+                "error": error,
+                "queued_at": datetime.datetime.utcnow()
+            }}
+        )
+
+
+def create_queue(db, classify_batch=None):
+    """classify_batch: hàm phân loại thay cho classifier mặc định (ví dụ chạy trong process pool)."""
+    cache_options = {"classify_batch": classify_batch} if classify_batch else {}
+    return SentimentQueue(
+        db,
+        cache=SentimentCache(db, max_size=int(os.environ.get("SENTIMENT_CACHE_SIZE", 10000)), **cache_options),
+        workers=int(os.environ.get("SENTIMENT_WORKERS", 2)),
+        batch_size=int(os.environ.get("SENTIMENT_BATCH_SIZE", 32)),
+        full_recovery_hours=float(os.environ.get("SENTIMENT_FULL_RECOVERY_HOURS", 24))
+    )
@@ -0,0 +1,171 @@
+"""
+Bảng tổng hợp số entry theo cảm xúc cho từng user, từng ngày (collection `sentiment_daily`).
+
+Mỗi document emotion lưu kèm `date` của entry, nên phần đóng góp của nó vào rollup
+là (user_id, date, sentiment). Khi worker ghi đè một document emotion hoặc khi
+entry bị xóa, ta trừ phần đóng góp cũ và cộng phần mới bằng $inc. /emotions/stats
+chỉ cần cộng các dòng trong khoảng ngày thay vì $lookup sang entries.
+
+Dựng lại từ dữ liệu hiện có:
+    python sentiment_rollup.py rebuild [--user USER_ID]
+"""
+import argparse
+import datetime
+import os
+from collections import Counter, defaultdict
+
+from bson.objectid import ObjectId
+from pymongo import MongoClient, UpdateOne
+
+from data_versions import DataVersions
+
+ROLLUP_COLLECTION = "sentiment_daily"
+SENTIMENTS = ["positive", "neutral", "negative"]
+PERIOD_DAYS = {"week": 7, "month": 30, "year": 365}
+
+
+class RollupDelta:
+    """Gom các thay đổi (+1/-1) theo (user_id, date) rồi ghi bằng một bulk_write."""
+
+    def __init__(self):
+        self.counts = defaultdict(Counter)
+
+    def add(self, emotion_doc, step=1):
+        if not emotion_doc or not emotion_doc.get("date") or emotion_doc.get("sentiment") not in SENTIMENTS:
+            return
+        self.counts[(emotion_doc["user_id"], emotion_doc["date"])][emotion_doc["sentiment"]] += step
+
+    def replace(self, old_doc, new_doc):
+        self.add(old_doc, -1)
+        self.add(new_doc, 1)
+
+    def apply(self, db, session=None):
+        ops = []
+        for (user_id, date), counter in self.counts.items():
+            inc = {s: n for s, n in counter.items() if n}
+            if inc:
+                ops.append(UpdateOne({"user_id": user_id, "date": date}, {"$inc": inc}, upsert=True))
+        if ops:
+            db[ROLLUP_COLLECTION].bulk_write(ops, ordered=False, session=session)
+        self.counts.clear()
+        return len(ops)
+
+
+TOTALS_PROJECTION = {s: 1 for s in SENTIMENTS}
+
+
+def range_query(user_id, start=None, end=None):
+    """Truy vấn các dòng rollup của user trong khoảng ngày [start, end] (chuỗi YYYY-MM-DD)."""
+    query = {"user_id": user_id}
+    date_range = {}
+    if start:
+        date_range["$gte"] = start
+    if end:
+        date_range["$lte"] = end
+    if date_range:
+        query["date"] = date_range
+    return query
+
+
+def sum_rows(rows):
+    totals = {s: 0 for s in SENTIMENTS}
+    for row in rows:
+        for s in SENTIMENTS:
+            totals[s] += row.get(s, 0)
+    return totals
+
+
+def sum_range(db, user_id, start=None, end=None):
+    """Tổng số entry theo cảm xúc trong khoảng ngày [start, end] (chuỗi YYYY-MM-DD)."""
+    return sum_rows(db[ROLLUP_COLLECTION].find(range_query(user_id, start, end), TOTALS_PROJECTION))
+
+
+def stats_range(period, start=None, end=None):
+    """
+    Khoảng ngày cho /emotions/stats: from/to nếu có, ngược lại N ngày gần nhất tính cả
+    hôm nay theo period (mặc định month). Trả về (start, end, lỗi).
+    """
+    for value in (start, end):
+        if value:
+            try:
+                datetime.datetime.strptime(value, "%Y-%m-%d")
+            except ValueError:
+                return None, None, "Date must be in YYYY-MM-DD format"
+    if not start and not end:
+        days = PERIOD_DAYS.get(period, 30)
+        start = (datetime.date.today() - datetime.timedelta(days=days - 1)).isoformat()
+    return start, end, None
+
+
+def to_chart(totals):
+    """Định dạng dữ liệu biểu đồ mà trang charts đang dùng."""
+    return {
+        "labels": [s.capitalize() for s in SENTIMENTS],
+        "datasets": [{
+            "label": "Emotion Count",
+            "data": [totals[s] for s in SENTIMENTS],
+            "backgroundColor": ["#81c784", "#fff176", "#e57373"]
+        }]
+    }
+
+
+#============================================================================================
+def rebuild(db, user_id=None, batch_size=1000):
+    """
+    Dựng lại rollup từ collection emotion. Document emotion cũ chưa có `date` sẽ được
+    bổ sung từ entry tương ứng trước khi đếm.
+    """
+    emotion_col = db.emotion
+    match = {"user_id": user_id} if user_id else {}
+
+    missing = emotion_col.find(dict(match, date={"$exists": False}), {"entry_id": 1}).batch_size(batch_size)
+    batch = []
+    for emo in missing:
+        batch.append(emo)
+        if len(batch) >= batch_size:
+            _backfill_dates(db, batch)
+            batch = []
+    if batch:
+        _backfill_dates(db, batch)
+
+    counts = defaultdict(Counter)
+    for emo in emotion_col.find(dict(match, date={"$exists": True}), {"user_id": 1, "date": 1, "sentiment": 1}).batch_size(batch_size):
+        if emo.get("sentiment") in SENTIMENTS:
+            counts[(emo["user_id"], emo["date"])][emo["sentiment"]] += 1
+
+    db[ROLLUP_COLLECTION].delete_many(match)
+    docs = []
+    for (uid, date), counter in counts.items():
+        doc = {"user_id": uid, "date": date}
+        doc.update({s: counter.get(s, 0) for s in SENTIMENTS})
+        docs.append(doc)
+    for i in range(0, len(docs), batch_size):
+        db[ROLLUP_COLLECTION].insert_many(docs[i:i + batch_size], ordered=False)
+    # Số liệu /emotions/stats có thể đã đổi: bỏ ETag và response đã cache
+    versions = DataVersions(db)
+    if user_id:
+        versions.bump(user_id)
+    else:
+        versions.bump_all()
+    return len(docs)
+
+
+def _backfill_dates(db, emotions):
+    entries = db.entries.find({"_id": {"$in": [e["entry_id"] for e in emotions]}}, {"date": 1})
+    dates = {e["_id"]: e["date"] for e in entries}
+    ops = [UpdateOne({"_id": e["_id"]}, {"$set": {"date": dates[e["entry_id"]]}})
+           for e in emotions if e["entry_id"] in dates]
+    if ops:
+        db.emotion.bulk_write(ops, ordered=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage per-user daily sentiment rollups")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.add_argument("--user", help="Only rebuild rollups for this user id")
+    parser.add_argument("--uri", default=os.environ.get("MONGO_URI", "mongodb://localhost:27017/emotional_diary_db"))
+    args = parser.parse_args()
+
+    db = MongoClient(args.uri).get_default_database()
+    rows = rebuild(db, ObjectId(args.user) if args.user else None)
+    print(f"Rebuilt {rows} rollup rows")
@@ -0,0 +1,226 @@
+"""
+Dòng thời gian cảm xúc cho /emotions/timeline: số entry theo cảm xúc theo ngày/tuần/tháng,
+điểm tâm trạng, trung bình trượt và chuỗi ngày liên tiếp trong một khoảng ngày bất kỳ.
+
+Dữ liệu lấy từ rollup `sentiment_daily` và được giữ trong bộ nhớ theo dạng cột cho mỗi
+user: một array ngày (số ngày từ 1970-01-01) và một ma trận N x 3 số entry
+positive/neutral/negative. Mọi phép tính làm bằng NumPy trên các array đó; chỉ mục được
+dựng lại khi version dữ liệu của user (user_versions) khác với lúc đọc.
+
+Điểm tâm trạng của một khoảng = (positive - negative) / tổng số entry, trong [-1, 1];
+khoảng không có entry có điểm null. Khi số điểm vượt `points`, các khoảng liền nhau được
+gộp (cộng số entry) để còn không quá `points` điểm.
+"""
+import datetime
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from sentiment_rollup import ROLLUP_COLLECTION, SENTIMENTS, stats_range
+
+BUCKETS = ("day", "week", "month")
+# Cửa sổ trung bình trượt mặc định, tính theo số khoảng (7 ngày, 4 tuần, 3 tháng)
+DEFAULT_WINDOW = {"day": 7, "week": 4, "month": 3}
+MAX_WINDOW = 366
+POINTS_DEFAULT = 365
+POINTS_MAX = 2000
+MAX_RANGE_DAYS = 366 * 50
+_EPOCH = datetime.date(1970, 1, 1)
+
+
+def _to_day(value):
+    return (datetime.date.fromisoformat(value) - _EPOCH).days
+
+
+def _to_iso(day):
+    return (_EPOCH + datetime.timedelta(days=int(day))).isoformat()
+
+
+def parse_timeline_args(args):
+    """
+    Đọc query string của /emotions/timeline. Trả về (tham số cho TimelineStore.timeline, lỗi).
+    Không có from/to thì lấy N ngày gần nhất theo period (mặc định year); period=all là
+    toàn bộ lịch sử.
+    """
+    bucket = args.get("bucket", "day")
+    if bucket not in BUCKETS:
+        return None, f"bucket must be one of {', '.join(BUCKETS)}"
+    period = args.get("period", "year")
+    if period == "all" and not args.get("from") and not args.get("to"):
+        start, end = None, None
+    else:
+        start, end, error = stats_range(period, args.get("from"), args.get("to"))
+        if error:
+            return None, error
+    if start and end and start > end:
+        return None, "'from' must not be after 'to'"
+    try:
+        points = int(args.get("points", POINTS_DEFAULT))
+        window = int(args.get("window", DEFAULT_WINDOW[bucket]))
+    except ValueError:
+        return None, "points and window must be integers"
+    return {
+        "start": start,
+        "end": end,
+        "bucket": bucket,
+        "points": max(2, min(points, POINTS_MAX)),
+        "window": max(1, min(window, MAX_WINDOW))
+    }, None
+
+
+#============================================================================================
+def _streaks(mask):
+    """Chuỗi True dài nhất và chuỗi kết thúc ở ngày cuối của mask."""
+    edges = np.diff(np.concatenate(([0], mask.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    if not len(starts):
+        return {"longest": 0, "current": 0}
+    lengths = ends - starts
+    return {
+        "longest": int(lengths.max()),
+        "current": int(lengths[-1]) if ends[-1] == len(mask) else 0
+    }
+
+
+def _ratio(numerator, denominator):
+    """numerator / denominator làm tròn 3 chữ số, null khi mẫu bằng 0."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        values = np.round(numerator / denominator, 3)
+    return [None if d == 0 else v for v, d in zip(values.tolist(), denominator.tolist())]
+
+
+def compute(days, counts, start, end, bucket="day", points=POINTS_DEFAULT, window=None):
+    """
+    Dòng thời gian từ array ngày đã sắp xếp (int, không trùng) và ma trận số entry tương
+    ứng, trong khoảng [start, end] (số ngày). Trả về dict JSON của route.
+    """
+    window = window or DEFAULT_WINDOW[bucket]
+    lo, hi = np.searchsorted(days, start, "left"), np.searchsorted(days, end, "right")
+    n_days = end - start + 1
+    # Ma trận theo từng ngày của khoảng, ngày không có entry là 0
+    daily = np.zeros((n_days, len(SENTIMENTS)), dtype=np.int64)
+    daily[days[lo:hi] - start] = counts[lo:hi]
+    offsets = np.arange(n_days)
+
+    if bucket == "day":
+        keys = offsets
+    elif bucket == "week":
+        # Tuần bắt đầu từ thứ Hai; 1970-01-01 là thứ Năm
+        keys = (offsets + (start + 3) % 7) // 7
+    else:
+        keys = (np.datetime64(_to_iso(start), "D") + offsets).astype("datetime64[M]").astype(np.int64)
+    firsts = np.flatnonzero(np.diff(keys, prepend=keys[0] - 1))
+    buckets = np.add.reduceat(daily, firsts, axis=0)
+    net = buckets[:, 0] - buckets[:, 2]
+    total = buckets.sum(axis=1)
+
+    # Trung bình trượt theo trọng số số entry, trên các khoảng gốc (trước khi gộp điểm)
+    net_cum = np.concatenate(([0], np.cumsum(net)))
+    total_cum = np.concatenate(([0], np.cumsum(total)))
+    idx = np.arange(1, len(buckets) + 1)
+    back = np.maximum(idx - window, 0)
+    net_window = net_cum[idx] - net_cum[back]
+    total_window = total_cum[idx] - total_cum[back]
+
+    group = -(-len(buckets) // points)
+    if group > 1:
+        group_firsts = np.arange(0, len(buckets), group)
+        # Mỗi điểm mang giá trị trung bình trượt tại khoảng cuối cùng của nó
+        group_lasts = np.minimum(group_firsts + group, len(buckets)) - 1
+        net_window, total_window = net_window[group_lasts], total_window[group_lasts]
+        buckets = np.add.reduceat(buckets, group_firsts, axis=0)
+        net = buckets[:, 0] - buckets[:, 2]
+        total = buckets.sum(axis=1)
+        firsts = firsts[group_firsts]
+
+    labels = [_to_iso(day) for day in (firsts + start).tolist()]
+    if bucket == "month":
+        labels = [label[:7] for label in labels]
+    daily_total = daily.sum(axis=1)
+    daily_net = daily[:, 0] - daily[:, 2]
+    totals = daily.sum(axis=0)
+    result = {
+        "bucket": bucket,
+        "from": _to_iso(start),
+        "to": _to_iso(end),
+        # Số khoảng gốc gộp thành một điểm (1 khi không phải downsample)
+        "bucket_size": group,
+        "window": window,
+        "labels": labels,
+        "score": _ratio(net, total),
+        "moving_average": _ratio(net_window, total_window),
+        "totals": {s: int(totals[i]) for i, s in enumerate(SENTIMENTS)},
+        "streaks": {
+            "journaling": _streaks(daily_total > 0),
+            "positive": _streaks(daily_net > 0),
+            "negative": _streaks(daily_net < 0)
+        }
+    }
+    for i, s in enumerate(SENTIMENTS):
+        result[s] = buckets[:, i].tolist()
+    result["totals"]["score"] = _ratio(np.array([totals[0] - totals[2]]), np.array([totals.sum()]))[0]
+    return result
+
+
+#============================================================================================
+class UserSeries:
+    def __init__(self, version, rows):
+        self.version = version
+        self.days = np.fromiter((_to_day(row["date"]) for row in rows), dtype=np.int64, count=len(rows))
+        self.counts = np.array([[row.get(s, 0) for s in SENTIMENTS] for row in rows], dtype=np.int64)
+        self.counts = self.counts.reshape(len(rows), len(SENTIMENTS))
+
+
+class TimelineStore:
+    """LRU các chuỗi ngày/số entry theo user, dựng lại khi version dữ liệu của user đổi."""
+
+    def __init__(self, db, versions, max_users=1000):
+        self.rollups = db[ROLLUP_COLLECTION]
+        self.versions = versions
+        self.max_users = max_users
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+        self.builds = 0
+
+    def _get(self, user_id):
+        version = self.versions.get(user_id)
+        with self._lock:
+            series = self._users.get(user_id)
+            if series is not None and series.version == version:
+                self._users.move_to_end(user_id)
+                return series
+        rows = list(self.rollups.find(
+            {"user_id": user_id}, {"_id": 0, "date": 1, **{s: 1 for s in SENTIMENTS}}
+        ).sort("date", 1))
+        series = UserSeries(version, rows)
+        with self._lock:
+            self.builds += 1
+            self._users[user_id] = series
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        return series
+
+    def timeline(self, user_id, start=None, end=None, bucket="day", points=POINTS_DEFAULT, window=None):
+        """
+        start/end là chuỗi YYYY-MM-DD hoặc None (ngày đầu tiên có dữ liệu / hôm nay hoặc
+        ngày cuối có dữ liệu nếu muộn hơn). Trả về (dict, lỗi).
+        """
+        series = self._get(user_id)
+        today = (datetime.date.today() - _EPOCH).days
+        end = _to_day(end) if end else max(today, int(series.days[-1]) if len(series.days) else today)
+        start = _to_day(start) if start else (int(series.days[0]) if len(series.days) else end)
+        start = min(start, end)
+        if end - start + 1 > MAX_RANGE_DAYS:
+            return None, f"Date range must not exceed {MAX_RANGE_DAYS} days"
+        return compute(series.days, series.counts, start, end, bucket, points, window), None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "users": len(self._users),
+                "days": sum(len(series.days) for series in self._users.values()),
+                "builds": self.builds
+            }
@@ -87,7 +87,7 @@ async function fetchEmotionsMap(year, month) {
   if (emotionsCache[ymKey] && Date.now() - emotionsCache[ymKey].timestamp < 60 * 1000) {
     return emotionsCache[ymKey].map;
   }    try {
-    const res = await fetch(`/emotions?user_id=${encodeURIComponent(user.user_id)}`, {
+    const res = await fetch(`/emotions`, {
       headers: getAuthHeaders()
     });
     if (!res.ok) return {};
@@ -259,8 +259,10 @@ function formatDateKey(year, month, day) {
   return `${year}-${mm}-${dd}`;
 }
 
-prevMonthBtn.addEventListener("click", () => {
+prevMonthBtn.addEventListener("click", async () => {
   currentCalendarDate.setMonth(currentCalendarDate.getMonth() -1 );
+  // Lùi về tháng cũ hơn các trang đã tải thì tải thêm trước khi vẽ lịch
+  await ensureEntriesLoadedFor(currentCalendarDate.getFullYear(), currentCalendarDate.getMonth());
   renderCalendar(currentCalendarDate.getFullYear(), currentCalendarDate.getMonth());
 });
 nextMonthBtn.addEventListener("click", () => {
@@ -356,15 +358,60 @@ function getAuthHeaders() {
   return user && user.token ? { "Authorization": "Bearer " + user.token, "Content-Type": "application/json" } : { "Content-Type": "application/json" };
 }
 
+// Entries được tải theo từng trang (cursor trên date, _id), mới nhất trước
+const ENTRIES_PAGE_SIZE = 100;
+let nextEntriesCursor = null;
+let entriesLoading = false;
+
+async function fetchEntriesPage(cursor) {
+  const user = JSON.parse(localStorage.getItem("user"));
+  if (!user || !user.user_id) return null;
+  let url = `${apiBaseURL}?limit=${ENTRIES_PAGE_SIZE}&fields=date,content,emotions`;
+  if (cursor) url += `&cursor=${encodeURIComponent(cursor)}`;
+  const res = await fetch(url, { headers: getAuthHeaders() });
+  if (!res.ok) throw new Error("Failed to fetch entries");
+  return res.json();
+}
+
+async function loadMoreEntries(render = true) {
+  if (!nextEntriesCursor || entriesLoading) return false;
+  entriesLoading = true;
+  try {
+    const page = await fetchEntriesPage(nextEntriesCursor);
+    if (!page) return false;
+    allEntries = allEntries.concat(page.entries);
+    nextEntriesCursor = page.next_cursor;
+  } catch (err) {
+    showMessage("Error loading entries.", true);
+    return false;
+  } finally {
+    entriesLoading = false;
+  }
+  if (render) renderCalendar(currentCalendarDate.getFullYear(), currentCalendarDate.getMonth());
+  return true;
+}
+
+// Tải thêm trang cho đến khi đã có đủ entries của tháng đang xem
+async function ensureEntriesLoadedFor(year, month) {
+  const monthStart = formatDateKey(year, month + 1, 1);
+  while (nextEntriesCursor && allEntries.length > 0 && allEntries[allEntries.length - 1].date >= monthStart) {
+    if (!(await loadMoreEntries(false))) break;
+  }
+}
+
+window.addEventListener("scroll", () => {
+  if (window.innerHeight + window.scrollY >= document.body.offsetHeight - 200) {
+    loadMoreEntries();
+  }
+});
+
 async function fetchEntries() {
   try {
-    const user = JSON.parse(localStorage.getItem("user"));
-    if (!user || !user.user_id) return;
-    const res = await fetch(apiBaseURL + "?user_id=" + encodeURIComponent(user.user_id), {
-      headers: getAuthHeaders()
-    });
-    if (!res.ok) throw new Error("Failed to fetch entries");
-    allEntries = await res.json();
+    const page = await fetchEntriesPage(null);
+    if (!page) return;
+    allEntries = page.entries;
+    nextEntriesCursor = page.next_cursor;
+    await ensureEntriesLoadedFor(currentCalendarDate.getFullYear(), currentCalendarDate.getMonth());
     // Xóa cache cảm xúc khi CRUD
     emotionsCache = {};
     renderCalendar(currentCalendarDate.getFullYear(), currentCalendarDate.getMonth());
@@ -380,11 +427,29 @@ async function fetchEntries() {
   }
 }
 
+// Cảm xúc được phân tích ở backend sau khi lưu; poll đến khi xong rồi vẽ lại lịch
+async function waitForSentiment(id, attempts = 10, delay = 500) {
+  for (let i = 0; i < attempts; i++) {
+    try {
+      const res = await fetch(`${apiBaseURL}/${id}/sentiment`, { headers: getAuthHeaders() });
+      if (!res.ok) return;
+      const data = await res.json();
+      if (data.status !== "pending") {
+        emotionsCache = {};
+        renderCalendar(currentCalendarDate.getFullYear(), currentCalendarDate.getMonth());
+        return;
+      }
+    } catch {
+      return;
+    }
+    await new Promise(resolve => setTimeout(resolve, delay));
+  }
+}
+
 async function addEntry(entry) {
   try {
     const user = JSON.parse(localStorage.getItem("user"));
     if (!user || !user.user_id) return;
-    entry.user_id = user.user_id;
     // Không gửi icon vì sẽ được tạo ở backend
     delete entry.icon;
     const res = await fetch(apiBaseURL, {
@@ -393,11 +458,13 @@ async function addEntry(entry) {
       body: JSON.stringify(entry)
     });
     if (!res.ok) throw new Error("Failed to add entry");
+    const created = await res.json();
     showMessage("Entry added!");
     entryForm.reset();
     entryForm.style.display = "none";
     emotionsCache = {}; // Clear cache để refetch cảm xúc
-    fetchEntries();
+    await fetchEntries();
+    if (created.sentiment_status === "pending") waitForSentiment(created._id);
   } catch (err) {
     showMessage("Error adding entry.", true);
   }
@@ -411,7 +478,6 @@ async function updateEntry(id, entry) {
     // Log để debug
     console.log("Updating entry:", id, entry);
     
-    entry.user_id = user.user_id;
     // Đảm bảo không gửi icon
     delete entry.icon;
 
@@ -446,6 +512,7 @@ async function updateEntry(id, entry) {
 
     // Render lại calendar và entries
     await fetchEntries(); // Fetch lại toàn bộ để đảm bảo dữ liệu đồng bộ
+    if (updatedEntry.sentiment_status === "pending") waitForSentiment(id);
     
   } catch (err) {
     console.error("Update error:", err);
@@ -461,7 +528,7 @@ async function deleteEntry(id) {
   }
   if (!confirm("Delete this entry?")) return;
   try {
-    const res = await fetch(`${apiBaseURL}/${id}?user_id=${encodeURIComponent(user.user_id)}`, {
+    const res = await fetch(`${apiBaseURL}/${id}`, {
       method: "DELETE",
       headers: getAuthHeaders()
     });
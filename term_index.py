@@ -0,0 +1,179 @@
+"""
+Chỉ mục tần suất từ theo user, phục vụ wordcloud mà không phải tách từ lại.
+
+Mỗi entry lưu `terms` = {từ: số lần} của content (đã bỏ stopwords). Tổng cho từng user
+ở hai phạm vi `all` và `negative` (entry có is_negative, tính cả nhãn emotions như
+trước) nằm trong document version của user (`user_versions`), nên EntryRepository
+$inc phần chênh lệch giữa bản cũ và bản mới cùng lệnh tăng version (term_increments).
+Bản cũ lưu ở collection `user_terms` được chuyển sang bằng migration 0003; trong lúc nó
+chưa xong, user còn document trong `user_terms` được đọc từ đó. Wordcloud theo khoảng
+ngày hoặc theo kết quả tìm kiếm được gộp từ `terms` đã lưu trên các entry.
+"""
+import datetime
+import logging
+import re
+from collections import Counter, defaultdict
+
+from pymongo import UpdateOne
+
+from data_versions import VERSIONS_COLLECTION
+from keywords import STOPWORDS, MIN_TERM_LENGTH, backfill_keywords
+
+TERMS_COLLECTION = VERSIONS_COLLECTION
+LEGACY_TERMS_COLLECTION = "user_terms"
+WORDCLOUD_SIZE = 50
+# Số lần quét lại khi version của user đổi trong lúc rebuild
+REBUILD_RETRIES = 5
+
+logger = logging.getLogger(__name__)
+
+
+def tokenize(text):
+    """Tách từ, chuyển về chữ thường, bỏ stopwords và từ quá ngắn."""
+    return Counter(
+        w for w in re.findall(r'\b\w+\b', (text or "").lower())
+        if w not in STOPWORDS and len(w) > MIN_TERM_LENGTH
+    )
+
+
+def entry_terms(content):
+    return {"terms": dict(tokenize(content))}
+
+
+def _contribution(entry):
+    """Phần đóng góp của một entry vào tổng của user: (all, negative)."""
+    if not entry:
+        return Counter(), Counter()
+    terms = Counter(entry.get("terms") or {})
+    negative = Counter()
+    if entry.get("is_negative"):
+        negative.update(terms)
+        # Nhãn emotions là chuỗi tự do: bỏ qua chuỗi không dùng được làm tên field Mongo
+        negative.update(
+            em.lower() for em in entry.get("emotions") or []
+            if isinstance(em, str) and em.lower() not in STOPWORDS and len(em) > MIN_TERM_LENGTH
+            and "." not in em and not em.startswith("$")
+        )
+    return terms, negative
+
+
+def to_wordcloud(counts, limit=WORDCLOUD_SIZE):
+    counter = Counter({w: c for w, c in counts.items() if c > 0})
+    return [{"text": w, "value": c} for w, c in counter.most_common(limit)]
+
+
+def add_contribution(counts, entry, scope="all"):
+    """Cộng `terms` đã lưu của một entry (lấy với WORDCLOUD_PROJECTION) vào counts."""
+    all_terms, negative = _contribution(entry)
+    counts.update(negative if scope == "negative" else all_terms)
+
+
+WORDCLOUD_PROJECTION = {"terms": 1, "emotions": 1, "is_negative": 1}
+
+
+def term_increments(changes):
+    """{user_id: {"all.<từ>"/"negative.<từ>": chênh lệch}} cho các cặp (bản cũ, bản mới) của entry."""
+    incs = defaultdict(Counter)
+    for old_entry, new_entry in changes:
+        entry = new_entry or old_entry
+        if not entry:
+            continue
+        old_all, old_neg = _contribution(old_entry)
+        new_all, new_neg = _contribution(new_entry)
+        inc = incs[entry["user_id"]]
+        for scope, old, new in (("all", old_all, new_all), ("negative", old_neg, new_neg)):
+            for term in set(old) | set(new):
+                inc[f"{scope}.{term}"] += new.get(term, 0) - old.get(term, 0)
+    return {user_id: {k: v for k, v in inc.items() if v} for user_id, inc in incs.items()}
+
+
+class TermIndex:
+    def __init__(self, db, migrated=None):
+        """migrated: MigrationStatus của migration 0003 (None: coi như đã xong)."""
+        self.db = db
+        self.collection = db[TERMS_COLLECTION]
+        self.legacy = db[LEGACY_TERMS_COLLECTION]
+        self.migrated = migrated
+
+    def apply(self, old_entry, new_entry, session=None):
+        """Cập nhật tổng của user theo chênh lệch giữa bản cũ và bản mới của một entry."""
+        self.apply_many([(old_entry, new_entry)], session)
+
+    def apply_many(self, changes, session=None):
+        """Như apply cho nhiều cặp (cũ, mới); gộp thành một $inc cho mỗi user."""
+        ops = [
+            UpdateOne({"_id": user_id}, {"$inc": inc}, upsert=True)
+            for user_id, inc in term_increments(changes).items() if inc
+        ]
+        if ops:
+            self.collection.bulk_write(ops, ordered=False, session=session)
+
+    #========================================================================================
+    def totals(self, user_id, scope="all"):
+        """Document tổng của user (chỉ field scope), hoặc None."""
+        if self.migrated is not None and not self.migrated.done():
+            doc = self.legacy.find_one({"_id": user_id}, {scope: 1})
+            if doc:
+                return doc
+        return self.collection.find_one({"_id": user_id}, {scope: 1})
+
+    def wordcloud(self, user_id, scope="all", limit=WORDCLOUD_SIZE):
+        doc = self.totals(user_id, scope) or {}
+        return to_wordcloud(doc.get(scope, {}), limit)
+
+    def wordcloud_for(self, entries_collection, query, scope="all", limit=WORDCLOUD_SIZE):
+        """Gộp `terms` đã lưu của các entry khớp query (ví dụ một khoảng ngày)."""
+        counts = Counter()
+        for entry in entries_collection.find(query, WORDCLOUD_PROJECTION):
+            add_contribution(counts, entry, scope)
+        return to_wordcloud(counts, limit)
+
+    def backfill(self, entries_collection, user_id, batch_size=500):
+        """Tính `terms` cho entry cũ của user và cộng vào tổng (chạy một lần cho mỗi entry)."""
+        backfill_keywords(entries_collection, user_id, batch_size)
+        missing = entries_collection.find(
+            {"user_id": user_id, "terms": {"$exists": False}},
+            {"user_id": 1, "content": 1, "emotions": 1, "is_negative": 1}
+        ).batch_size(batch_size)
+        for entry in missing:
+            fields = entry_terms(entry.get("content"))
+            result = entries_collection.update_one(
+                {"_id": entry["_id"], "terms": {"$exists": False}},
+                {"$set": dict(fields, updated_at=datetime.datetime.utcnow())}
+            )
+            if result.modified_count:
+                entry.update(fields)
+                self.apply(None, entry)
+
+    def rebuild(self, entries_collection, user_id, batch_size=500):
+        """
+        Tính lại toàn bộ tổng của user từ `terms` trên các entry. Tổng mới được ghi vào
+        field tạm rồi đổi tên thành all/negative chỉ khi version của user không đổi từ lúc
+        bắt đầu quét: mỗi lần ghi entry tăng version cùng lệnh $inc tổng, nên $inc xen vào
+        giữa không bị ghi đè mà lần quét được chạy lại. Trả về False nếu hết số lần thử.
+        """
+        self.backfill(entries_collection, user_id, batch_size)
+        projection = {"terms": 1, "emotions": 1, "is_negative": 1}
+        for _ in range(REBUILD_RETRIES):
+            doc = self.collection.find_one({"_id": user_id}, {"version": 1})
+            version = doc.get("version") if doc else None
+            totals = {"all": Counter(), "negative": Counter()}
+            for entry in entries_collection.find({"user_id": user_id}, projection).batch_size(batch_size):
+                all_terms, negative = _contribution(entry)
+                totals["all"].update(all_terms)
+                totals["negative"].update(negative)
+            # Field tạm thay vì replace: document còn giữ version/search của user
+            self.collection.update_one(
+                {"_id": user_id},
+                {"$set": {"all_staging": dict(totals["all"]), "negative_staging": dict(totals["negative"])}},
+                upsert=True
+            )
+            swapped = self.collection.update_one(
+                {"_id": user_id, "version": version},
+                {"$rename": {"all_staging": "all", "negative_staging": "negative"}}
+            )
+            if swapped.matched_count:
+                return True
+        self.collection.update_one({"_id": user_id}, {"$unset": {"all_staging": "", "negative_staging": ""}})
+        logger.warning("Term totals of user %s changed during %d rebuilds, kept incremental totals", user_id, REBUILD_RETRIES)
+        return False
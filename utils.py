@@ -1,38 +1,152 @@
+import base64
+import datetime
 import hashlib
 import jwt
-from flask import request, jsonify
+from flask import request, jsonify, Response, stream_with_context
 from bson.objectid import ObjectId
-from textblob import TextBlob
+from sentiment_engine import get_engine
+from metrics import span, observe_span
+import fast_json
 from flask import current_app as app
+from collections import OrderedDict
 import random
+import threading
+import time
 
 def hash_password(password):
     return hashlib.sha256(password.encode()).hexdigest()
 
-def generate_token(user_id, username):
-    token = jwt.encode({"user_id": str(user_id), "username": username}, app.config["SECRET_KEY"], algorithm="HS256")
+def generate_token(user_id, username, secret_key=None):
+    # secret_key cho app không phải Flask (main_async); mặc định lấy từ config của app Flask
+    token = jwt.encode({"user_id": str(user_id), "username": username}, secret_key or app.config["SECRET_KEY"], algorithm="HS256")
     if isinstance(token, bytes):
         token = token.decode("utf-8")
     return token
 
-def decode_token(token):
+def decode_token(token, secret_key=None):
     try:
-        return jwt.decode(token, app.config["SECRET_KEY"], algorithms=["HS256"])
+        return jwt.decode(token, secret_key or app.config["SECRET_KEY"], algorithms=["HS256"])
     except Exception:
         return None
 
-def get_current_user(users_collection):
-    auth = request.headers.get("Authorization", "")
-    if not auth.startswith("Bearer "):
-        return None
-    token = auth.split(" ", 1)[1]
-    payload = decode_token(token)
+class UserCache:
+    """
+    Cache token đã xác thực -> danh tính user ({"_id", "username"}), có TTL và giới hạn
+    kích thước (LRU), để không phải find_one trên users ở mỗi request.
+
+    Hết hạn chỉ theo TTL, có chủ ý thay cho việc xóa khỏi cache khi user đổi: app không có
+    route sửa/xóa user (thay đổi chỉ đến từ ngoài app: mongo shell, restore_db.py) và cache
+    nằm riêng trong từng process, nên không có chỗ nào trong app để gọi hàm invalidate.
+    Độ cũ vì vậy bị chặn bởi AUTH_CACHE_TTL giây: user bị xóa hoặc đổi tên vẫn được chấp
+    nhận với danh tính cũ tối đa chừng đó. Cần hiệu lực ngay thì khởi động lại app sau khi
+    sửa users, hoặc đặt AUTH_CACHE_TTL=0 để tắt cache.
+    """
+
+    def __init__(self, max_size=1024, ttl=60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token):
+        with self._lock:
+            item = self._items.get(token)
+            if item and item[1] > time.monotonic():
+                self._items.move_to_end(token)
+                self.hits += 1
+                return item[0]
+            if item:
+                del self._items[token]
+            self.misses += 1
+            return None
+
+    def put(self, token, user):
+        with self._lock:
+            self._items[token] = (user, time.monotonic() + self.ttl)
+            self._items.move_to_end(token)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._items),
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0
+            }
+
+user_cache = UserCache()
+
+USER_PROJECTION = {"username": 1}
+
+def authenticate(auth_header, secret_key=None, trust_claims=False):
+    """
+    Phần không phụ thuộc framework của get_current_user (dùng chung với main_async.py).
+    Trả về (user, lookup): user lấy được từ cache hoặc claim; lookup = (token, user_id)
+    khi còn phải tra users, sau đó gọi remember_user với kết quả tra.
+    """
+    if not auth_header.startswith("Bearer "):
+        return None, None
+    token = auth_header.split(" ", 1)[1]
+    user = user_cache.get(token)
+    if user:
+        return user, None
+    payload = decode_token(token, secret_key)
     if not payload:
-        return None
-    user = users_collection.find_one({"_id": ObjectId(payload["user_id"])})
+        return None, None
+    if trust_claims:
+        user = {"_id": ObjectId(payload["user_id"]), "username": payload.get("username")}
+        user_cache.put(token, user)
+        return user, None
+    return None, (token, ObjectId(payload["user_id"]))
+
+def remember_user(lookup, user):
+    if user:
+        user_cache.put(lookup[0], user)
     return user
 
-def entry_to_json(entry):
+def get_current_user(users_collection):
+    """
+    Trả về danh tính user của request ({"_id", "username"}) hoặc None.
+    Nếu AUTH_TRUST_CLAIMS bật thì tin claim trong JWT đã ký, không truy vấn DB;
+    ngược lại kết quả tra users được cache theo token (AUTH_CACHE_TTL giây).
+    """
+    user, lookup = authenticate(request.headers.get("Authorization", ""), trust_claims=app.config.get("AUTH_TRUST_CLAIMS"))
+    if lookup is None:
+        return user
+    return remember_user(lookup, users_collection.find_one({"_id": lookup[1]}, USER_PROJECTION))
+
+ENTRY_FIELDS = ("date", "content", "emotions", "user_id")
+
+def parse_date_range(args):
+    """Đọc from/to (YYYY-MM-DD) từ query string. Trả về (điều kiện $gte/$lte, lỗi)."""
+    date_range = {}
+    for param, op in (("from", "$gte"), ("to", "$lte")):
+        value = args.get(param)
+        if value:
+            try:
+                datetime.datetime.strptime(value, "%Y-%m-%d")
+            except ValueError:
+                return None, f"'{param}' must be in YYYY-MM-DD format"
+            date_range[op] = value
+    return date_range, None
+
+def entry_to_json(entry, fields=None):
+    if fields is not None:
+        # Entry được lấy với projection: chỉ trả về các field đã chọn
+        result = {"_id": str(entry["_id"])}
+        for field in fields:
+            if field in entry:
+                result[field] = str(entry[field]) if field == "user_id" else entry[field]
+        return result
     return {
         "_id": str(entry["_id"]),
         "date": entry["date"],
@@ -41,15 +155,89 @@ def entry_to_json(entry):
         "user_id": str(entry["user_id"])
     }
 
+# Số document mỗi lần lấy từ cursor Mongo và kích thước chunk ghi ra khi stream
+STREAM_BATCH_SIZE = 500
+STREAM_CHUNK_BYTES = 64 * 1024
+
+def wants_ndjson(args, headers):
+    """Client yêu cầu stream NDJSON qua header Accept hoặc tham số stream=1."""
+    return args.get("stream") == "1" or "application/x-ndjson" in headers.get("Accept", "")
+
+def wants_stream():
+    return wants_ndjson(request.args, request.headers)
+
+class NdjsonChunks:
+    """
+    Serialize từng phần tử thành một dòng NDJSON và gom thành chunk khoảng
+    STREAM_CHUNK_BYTES, dùng chung cho stream đồng bộ (Flask) và bất đồng bộ (Quart).
+    """
+
+    def __init__(self):
+        self._buffer = []
+        self._size = 0
+        # Chỉ đo thời gian serialize, cộng dồn rồi ghi một lần khi stream kết thúc
+        self._serialize_seconds = 0.0
+
+    def add(self, item):
+        """Thêm một phần tử; trả về chunk khi đã đủ lớn, ngược lại None."""
+        started = time.perf_counter()
+        line = fast_json.dumps_bytes(item) + b"\n"
+        self._serialize_seconds += time.perf_counter() - started
+        self._buffer.append(line)
+        self._size += len(line)
+        if self._size < STREAM_CHUNK_BYTES:
+            return None
+        return self.take()
+
+    def take(self):
+        chunk = b"".join(self._buffer)
+        self._buffer = []
+        self._size = 0
+        return chunk
+
+    def close(self):
+        """Phần còn lại (có thể rỗng); ghi thời gian serialize của cả stream."""
+        observe_span("serialize", self._serialize_seconds)
+        return self.take()
+
+def ndjson_response(items):
+    """
+    Trả về response NDJSON (mỗi dòng một JSON) từ một iterable, serialize dần từng
+    phần tử nên bộ nhớ không tăng theo số lượng document.
+    """
+    def generate():
+        chunks = NdjsonChunks()
+        for item in items:
+            chunk = chunks.add(item)
+            if chunk:
+                yield chunk
+        chunk = chunks.close()
+        if chunk:
+            yield chunk
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+def encode_cursor(date, entry_id):
+    """Cursor phân trang theo (date, _id), dạng chuỗi an toàn cho URL."""
+    raw = f"{date}|{entry_id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+def decode_cursor(cursor):
+    try:
+        date, entry_id = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").split("|", 1)
+        return date, ObjectId(entry_id)
+    except Exception:
+        return None
+
+# Đổi khi đổi backend, model hoặc ngưỡng phân loại, để cache cảm xúc cũ bị bỏ qua
+CLASSIFIER_VERSION = get_engine().version
+
 def classify_sentiment(text):
-    blob = TextBlob(text)
-    polarity = blob.sentiment.polarity
-    if polarity > 0.1:
-        return "positive"
-    elif polarity < -0.1:
-        return "negative"
-    else:
-        return "neutral"
+    with span("classify"):
+        return get_engine().classify(text)
+
+def classify_sentiment_batch(texts):
+    with span("classify"):
+        return get_engine().classify_batch(texts)
 
 # Icon sets for each sentiment
 ICON_SETS = {